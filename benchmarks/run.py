@@ -0,0 +1,278 @@
+"""
+Benchmark từng công đoạn xử lý trên workbook tổng hợp (benchmarks/synth.py).
+
+    python -m benchmarks.run                         # in JSON kết quả ra stdout
+    python -m benchmarks.run --out bench.json        # ghi file
+    python -m benchmarks.run --save-baseline         # ghi đè benchmarks/baseline.json
+    python -m benchmarks.run --fail-on-regression    # exit 1 nếu chậm hơn baseline
+
+Chạy trong thư mục tạm (session/rule/job DB, output riêng) với LLM_OFFLINE=1 nên không gọi mạng.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+# Công đoạn nhanh hơn ngưỡng này (ms) chỉ so theo tỉ lệ sẽ toàn nhiễu
+NOISE_FLOOR_MS = 5.0
+
+_RULE = {
+    "start_keywords": ["sản phẩm"],
+    "end_keywords": [],
+    "label_keywords": {"chứa 'khu vực'": "Đơn hàng theo khu vực"},
+}
+
+
+def _isolate(workdir: str) -> None:
+    """Env + cwd cho benchmark; phải gọi TRƯỚC khi import module của repo (đọc env lúc import)."""
+    env = {
+        "LLM_OFFLINE": "1",
+        "LLM_CACHE_DISABLED": "1",
+        "OUTPUT_DIR": os.path.join(workdir, "output"),
+        "RULE_DB_PATH": os.path.join(workdir, "rule_memory.sqlite3"),
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.sqlite3"),
+        "ANALYSIS_WORKERS": "0",
+    }
+    for k, v in env.items():
+        os.environ.setdefault(k, v)
+    os.chdir(workdir)
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+
+
+def _timed(fn: Callable[[], Any], repeat: int, warmup: int, setup: Optional[Callable[[], Any]] = None):
+    """Chạy fn (warmup + repeat lần, setup không tính giờ) → (kết quả lần cuối, thống kê ms)."""
+    result = None
+    samples: List[float] = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        result = fn()
+        dt = (time.perf_counter() - t0) * 1000.0
+        if i >= warmup:
+            samples.append(dt)
+    return result, {
+        "runs": len(samples),
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+def _same_sections(found: List[Dict[str, Any]], truth: List[Dict[str, Any]]) -> bool:
+    key = lambda s: (int(s["header_row"]), int(s["start_row"]), int(s["end_row"]))
+    return [key(s) for s in found] == [key(s) for s in truth]
+
+
+def bench_format(fmt: str, path: str, truth: List[Dict[str, Any]], repeat: int, warmup: int) -> Dict[str, Any]:
+    from common.df_cache import df_cache
+    from controllers.extractor_controller import _read_df
+    from data_processing.section_detector import detect_sections_auto
+    from data_processing.rule_based_extractor import extract_sections_with_rule
+    from data_processing.validators import validate_sections_zero_based
+    from data_processing.analyzer import run_analysis
+    from data_processing.planner import build_report
+    from data_processing.exporter import save_report_excel
+
+    stages: Dict[str, Dict[str, Any]] = {}
+    sheet = "Data" if fmt != "csv" else None
+
+    df, stages["read"] = _timed(
+        lambda: _read_df(path, sheet_name=sheet), repeat, warmup, setup=lambda: df_cache.invalidate(path)
+    )
+    _, stages["read_cached"] = _timed(lambda: _read_df(path, sheet_name=sheet), repeat, warmup)
+
+    detected, stages["detect"] = _timed(lambda: detect_sections_auto(df), repeat, warmup)
+    by_rule, stages["extract_rule"] = _timed(lambda: extract_sections_with_rule(df, _RULE), repeat, warmup)
+
+    sections = validate_sections_zero_based(detected, nrows=df.shape[0])
+    analysis, stages["analysis"] = _timed(lambda: run_analysis(df, sections, params=None), repeat, warmup)
+    report, stages["report"] = _timed(lambda: build_report(analysis), repeat, warmup)
+    _, stages["export"] = _timed(
+        lambda: save_report_excel(report=report, session_id=f"bench_{fmt}"), repeat, warmup
+    )
+
+    checks = {
+        "shape": list(df.shape),
+        "detected_sections": len(detected),
+        "expected_sections": len(truth),
+        "detect_matches_truth": _same_sections(detected, truth),
+        "rule_sections": len(by_rule),
+        "analysis_sections": len(analysis.get("sections", [])),
+    }
+    return {"stages": stages, "checks": checks, "sections": sections}
+
+
+def bench_session_store(sections: List[Dict[str, Any]], repeat: int, warmup: int) -> Dict[str, Dict[str, Any]]:
+    from common.models import SessionData
+    from common.session_store import SessionStore, _cache_for
+
+    store = SessionStore(Path("bench_sessions.sqlite3"))
+    cache = _cache_for(store.db_path)
+    data = SessionData(
+        session_id="bench",
+        file_path="synth.xlsx",
+        user_id="bench_user",
+        auto_sections=sections,
+        fingerprint="0" * 32,
+    )
+    stages: Dict[str, Dict[str, Any]] = {}
+    _, stages["session_upsert"] = _timed(lambda: store.upsert(data), repeat, warmup)
+    _, stages["session_get"] = _timed(lambda: store.get("bench"), repeat, warmup)
+    _, stages["session_get_cold"] = _timed(lambda: store.get("bench"), repeat, warmup, setup=cache.clear)
+    _, stages["session_update"] = _timed(
+        lambda: store.update_fields("bench", confirmed_sections=sections, confirmed=True), repeat, warmup
+    )
+    return stages
+
+
+def compare(stages: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Công đoạn có median > baseline * (1 + tolerance) và chậm hơn quá NOISE_FLOOR_MS."""
+    out = []
+    for name, cur in stages.items():
+        base = (baseline.get("stages") or {}).get(name)
+        if not base:
+            continue
+        b, c = float(base["median_ms"]), float(cur["median_ms"])
+        if c > b * (1 + tolerance) and c - b > NOISE_FLOOR_MS:
+            out.append({
+                "stage": name,
+                "baseline_ms": b,
+                "median_ms": c,
+                "ratio": round(c / b, 3) if b else None,
+            })
+    return out
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="agent_bench_")
+    cwd = os.getcwd()
+    _isolate(workdir)
+    try:
+        return _run_in(workdir, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_in(workdir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    from benchmarks.synth import SynthSpec, generate
+
+    spec = SynthSpec(
+        rows=args.rows,
+        sections=args.sections,
+        blank_rows=args.blank_rows,
+        header_style=args.header_style,
+        seed=args.seed,
+    )
+    t0 = time.perf_counter()
+    gen = generate(spec, os.path.join(workdir, "data"), formats=args.formats)
+    gen_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+    truth = gen["sheet"].sections
+
+    stages: Dict[str, Dict[str, Any]] = {}
+    checks: Dict[str, Any] = {}
+    sections: List[Dict[str, Any]] = truth
+    for fmt, path in gen["files"].items():
+        res = bench_format(fmt, path, truth, args.repeat, args.warmup)
+        stages.update({f"{fmt}.{k}": v for k, v in res["stages"].items()})
+        checks[fmt] = res["checks"]
+        sections = res["sections"] or sections
+    stages.update(bench_session_store(sections, args.repeat, args.warmup))
+
+    params = {
+        "rows": spec.rows,
+        "sections": spec.sections,
+        "blank_rows": spec.blank_rows,
+        "header_style": spec.header_style,
+        "seed": spec.seed,
+        "formats": list(gen["files"]),
+    }
+    return {
+        "meta": {
+            "params": params,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "generate_ms": gen_ms,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": stages,
+        "checks": checks,
+    }
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    from benchmarks.synth import BLANK_PATTERNS, HEADER_STYLES
+
+    p = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.strip().splitlines()[0])
+    p.add_argument("--rows", type=int, default=20000, help="tổng số dòng dữ liệu")
+    p.add_argument("--sections", type=int, default=8)
+    p.add_argument("--blank-rows", choices=BLANK_PATTERNS, default="single")
+    p.add_argument("--header-style", choices=HEADER_STYLES, default="plain")
+    p.add_argument("--formats", nargs="+", choices=["xlsx", "csv"], default=["xlsx", "csv"])
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--warmup", type=int, default=1)
+    p.add_argument("--out", help="ghi JSON ra file (mặc định stdout)")
+    p.add_argument("--baseline", default=str(BASELINE_PATH))
+    p.add_argument("--tolerance", type=float, default=0.5, help="cho phép chậm hơn baseline bao nhiêu (0.5 = 50%%)")
+    p.add_argument("--save-baseline", action="store_true", help="ghi kết quả lần chạy này làm baseline")
+    p.add_argument("--fail-on-regression", action="store_true")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    baseline_path = Path(args.baseline).resolve()
+    out_path = Path(args.out).resolve() if args.out else None
+
+    result = run(args)
+
+    baseline = None
+    if not args.save_baseline and baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if baseline is None:
+        result["regressions"] = []
+    elif (baseline.get("meta") or {}).get("params") != result["meta"]["params"]:
+        # số liệu chỉ so được khi cùng kích thước/bố cục workbook
+        result["regressions"] = []
+        result["baseline_note"] = "baseline khác tham số workbook, bỏ qua so sánh"
+    else:
+        result["regressions"] = compare(result["stages"], baseline, args.tolerance)
+        result["baseline"] = {"path": str(baseline_path), "tolerance": args.tolerance}
+
+    # section phát hiện sai so với bố cục đã sinh cũng tính là hồi quy (nhanh mà sai thì vô nghĩa)
+    result["check_failures"] = [
+        f"{fmt}.detect_matches_truth" for fmt, c in result["checks"].items() if not c["detect_matches_truth"]
+    ]
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        baseline_path.write_text(text + "\n", encoding="utf-8")
+    if out_path:
+        out_path.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.fail_on_regression and (result["regressions"] or result["check_failures"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import csv
+import os
+import random
+
+# Sinh workbook tổng hợp nhiều section để benchmark, bố cục khớp với detect_sections_auto:
+# - header: >= 2 ô text (>= 2 ký tự), không có số
+# - dữ liệu: >= 2 ô khác rỗng mỗi dòng
+# - các section cách nhau bởi dòng trống hoàn toàn
+
+HEADER = ["Mã đơn", "Sản phẩm", "Khu vực", "Số lượng", "Đơn giá", "Thành tiền"]
+PRODUCTS = ["Bút bi", "Giấy A4", "Mực in", "Bìa hồ sơ", "Kẹp giấy", "Sổ tay"]
+REGIONS = ["Hà Nội", "Đà Nẵng", "TP.HCM", "Cần Thơ"]
+
+HEADER_STYLES = ("plain", "title")
+BLANK_PATTERNS = ("single", "double", "random")
+
+
+@dataclass
+class SynthSpec:
+    """
+    rows        : tổng số dòng dữ liệu (chia đều cho các section)
+    sections    : số section
+    blank_rows  : "single" | "double" | "random" (1-3 dòng trống giữa 2 section)
+    header_style: "plain" (header ở dòng đầu section) | "title" (1 dòng tiêu đề 1 ô phía trên header)
+    """
+    rows: int = 20000
+    sections: int = 8
+    blank_rows: str = "single"
+    header_style: str = "plain"
+    seed: int = 42
+
+    def __post_init__(self):
+        if self.sections < 1 or self.rows < self.sections:
+            raise ValueError("cần sections >= 1 và rows >= sections")
+        if self.blank_rows not in BLANK_PATTERNS:
+            raise ValueError(f"blank_rows phải thuộc {BLANK_PATTERNS}")
+        if self.header_style not in HEADER_STYLES:
+            raise ValueError(f"header_style phải thuộc {HEADER_STYLES}")
+
+
+@dataclass
+class SynthSheet:
+    """Các dòng của sheet (None = ô trống) + section đúng (0-based, end_row inclusive, như header=None)."""
+    rows: List[List[Any]]
+    sections: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _gap(spec: SynthSpec, rng: random.Random) -> int:
+    if spec.blank_rows == "double":
+        return 2
+    if spec.blank_rows == "random":
+        return rng.randint(1, 3)
+    return 1
+
+
+def build_sheet(spec: SynthSpec) -> SynthSheet:
+    rng = random.Random(spec.seed)
+    width = len(HEADER)
+    blank = [None] * width
+    rows: List[List[Any]] = []
+    sections: List[Dict[str, Any]] = []
+    per, extra = divmod(spec.rows, spec.sections)
+    order = 1
+
+    for k in range(spec.sections):
+        if k:
+            rows.extend(list(blank) for _ in range(_gap(spec, rng)))
+        if spec.header_style == "title":
+            rows.append([f"Bảng {k + 1}: đơn hàng"] + [None] * (width - 1))
+        header_row = len(rows)
+        rows.append(list(HEADER))
+        for _ in range(per + (1 if k < extra else 0)):
+            qty = rng.randint(1, 500)
+            price = round(rng.uniform(1.0, 250.0), 2)
+            rows.append([
+                f"DH{order:07d}",
+                rng.choice(PRODUCTS),
+                rng.choice(REGIONS),
+                qty,
+                price,
+                round(qty * price, 2),
+            ])
+            order += 1
+        sections.append({
+            "start_row": header_row + 1,
+            "end_row": len(rows) - 1,
+            "header_row": header_row,
+            "label": f"Section {k + 1}",
+        })
+    return SynthSheet(rows=rows, sections=sections)
+
+
+def write_xlsx(sheet: SynthSheet, path: str, sheet_name: str = "Data") -> str:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    for row in sheet.rows:
+        ws.append(row)
+    wb.save(path)
+    return path
+
+
+def write_csv(sheet: SynthSheet, path: str) -> str:
+    # Dòng trống ghi thành ",,,," (read_csv bỏ qua dòng rỗng thật → lệch chỉ số dòng)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        for row in sheet.rows:
+            w.writerow(["" if v is None else v for v in row])
+    return path
+
+
+def generate(spec: SynthSpec, out_dir: str, formats: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Ghi workbook theo từng định dạng → {"sheet": SynthSheet, "files": {"xlsx": path, "csv": path}}."""
+    os.makedirs(out_dir, exist_ok=True)
+    sheet = build_sheet(spec)
+    stem = f"synth_{spec.rows}r_{spec.sections}s_{spec.blank_rows}_{spec.header_style}"
+    files: Dict[str, str] = {}
+    for fmt in formats or ["xlsx", "csv"]:
+        path = os.path.join(out_dir, f"{stem}.{fmt}")
+        if fmt == "xlsx":
+            files[fmt] = write_xlsx(sheet, path)
+        elif fmt == "csv":
+            files[fmt] = write_csv(sheet, path)
+        else:
+            raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+    return {"sheet": sheet, "files": files}
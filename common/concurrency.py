@@ -0,0 +1,36 @@
+import asyncio, contextvars, os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+# Giới hạn song song theo loại tài nguyên (chỉnh qua ENV):
+# PARSE_WORKERS  : số luồng parse Excel/CSV + detect (CPU)
+# IO_WORKERS     : số luồng cho sqlite / ghi file
+# LLM_CONCURRENCY: số request LLM đồng thời
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+
+_pools: Dict[str, ThreadPoolExecutor] = {
+    "parse": ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse"),
+    "io": ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io"),
+}
+_llm_sem: Optional[asyncio.Semaphore] = None
+
+
+async def run_in_pool(kind: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Chạy hàm blocking trên pool `kind` ("parse" | "io") mà không chặn event loop.
+    Context (contextvars, vd endpoint của common/metrics) được copy sang luồng pool như asyncio.to_thread.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_pools[kind], partial(ctx.run, fn, *args, **kwargs))
+
+
+def llm_slot() -> asyncio.Semaphore:
+    """Semaphore giới hạn số lời gọi LLM async đồng thời (dùng: `async with llm_slot():`)."""
+    global _llm_sem
+    if _llm_sem is None:
+        _llm_sem = asyncio.Semaphore(LLM_CONCURRENCY)
+    return _llm_sem
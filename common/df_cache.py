@@ -0,0 +1,164 @@
+import os, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+from .metrics import stage
+from .sheet_snapshot import load_snapshot
+
+# Giới hạn bộ nhớ cho cache DataFrame (MB), dùng chung cho cả process
+DF_CACHE_MAX_MB = float(os.getenv("DF_CACHE_MAX_MB", "512"))
+
+
+def _nbytes(obj: Any) -> int:
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, dict):
+        return sum(_nbytes(v) for v in obj.values())
+    return 0
+
+
+class DataFrameCache:
+    """
+    Cache LRU cho DataFrame đã parse, giới hạn theo dung lượng.
+    Key = (đường dẫn tuyệt đối, mtime_ns, size, sheet, header) → file đổi là tự miss.
+    DataFrame trả về được dùng chung giữa các request: KHÔNG sửa tại chỗ.
+    """
+
+    def __init__(self, max_bytes: int = int(DF_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Tuple, Tuple[Any, int]]" = OrderedDict()
+        # key phụ → key chính (cùng 1 object, chỉ tính dung lượng 1 lần)
+        self._aliases: Dict[Tuple, Tuple] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(file_path: str, sheet_name: Hashable, header: Optional[int]) -> Tuple:
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size, sheet_name, header)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            target = self._aliases.get(key, key)
+            item = self._items.get(target)
+            if item is None:
+                # key chính đã bị evict → bỏ alias treo
+                self._aliases.pop(key, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(target)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Tuple, value: Any) -> None:
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._aliases.pop(key, None)
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._items:
+                _, (_, sz) = self._items.popitem(last=False)
+                self._bytes -= sz
+
+    def alias(self, key: Tuple, target: Tuple) -> None:
+        """Cho key trỏ tới entry đã có ở target (không nhân đôi dung lượng trong ngân sách)."""
+        with self._lock:
+            if target not in self._items or key == target:
+                return
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._aliases[key] = target
+
+    def get_or_load(self, key: Tuple, loader: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, file_path: Optional[str] = None) -> None:
+        path = os.path.abspath(file_path) if file_path else None
+        with self._lock:
+            for key in [k for k in self._items if path is None or k[0] == path]:
+                _, sz = self._items.pop(key)
+                self._bytes -= sz
+            for key in [k for k in self._aliases if path is None or k[0] == path]:
+                del self._aliases[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "aliases": len(self._aliases),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+df_cache = DataFrameCache()
+
+
+def _load_excel(file_path: str, sheet_name: Any, header: Optional[int]) -> Any:
+    # Ưu tiên snapshot tạo lúc /upload (chỉ có cho header=None) để bỏ qua parse XML
+    if header is None:
+        try:
+            snap = load_snapshot(file_path, sheet_name)
+        except Exception:
+            snap = None
+        if snap is not None:
+            return snap
+    return pd.read_excel(file_path, sheet_name=sheet_name, header=header)
+
+
+def _rows(obj: Any) -> int:
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.shape[0])
+    if isinstance(obj, dict):
+        return sum(_rows(v) for v in obj.values())
+    return 0
+
+
+def _parse(loader: Callable[[], Any]) -> Callable[[], Any]:
+    """Loader có đo công đoạn "parse" (chỉ chạy khi cache miss), size = số dòng."""
+    def run() -> Any:
+        with stage("parse") as rec:
+            out = loader()
+            rec["size"] = _rows(out)
+        return out
+    return run
+
+
+def read_table(file_path: str, sheet_name: Any = 0, header: Optional[int] = None) -> Any:
+    """
+    Đọc CSV/Excel qua cache dùng chung.
+    - CSV: bỏ qua sheet_name.
+    - Excel: tham số truyền thẳng cho pd.read_excel (sheet_name=None → dict các sheet);
+      header=None thì đọc từ snapshot nếu có.
+    """
+    ext = (file_path or "").lower().split(".")[-1]
+    if ext == "csv":
+        key = DataFrameCache.make_key(file_path, None, header)
+        return df_cache.get_or_load(key, _parse(lambda: pd.read_csv(file_path, header=header)))
+    key = DataFrameCache.make_key(file_path, sheet_name, header)
+    return df_cache.get_or_load(key, _parse(lambda: _load_excel(file_path, sheet_name, header)))
+
+
+def seed_sheets(file_path: str, frames: Dict[str, pd.DataFrame]) -> None:
+    """Nạp sẵn các sheet (header=None) vào cache theo tên sheet; key theo index là alias."""
+    for i, (name, df) in enumerate(frames.items()):
+        key = DataFrameCache.make_key(file_path, name, None)
+        df_cache.put(key, df)
+        df_cache.alias(DataFrameCache.make_key(file_path, i, None), key)
@@ -0,0 +1,367 @@
+import hashlib
+import importlib
+import json
+import multiprocessing as mp
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic_core import to_jsonable_python
+
+# Hàng đợi job nền (sqlite) cho các thao tác chậm (/confirm_sections, /final: gọi LLM, xuất file).
+# ENV:
+# JOB_DB_PATH  : file sqlite của hàng đợi (mặc định jobs.sqlite3)
+# JOB_WORKERS  : số process worker (mặc định 2)
+# JOB_POLL_MS  : chu kỳ worker kiểm tra job mới (mặc định 200)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_MS = int(os.getenv("JOB_POLL_MS", "200"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+# error của job bị hủy: dừng kịp trước bước ghi, hay chạy xong rồi mới thấy cờ hủy
+CANCELLED_CLEAN = "Đã hủy trước bước ghi: không có thay đổi nào được lưu."
+CANCELLED_LATE = "Đã hủy khi job đã ghi xong (session/rule/lịch sử vẫn giữ); chỉ bỏ kết quả."
+
+
+class JobCancelled(BaseException):
+    """
+    Ném từ check_cancelled() khi job đang chạy bị hủy.
+    Kế thừa BaseException (như asyncio.CancelledError) để các khối `except Exception` của handler không nuốt mất.
+    """
+
+
+def dedup_key(kind: str, payload: Dict[str, Any]) -> str:
+    raw = json.dumps([kind, to_jsonable_python(payload)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Hàng đợi job lưu trong sqlite, dùng được từ nhiều process.
+    - submit: trùng (kind, payload) với job đang queued/running → trả lại job cũ.
+    - claim: worker lấy job queued cũ nhất (BEGIN IMMEDIATE → không 2 worker lấy trùng).
+    - cancel: job queued bị hủy ngay; job running được đánh dấu, handler dừng ở check_cancelled() kế tiếp
+      (trước bước ghi), hoặc worker bỏ kết quả nếu job đã ghi xong.
+    Handler là đường dẫn "module:function" để process worker tự import.
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._conn() as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS jobs (
+                  id TEXT PRIMARY KEY,
+                  kind TEXT NOT NULL,
+                  handler TEXT NOT NULL,
+                  dedup_key TEXT NOT NULL,
+                  payload TEXT NOT NULL,
+                  status TEXT NOT NULL,
+                  cancel_requested INTEGER NOT NULL DEFAULT 0,
+                  result TEXT,
+                  error TEXT,
+                  worker_pid INTEGER,
+                  created_at REAL NOT NULL,
+                  started_at REAL,
+                  finished_at REAL
+                )
+                '''
+            )
+            con.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)')
+            con.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs(dedup_key) "
+                "WHERE status IN ('queued', 'running')"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.con = con
+        return con
+
+    def submit(self, kind: str, handler: str, payload: Dict[str, Any]) -> Tuple[str, bool]:
+        """Trả (job_id, deduped)."""
+        key = dedup_key(kind, payload)
+        con = self._conn()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            row = con.execute(
+                "SELECT id FROM jobs WHERE dedup_key=? AND status IN ('queued', 'running')", (key,)
+            ).fetchone()
+            if row:
+                con.execute('COMMIT')
+                return row[0], True
+            job_id = uuid.uuid4().hex
+            con.execute(
+                'INSERT INTO jobs(id, kind, handler, dedup_key, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, handler, key, json.dumps(to_jsonable_python(payload), ensure_ascii=False), QUEUED, time.time()),
+            )
+            con.execute('COMMIT')
+            return job_id, False
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+
+    def claim(self, pid: int) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """Lấy 1 job queued → running. Trả (job_id, handler, payload) hoặc None."""
+        con = self._conn()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            row = con.execute(
+                'SELECT id, handler, payload FROM jobs WHERE status=? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if not row:
+                con.execute('COMMIT')
+                return None
+            con.execute(
+                'UPDATE jobs SET status=?, worker_pid=?, started_at=? WHERE id=?', (RUNNING, pid, time.time(), row[0])
+            )
+            con.execute('COMMIT')
+            return row[0], row[1], json.loads(row[2])
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+
+    def finish(
+        self, job_id: str, result: Any = None, error: Optional[Dict[str, Any]] = None, stopped: bool = False
+    ) -> None:
+        """
+        Ghi kết quả bằng 1 câu UPDATE trong BEGIN IMMEDIATE: cancel() không chen được giữa lúc đọc cờ hủy
+        và lúc ghi trạng thái. Job có cancel_requested → cancelled (bỏ result); stopped=True nghĩa là
+        handler dừng ở check_cancelled(), chưa ghi gì.
+        """
+        cancel_error = {"type": "JobCancelled", "status_code": None, "detail": CANCELLED_CLEAN if stopped else CANCELLED_LATE}
+        con = self._conn()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            con.execute(
+                '''
+                UPDATE jobs SET
+                  status = CASE WHEN cancel_requested THEN ? ELSE ? END,
+                  result = CASE WHEN cancel_requested THEN NULL ELSE ? END,
+                  error = CASE WHEN cancel_requested THEN ? ELSE ? END,
+                  finished_at = ?
+                WHERE id = ?
+                ''',
+                (
+                    CANCELLED,
+                    FAILED if error is not None else DONE,
+                    None if result is None else json.dumps(to_jsonable_python(result, fallback=str), ensure_ascii=False),
+                    json.dumps(cancel_error, ensure_ascii=False),
+                    None if error is None else json.dumps(error, ensure_ascii=False),
+                    time.time(),
+                    job_id,
+                ),
+            )
+            con.execute('COMMIT')
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+
+    def cancel_requested(self, job_id: str) -> bool:
+        row = self._conn().execute('SELECT cancel_requested FROM jobs WHERE id=?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Trả trạng thái sau khi hủy (None nếu không có job)."""
+        con = self._conn()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            row = con.execute('SELECT status FROM jobs WHERE id=?', (job_id,)).fetchone()
+            if not row:
+                con.execute('COMMIT')
+                return None
+            status = row[0]
+            if status == QUEUED:
+                con.execute('UPDATE jobs SET status=?, finished_at=? WHERE id=?', (CANCELLED, time.time(), job_id))
+                status = CANCELLED
+            elif status == RUNNING:
+                con.execute('UPDATE jobs SET cancel_requested=1 WHERE id=?', (job_id,))
+            con.execute('COMMIT')
+            return status
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            'SELECT id, kind, status, cancel_requested, result, error, created_at, started_at, finished_at '
+            'FROM jobs WHERE id=?', (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "cancel_requested": bool(row[3]),
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": json.loads(row[5]) if row[5] else None,
+            "created_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8],
+        }
+
+    def has_pending(self) -> bool:
+        return self._conn().execute(
+            "SELECT 1 FROM jobs WHERE status IN ('queued', 'running') LIMIT 1"
+        ).fetchone() is not None
+
+    def requeue_orphans(
+        self, before_requeue: Optional[Callable[[str, str, Dict[str, Any]], None]] = None
+    ) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Job running của worker đã chết (restart server...) → queued lại. Trả [(job_id, kind, payload)].
+        before_requeue(job_id, kind, payload) chạy trong cùng transaction, trước UPDATE:
+        worker (kể cả ở process khác) chỉ claim được job sau khi trạng thái cũ đã được dọn.
+        """
+        con = self._conn()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            rows = con.execute('SELECT id, kind, payload, worker_pid FROM jobs WHERE status=?', (RUNNING,)).fetchall()
+            dead = [(r[0], r[1], json.loads(r[2])) for r in rows if not _pid_alive(r[3])]
+            if before_requeue is not None:
+                for job_id, kind, payload in dead:
+                    before_requeue(job_id, kind, payload)
+            if dead:
+                con.executemany(
+                    'UPDATE jobs SET status=?, worker_pid=NULL, started_at=NULL WHERE id=?', [(QUEUED, r[0]) for r in dead]
+                )
+            con.execute('COMMIT')
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+        return dead
+
+
+# Dọn trạng thái do job chết giữa chừng để lại (khóa trên session...), chạy trước khi job được queued lại
+# (trong transaction của requeue_orphans → chưa worker nào claim được job).
+# kind → hàm(payload); controller tự đăng ký lúc import.
+_requeue_hooks: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def on_requeue(kind: str, hook: Callable[[Dict[str, Any]], None]) -> None:
+    _requeue_hooks[kind] = hook
+
+
+def _run_requeue_hook(job_id: str, kind: str, payload: Dict[str, Any]) -> None:
+    hook = _requeue_hooks.get(kind)
+    if hook is None:
+        return
+    try:
+        hook(payload)
+    except Exception as e:
+        print(f"[WARN] Không dọn được trạng thái của job {job_id} ({kind}): {e}")
+
+
+def _recover_orphans(q: JobQueue) -> int:
+    return len(q.requeue_orphans(_run_requeue_hook))
+
+
+# Job đang chạy trong process worker này (mỗi worker chạy 1 job 1 lúc)
+_current: Optional[Tuple[JobQueue, str]] = None
+
+
+def check_cancelled() -> None:
+    """
+    Điểm hủy cho handler job nền: gọi ngay trước bước ghi (session, rule, lịch sử).
+    Job đã bị yêu cầu hủy → JobCancelled, handler dừng trước khi ghi. Ngoài job nền → không làm gì.
+    """
+    if _current is not None:
+        q, job_id = _current
+        if q.cancel_requested(job_id):
+            raise JobCancelled(job_id)
+
+
+def _resolve(handler: str) -> Callable[[Dict[str, Any]], Any]:
+    module, _, name = handler.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _error_of(e: Exception) -> Dict[str, Any]:
+    # HTTPException (fastapi) có status_code/detail → giữ nguyên để endpoint status trả lại
+    return {
+        "type": type(e).__name__,
+        "status_code": getattr(e, "status_code", None),
+        "detail": getattr(e, "detail", None) or str(e),
+    }
+
+
+def worker_loop(db_path: str, stop, poll_ms: int = JOB_POLL_MS) -> None:
+    global _current
+    q = JobQueue(db_path)
+    pid = os.getpid()
+    while not stop.is_set():
+        job = q.claim(pid)
+        if job is None:
+            stop.wait(poll_ms / 1000.0)
+            continue
+        job_id, handler, payload = job
+        _current = (q, job_id)
+        try:
+            result = _resolve(handler)(payload)
+        except JobCancelled:
+            q.finish(job_id, stopped=True)
+        except Exception as e:
+            q.finish(job_id, error=_error_of(e))
+        else:
+            q.finish(job_id, result=result)
+        finally:
+            _current = None
+
+
+class WorkerPool:
+    """Các process worker chạy worker_loop, khởi động lười khi có job đầu tiên."""
+
+    def __init__(self, db_path: str = JOB_DB_PATH, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self._ctx = mp.get_context("spawn")
+        self._stop = None
+        self._procs: List[mp.process.BaseProcess] = []
+        self._lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            self._procs = [p for p in self._procs if p.is_alive()]
+            if len(self._procs) >= self.workers:
+                return
+            if not self._procs:
+                _recover_orphans(JobQueue(self.db_path))
+                self._stop = self._ctx.Event()
+            for _ in range(self.workers - len(self._procs)):
+                p = self._ctx.Process(target=worker_loop, args=(self.db_path, self._stop), daemon=True)
+                p.start()
+                self._procs.append(p)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            if self._stop is not None:
+                self._stop.set()
+            for p in self._procs:
+                p.join(timeout)
+            self._procs = []
+
+
+job_queue = JobQueue()
+worker_pool = WorkerPool()
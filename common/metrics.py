@@ -0,0 +1,207 @@
+import bisect, contextvars, functools, os, threading, time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+# Đo thời gian + kích thước từng công đoạn trên đường nóng (parse, detect, rule, LLM, phân tích,
+# xuất file, sqlite), nhóm theo endpoint, xuất dạng histogram Prometheus ở /metrics.
+# Số liệu nằm trong RAM của từng process (job nền chạy process riêng → không gộp vào đây).
+# ENV:
+# METRICS_ENABLED : 1 = bật (mặc định), 0 = tắt (stage()/observe() thành no-op)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# giây
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# số dòng / byte / token
+SIZE_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# endpoint của request hiện tại ("POST /preview"); ngoài request → "background"
+_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_endpoint", default="background")
+
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus cho 1 bộ label."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # phần tử cuối = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _label_str(labels: Tuple[Tuple[str, str], ...]) -> str:
+    def esc(v: str) -> str:
+        return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return ",".join(f'{k}="{esc(str(v))}"' for k, v in labels)
+
+
+def _fmt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class MetricsRegistry:
+    """
+    Histogram + counter theo (tên metric, label), 1 lock cho cả registry.
+    render() → text exposition format 0.0.4 của Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}  # tên → (type, help)
+        self._hists: Dict[str, Dict[Tuple, Histogram]] = {}
+        self._bounds: Dict[str, Sequence[float]] = {}
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float]) -> None:
+        with self._lock:
+            self._meta.setdefault(name, ("histogram", help_text))
+            self._bounds.setdefault(name, tuple(buckets))
+            self._hists.setdefault(name, {})
+
+    def counter(self, name: str, help_text: str) -> None:
+        with self._lock:
+            self._meta.setdefault(name, ("counter", help_text))
+            self._counters.setdefault(name, {})
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._hists[name]
+            h = series.get(key)
+            if h is None:
+                h = series[key] = Histogram(self._bounds[name])
+            h.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0.0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            for series in self._hists.values():
+                series.clear()
+            for series in self._counters.values():
+                series.clear()
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for key, v in sorted(self._counters[name].items()):
+                        lines.append(f"{name}{{{_label_str(key)}}} {_fmt(v)}")
+                    continue
+                for key, h in sorted(self._hists[name].items()):
+                    base = _label_str(key)
+                    sep = "," if base else ""
+                    acc = 0
+                    for bound, c in zip(h.buckets, h.counts):
+                        acc += c
+                        lines.append(f'{name}_bucket{{{base}{sep}le="{_fmt(bound)}"}} {acc}')
+                    lines.append(f'{name}_bucket{{{base}{sep}le="+Inf"}} {h.count}')
+                    tail = f"{{{base}}}" if base else ""
+                    lines.append(f"{name}_sum{tail} {_fmt(h.sum)}")
+                    lines.append(f"{name}_count{tail} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.histogram("agent_request_duration_seconds", "Thời gian xử lý request theo endpoint.", DURATION_BUCKETS)
+registry.histogram("agent_stage_duration_seconds", "Thời gian từng công đoạn, theo endpoint.", DURATION_BUCKETS)
+registry.histogram("agent_stage_size", "Kích thước dữ liệu của công đoạn (dòng/byte/token).", SIZE_BUCKETS)
+registry.counter("agent_llm_tokens_total", "Token LLM theo endpoint/model/loại (prompt|completion).")
+registry.counter("agent_stage_errors_total", "Số lần công đoạn ném lỗi.")
+
+
+def current_endpoint() -> str:
+    return _endpoint.get()
+
+
+@contextmanager
+def endpoint_scope(endpoint: str) -> Iterator[None]:
+    """Gán endpoint cho mọi công đoạn đo trong khối (kể cả trong run_in_pool, vì context được copy)."""
+    token = _endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+def observe(stage_name: str, seconds: float, size: Optional[float] = None, endpoint: Optional[str] = None) -> None:
+    if not METRICS_ENABLED:
+        return
+    ep = endpoint or _endpoint.get()
+    registry.observe("agent_stage_duration_seconds", seconds, endpoint=ep, stage=stage_name)
+    if size is not None:
+        registry.observe("agent_stage_size", float(size), endpoint=ep, stage=stage_name)
+
+
+def observe_request(endpoint: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        registry.observe("agent_request_duration_seconds", seconds, endpoint=endpoint)
+
+
+def count_tokens(model: str, prompt: Optional[int], completion: Optional[int]) -> None:
+    if not METRICS_ENABLED:
+        return
+    ep = _endpoint.get()
+    if prompt:
+        registry.inc("agent_llm_tokens_total", prompt, endpoint=ep, model=model or "", kind="prompt")
+    if completion:
+        registry.inc("agent_llm_tokens_total", completion, endpoint=ep, model=model or "", kind="completion")
+
+
+@contextmanager
+def stage(stage_name: str, size: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Đo 1 công đoạn:
+        with stage("detect", size=len(df)):
+            ...
+        with stage("parse") as rec:
+            df = ...; rec["size"] = len(df)   # kích thước biết sau khi chạy
+    """
+    rec: Dict[str, Any] = {"size": size}
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except BaseException:
+        if METRICS_ENABLED:
+            registry.inc("agent_stage_errors_total", endpoint=_endpoint.get(), stage=stage_name)
+        raise
+    finally:
+        observe(stage_name, time.perf_counter() - t0, rec.get("size"))
+
+
+def timed(stage_name: str, size_of: Optional[Callable[[Any], Optional[float]]] = None):
+    """Decorator của stage(); size_of(kết quả) → kích thước (lỗi trong size_of bị bỏ qua)."""
+
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as rec:
+                out = fn(*args, **kwargs)
+                if size_of is not None:
+                    try:
+                        rec["size"] = size_of(out)
+                    except Exception:
+                        pass
+                return out
+
+        return wrapper
+
+    return deco
+
+
+def render() -> str:
+    return registry.render()
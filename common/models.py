@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from pydantic import BaseModel, Field
 
 class Section(BaseModel):
@@ -25,3 +25,9 @@ class SessionData(BaseModel):
     confirmed: Optional[bool] = False
     rule_version: Optional[str] = None
     fingerprint: Optional[str] = None
+    # rule /preview đã dùng: {"fingerprint", "user_id", "score"} (score < 1 = khớp gần đúng)
+    rule_match: Optional[Dict[str, Any]] = None
+
+    # Tín hiệu dòng đã nén của sheet đang preview (section_detector.pack_row_signals)
+    # + "source" = [file_path, sheet_name, header] để biết còn dùng lại được không
+    row_signals: Optional[Dict[str, Any]] = None
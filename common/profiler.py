@@ -0,0 +1,289 @@
+import functools, json, os, re, sys, threading, time, uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Profiler lấy mẫu call stack cho request chậm (tùy chọn, tắt mặc định).
+# 1 thread lấy mẫu sys._current_frames() mỗi PROFILE_INTERVAL_MS khi có request đang được profile;
+# mẫu lấy từ mọi thread đang bận (event loop + pool parse/io + threadpool của FastAPI),
+# nên khi nhiều request chạy song song, file profile có cả stack của request khác.
+# ENV:
+# PROFILE_REQUESTS    : 1 = bật middleware (0 = không đăng ký gì, không tốn gì)
+# PROFILE_SLOW_MS     : > 0 → profile mọi request, chỉ ghi file khi chạy lâu hơn ngưỡng (ms)
+# PROFILE_HEADER      : header bật profile cho riêng 1 request (mặc định X-Profile: 1), luôn ghi file
+# PROFILE_INTERVAL_MS : chu kỳ lấy mẫu (ms)
+# PROFILE_FORMAT      : speedscope (JSON, mở ở speedscope.app) | collapsed (flamegraph.pl, speedscope)
+# PROFILE_DIR         : thư mục ghi profile (+ index.jsonl)
+# PROFILE_MAX_FILES   : giữ tối đa N file, vượt thì xóa file cũ nhất
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+_MAX_DEPTH = 128
+_EXT = {"speedscope": ".speedscope.json", "collapsed": ".collapsed.txt"}
+# Lá của stack = thread đang chờ (pool rảnh, event loop select) → không tính là mẫu
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+_ROOT = os.path.abspath(os.getcwd())
+
+Frame = Tuple[str, str, int]  # (tên hàm, file rút gọn, dòng đầu hàm)
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(path: str) -> str:
+    if "site-packages" in path:
+        return path.split("site-packages", 1)[1].lstrip("/\\")
+    ap = os.path.abspath(path)
+    if ap.startswith(_ROOT + os.sep):
+        return os.path.relpath(ap, _ROOT)
+    return os.path.basename(path)
+
+
+def _stack_of(frame) -> Optional[Tuple[Frame, ...]]:
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+        return None
+    out: List[Frame] = []
+    while frame is not None and len(out) < _MAX_DEPTH:
+        code = frame.f_code
+        out.append((code.co_name, _short_path(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    out.reverse()
+    return tuple(out)
+
+
+class RequestProfile:
+    """Mẫu stack của 1 request: Counter[(tên thread, stack)] → số mẫu."""
+
+    def __init__(self, endpoint: str, forced: bool):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.endpoint = endpoint
+        self.forced = forced
+        self.started = time.time()
+        self.samples: Counter = Counter()
+        self.ticks = 0
+        self._lock = threading.Lock()
+
+    def add(self, stacks: List[Tuple[str, Tuple[Frame, ...]]]) -> None:
+        with self._lock:
+            self.ticks += 1
+            self.samples.update(stacks)
+
+
+class _Sampler:
+    """Thread lấy mẫu dùng chung; chỉ chạy vòng lấy mẫu khi có profile đang mở."""
+
+    def __init__(self, interval_ms: float):
+        self.interval = max(interval_ms, 0.5) / 1000.0
+        self._lock = threading.Lock()
+        self._active: Dict[str, RequestProfile] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._active[profile.id] = profile
+            self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._active.pop(profile.id, None)
+
+    def _snapshot(self) -> List[Tuple[str, Tuple[Frame, ...]]]:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        out = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = _stack_of(frame)
+            if stack:
+                out.append((names.get(ident, str(ident)), stack))
+        return out
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            with self._lock:
+                profiles = list(self._active.values())
+                if not profiles:
+                    self._wake.clear()
+                    continue
+            stacks = self._snapshot()
+            for p in profiles:
+                p.add(stacks)
+            time.sleep(self.interval)
+
+
+def _frame_name(f: Frame) -> str:
+    return f"{f[0]} ({f[1]}:{f[2]})"
+
+
+def collapsed(profile: RequestProfile) -> str:
+    """Định dạng "thread;frame;frame count" (Brendan Gregg), root → lá."""
+    lines = []
+    for (thread, stack), n in profile.samples.most_common():
+        names = [thread] + [_frame_name(f).replace(";", ",") for f in stack]
+        lines.append(f"{';'.join(names)} {n}")
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(profile: RequestProfile, duration_ms: float, interval_ms: float) -> Dict[str, Any]:
+    """File speedscope (https://www.speedscope.app/file-format-schema.json), 1 profile "sampled" / thread."""
+    frames: List[Dict[str, Any]] = []
+    index: Dict[Any, int] = {}
+
+    def frame_id(key, entry: Dict[str, Any]) -> int:
+        if key not in index:
+            index[key] = len(frames)
+            frames.append(entry)
+        return index[key]
+
+    by_thread: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+    for (thread, stack), n in profile.samples.items():
+        ids = [frame_id(("thread", thread), {"name": f"[{thread}]"})]
+        ids += [frame_id(f, {"name": f[0], "file": f[1], "line": f[2]}) for f in stack]
+        samples, weights = by_thread.setdefault(thread, ([], []))
+        samples.append(ids)
+        weights.append(n * interval_ms)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{profile.endpoint} {duration_ms:.0f}ms",
+        "exporter": "agent-request-profiler",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+            for thread, (samples, weights) in sorted(by_thread.items())
+        ],
+    }
+
+
+def _slug(endpoint: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", endpoint).strip("_")[:60] or "request"
+
+
+class ProfileStore:
+    """Ghi file profile + index.jsonl (metadata) trong PROFILE_DIR, giới hạn PROFILE_MAX_FILES."""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES, fmt: str = PROFILE_FORMAT):
+        if fmt not in _EXT:
+            raise ValueError(f"PROFILE_FORMAT phải thuộc {list(_EXT)}")
+        self.dir = directory
+        self.max_files = max_files
+        self.fmt = fmt
+        self._lock = threading.Lock()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.dir, "index.jsonl")
+
+    def save(self, profile: RequestProfile, duration_ms: float, status: Optional[int], interval_ms: float) -> Dict[str, Any]:
+        os.makedirs(self.dir, exist_ok=True)
+        name = f"{profile.id}_{_slug(profile.endpoint)}{_EXT[self.fmt]}"
+        if self.fmt == "speedscope":
+            body = json.dumps(speedscope(profile, duration_ms, interval_ms), ensure_ascii=False)
+        else:
+            body = collapsed(profile)
+        with open(os.path.join(self.dir, name), "w", encoding="utf-8") as f:
+            f.write(body)
+        meta = {
+            "name": name,
+            "id": profile.id,
+            "endpoint": profile.endpoint,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "samples": profile.ticks,
+            "interval_ms": interval_ms,
+            "forced": profile.forced,
+            "format": self.fmt,
+            "created_at": profile.started,
+        }
+        with self._lock:
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+            self._rotate()
+        return meta
+
+    def _read_index(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return [r for r in rows if os.path.exists(os.path.join(self.dir, r.get("name", "")))]
+
+    def _rotate(self) -> None:
+        rows = self._read_index()
+        cut = max(len(rows) - self.max_files, 0) if self.max_files > 0 else 0
+        drop, keep = rows[:cut], rows[cut:]
+        for r in drop:
+            try:
+                os.remove(os.path.join(self.dir, r["name"]))
+            except OSError:
+                pass
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in keep)
+        os.replace(tmp, self._index_path)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Mới nhất trước."""
+        with self._lock:
+            return list(reversed(self._read_index()))
+
+    def path_of(self, name: str) -> Optional[str]:
+        # chỉ trả file có trong index (không cho đọc đường dẫn tùy ý)
+        for r in self.list():
+            if r["name"] == name:
+                return os.path.join(self.dir, name)
+        return None
+
+
+profile_store = ProfileStore()
+_sampler: Optional[_Sampler] = None
+
+
+def wants_profile(headers) -> bool:
+    """Request có nên profile không: mọi request khi PROFILE_SLOW_MS > 0, hoặc có header debug."""
+    return PROFILE_SLOW_MS > 0 or headers.get(PROFILE_HEADER, "") not in ("", "0")
+
+
+def begin(endpoint: str, forced: bool) -> RequestProfile:
+    global _sampler
+    if _sampler is None:
+        _sampler = _Sampler(PROFILE_INTERVAL_MS)
+    profile = RequestProfile(endpoint, forced)
+    _sampler.start(profile)
+    return profile
+
+
+def end(profile: RequestProfile, duration_ms: float, status: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Dừng lấy mẫu; ghi file nếu request bị ép profile hoặc chậm hơn ngưỡng."""
+    _sampler.stop(profile)
+    slow = PROFILE_SLOW_MS > 0 and duration_ms >= PROFILE_SLOW_MS
+    if not (profile.forced or slow) or not profile.samples:
+        return None
+    try:
+        return profile_store.save(profile, duration_ms, status, PROFILE_INTERVAL_MS)
+    except Exception as e:
+        print(f"[WARN] Không ghi được profile {profile.id}: {e}")
+        return None
@@ -1,82 +1,185 @@
-import json, sqlite3, time
+import json, os, sqlite3, threading, time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from datetime import datetime
+from pydantic_core import to_jsonable_python
+from .metrics import timed
 from .models import SessionData
 
 DB_PATH = Path('./session_store.sqlite3')
+# Số session "nóng" giữ trong RAM (mỗi file DB 1 cache dùng chung cho mọi SessionStore)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "256"))
+
+
+class _SessionCache:
+    """LRU {session_id: (version, SessionData)}; version lấy từ cột sessions.version."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Tuple[int, SessionData]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Tuple[int, SessionData]]:
+        with self._lock:
+            item = self._items.get(session_id)
+            if item is not None:
+                self._items.move_to_end(session_id)
+            return item
+
+    def put(self, session_id: str, version: int, data: SessionData) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[session_id] = (version, data)
+            self._items.move_to_end(session_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def pop(self, session_id: str) -> None:
+        with self._lock:
+            self._items.pop(session_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_caches: Dict[str, _SessionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _cache_for(db_path: Path) -> _SessionCache:
+    key = str(Path(db_path).resolve())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = _SessionCache(SESSION_CACHE_SIZE)
+        return _caches[key]
+
 
 class SessionStore:
+    """
+    - Mỗi thread giữ 1 connection (WAL, synchronous=NORMAL) thay vì connect mỗi lần gọi.
+    - get() đọc qua cache: chỉ parse JSON khi version trong DB khác bản cache
+      (an toàn khi chạy nhiều worker process).
+    - update_fields() sửa từng field bằng json_set, không ghi lại cả blob.
+    Đối tượng trả về là bản sao, sửa thoải mái rồi upsert().
+    """
+
     def __init__(self, db_path: Path = DB_PATH):
         self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._cache = _cache_for(self.db_path)
         self._init()
 
+    def _conn(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.con = con
+        return con
+
     def _init(self):
-        con = sqlite3.connect(self.db_path)
-        try:
-            con.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS sessions (
-                  session_id TEXT PRIMARY KEY,
-                  json TEXT NOT NULL,
-                  updated_at INTEGER NOT NULL
-                )
-                '''
+        con = self._conn()
+        con.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS sessions (
+              session_id TEXT PRIMARY KEY,
+              json TEXT NOT NULL,
+              updated_at INTEGER NOT NULL
             )
-            con.commit()
-        finally:
-            con.close()
+            '''
+        )
+        cols = {r[1] for r in con.execute('PRAGMA table_info(sessions)')}
+        if 'version' not in cols:
+            con.execute('ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        con.commit()
+
+    def _write(self, sql: str, params: tuple, session_id: str) -> Optional[int]:
+        con = self._conn()
+        with con:
+            cur = con.execute(sql, params)
+            if cur.rowcount == 0:
+                return None
+            row = con.execute('SELECT version FROM sessions WHERE session_id=?', (session_id,)).fetchone()
+        return int(row[0]) if row else None
 
+    @timed("sqlite.session_upsert")
     def upsert(self, data: SessionData) -> None:
         js = data.model_dump(mode="json")
         js["updated_at"] = datetime.utcnow().isoformat()
 
-        con = sqlite3.connect(self.db_path)
-        try:
-            con.execute(
-                "REPLACE INTO sessions(session_id, json, updated_at) VALUES (?, ?, ?)",
-                (data.session_id, json.dumps(js, ensure_ascii=False), int(time.time()))
-            )
-            con.commit()
-        finally:
-            con.close()
-
+        version = self._write(
+            '''
+            INSERT INTO sessions(session_id, json, updated_at, version) VALUES (?, ?, ?, 1)
+            ON CONFLICT(session_id) DO UPDATE SET
+              json=excluded.json, updated_at=excluded.updated_at, version=sessions.version + 1
+            ''',
+            (data.session_id, json.dumps(js, ensure_ascii=False), int(time.time())),
+            data.session_id,
+        )
+        if version is not None:
+            self._cache.put(data.session_id, version, data.model_copy(deep=True))
 
+    @timed("sqlite.session_get")
     def get(self, session_id: str) -> Optional[SessionData]:
-        con = sqlite3.connect(self.db_path)
-        try:
-            cur = con.execute('SELECT json FROM sessions WHERE session_id=?', (session_id,))
-            row = cur.fetchone()
-            if not row:
-                return None
-            js = json.loads(row[0])
-            return SessionData(**js)
-        finally:
-            con.close()
+        cached = self._cache.get(session_id)
+        cached_version = cached[0] if cached else -1
+        row = self._conn().execute(
+            'SELECT version, CASE WHEN version = ? THEN NULL ELSE json END FROM sessions WHERE session_id=?',
+            (cached_version, session_id),
+        ).fetchone()
+        if not row:
+            self._cache.pop(session_id)
+            return None
+        version, raw = int(row[0]), row[1]
+        if raw is None and cached:
+            return cached[1].model_copy(deep=True)
+        data = SessionData(**json.loads(raw))
+        self._cache.put(session_id, version, data.model_copy(deep=True))
+        return data
 
+    @timed("sqlite.session_update")
     def update_fields(self, session_id: str, **fields):
-        data = self.get(session_id)
-        if not data:
+        unknown = [k for k in fields if k not in SessionData.model_fields]
+        if unknown:
+            raise ValueError(f"Field không hợp lệ: {unknown}")
+        if not fields:
+            return self.get(session_id)
+
+        paths = ", ".join(f"'$.{k}', json(?)" for k in fields)
+        values = tuple(json.dumps(to_jsonable_python(v), ensure_ascii=False) for v in fields.values())
+        version = self._write(
+            f'UPDATE sessions SET json = json_set(json, {paths}), updated_at = ?, version = version + 1 '
+            'WHERE session_id=?',
+            values + (int(time.time()), session_id),
+            session_id,
+        )
+        if version is None:
+            self._cache.pop(session_id)
             return None
-        for k, v in fields.items():
-            setattr(data, k, v)
-        self.upsert(data)
-        return data
+
+        cached = self._cache.get(session_id)
+        if cached and cached[0] == version - 1:
+            data = cached[1].model_copy(deep=True)
+            for k, v in fields.items():
+                setattr(data, k, v)
+            self._cache.put(session_id, version, data.model_copy(deep=True))
+            return data
+        return self.get(session_id)
 
     def delete(self, session_id: str) -> None:
-        con = sqlite3.connect(self.db_path)
-        try:
+        con = self._conn()
+        with con:
             con.execute('DELETE FROM sessions WHERE session_id=?', (session_id,))
-            con.commit()
-        finally:
-            con.close()
+        self._cache.pop(session_id)
 
     def cleanup(self, ttl_hours: int = 24):
         now = int(time.time())
         cutoff = now - ttl_hours * 3600
-        con = sqlite3.connect(self.db_path)
-        try:
+        con = self._conn()
+        with con:
             con.execute('DELETE FROM sessions WHERE updated_at < ?', (cutoff,))
-            con.commit()
-        finally:
-            con.close()
\ No newline at end of file
+        self._cache.clear()
@@ -0,0 +1,168 @@
+import os, json, pickle
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# Snapshot lưu cạnh file upload: uploaded_files/<sid>.xlsx -> uploaded_files/<sid>.xlsx.snapshot/
+SNAPSHOT_SUFFIX = ".snapshot"
+MANIFEST = "manifest.json"
+# Bố cục mỗi sheet: sheet_<i>/meta.pkl (index, columns, loại từng cột),
+# c<j>.npy cho cột số/bool/datetime (đọc bằng memory-map), objects.pkl cho các cột object còn lại.
+# Đọc header=None nên cột nào có ô tiêu đề chữ cũng là object → phần lớn cột của sheet Excel
+# nằm trong objects.pkl (không map được); chỉ cột thuần số/ngày (bảng không tiêu đề...) được mmap.
+LAYOUT = "columnar-v1"
+# dtype numpy ghi được ra .npy và đọc lại bằng np.load(mmap_mode=...)
+_MMAP_KINDS = "biufcmM"
+
+
+def snapshot_dir(file_path: str) -> str:
+    return f"{file_path}{SNAPSHOT_SUFFIX}"
+
+
+def _source_stat(file_path: str) -> Dict[str, int]:
+    st = os.stat(file_path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _replace_with(path: str, write) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _is_mmappable(s: pd.Series) -> bool:
+    return isinstance(s.dtype, np.dtype) and s.dtype.kind in _MMAP_KINDS
+
+
+def _write_sheet(d: str, df: pd.DataFrame) -> None:
+    os.makedirs(d, exist_ok=True)
+    kinds: List[str] = []
+    objects: Dict[int, pd.Series] = {}
+    for j in range(df.shape[1]):
+        col = df.iloc[:, j]
+        if _is_mmappable(col):
+            arr = np.ascontiguousarray(col.to_numpy())
+            _replace_with(os.path.join(d, f"c{j}.npy"), lambda f: np.save(f, arr, allow_pickle=False))
+            kinds.append("npy")
+        else:
+            objects[j] = col.reset_index(drop=True)
+            kinds.append("obj")
+    if objects:
+        obj_df = pd.DataFrame(objects)
+        _replace_with(os.path.join(d, "objects.pkl"), lambda f: pickle.dump(obj_df, f, protocol=pickle.HIGHEST_PROTOCOL))
+    meta = {"index": df.index, "columns": df.columns, "kinds": kinds}
+    _replace_with(os.path.join(d, "meta.pkl"), lambda f: pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _read_sheet(d: str) -> pd.DataFrame:
+    """
+    Ghép lại DataFrame từ thư mục sheet. Cột .npy mở bằng mmap_mode="c" (copy-on-write):
+    không copy lúc đọc, các process đọc cùng snapshot dùng chung page cache,
+    lỡ có ghi thì chỉ ghi vào bản riêng trong RAM chứ không vào file.
+    """
+    with open(os.path.join(d, "meta.pkl"), "rb") as f:
+        meta = pickle.load(f)
+    objects = None
+    if "obj" in meta["kinds"]:
+        with open(os.path.join(d, "objects.pkl"), "rb") as f:
+            objects = pickle.load(f)
+    cols: Dict[int, Any] = {}
+    for j, kind in enumerate(meta["kinds"]):
+        if kind == "npy":
+            # np.asarray: view ndarray thường trên vùng map (pandas không cần lớp np.memmap)
+            cols[j] = np.asarray(np.load(os.path.join(d, f"c{j}.npy"), mmap_mode="c"))
+        else:
+            cols[j] = objects[j]
+    df = pd.DataFrame(cols, copy=False) if cols else pd.DataFrame(index=range(len(meta["index"])))
+    df.index = meta["index"]
+    df.columns = meta["columns"]
+    return df
+
+
+def write_snapshot(file_path: str) -> Dict[str, pd.DataFrame]:
+    """
+    Parse toàn bộ sheet (header=None) đúng 1 lần và ghi mỗi sheet ra 1 thư mục dạng cột
+    (xem LAYOUT). Manifest ghi sau cùng → snapshot dở dang sẽ bị bỏ qua khi đọc.
+    Trả về {sheet_name: DataFrame} để caller nạp sẵn vào cache.
+    """
+    frames: Dict[str, pd.DataFrame] = pd.read_excel(file_path, sheet_name=None, header=None)
+    d = snapshot_dir(file_path)
+    os.makedirs(d, exist_ok=True)
+
+    sheets: List[str] = []
+    for i, (name, df) in enumerate(frames.items()):
+        _write_sheet(os.path.join(d, f"sheet_{i}"), df)
+        sheets.append(str(name))
+
+    # ncols: độ rộng từng sheet (cho fingerprint, không phải nạp cả sheet)
+    ncols = [int(df.shape[1]) for df in frames.values()]
+    manifest = {
+        "source": _source_stat(file_path), "header": None, "layout": LAYOUT,
+        "sheets": sheets, "ncols": ncols,
+    }
+    tmp = os.path.join(d, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(d, MANIFEST))
+    return frames
+
+
+def _load_manifest(file_path: str) -> Optional[Dict[str, Any]]:
+    p = os.path.join(snapshot_dir(file_path), MANIFEST)
+    if not os.path.exists(p):
+        return None
+    try:
+        with open(p, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except Exception:
+        return None
+    # File gốc bị ghi đè sau khi snapshot → snapshot hết hiệu lực
+    if manifest.get("source") != _source_stat(file_path):
+        return None
+    return manifest
+
+
+def snapshot_sheet_names(file_path: str) -> Optional[List[str]]:
+    manifest = _load_manifest(file_path)
+    return list(manifest["sheets"]) if manifest else None
+
+
+def _sheet_index(manifest: Dict[str, Any], sheet_name: Union[int, str]) -> Optional[int]:
+    sheets: List[str] = manifest["sheets"]
+    if isinstance(sheet_name, int):
+        return sheet_name if 0 <= sheet_name < len(sheets) else None
+    return sheets.index(sheet_name) if sheet_name in sheets else None
+
+
+def snapshot_ncols(file_path: str, sheet_name: Union[int, str] = 0) -> Optional[int]:
+    """Số cột của sheet theo manifest (None nếu không có snapshot hợp lệ / không thấy sheet)."""
+    manifest = _load_manifest(file_path)
+    if not manifest:
+        return None
+    idx = _sheet_index(manifest, sheet_name)
+    return int(manifest["ncols"][idx]) if idx is not None else None
+
+
+def load_snapshot(
+    file_path: str, sheet_name: Union[int, str, None] = 0
+) -> Union[pd.DataFrame, Dict[str, pd.DataFrame], None]:
+    """
+    Đọc sheet từ snapshot (tương đương pd.read_excel(..., header=None)).
+    sheet_name: index, tên sheet, hoặc None (→ dict mọi sheet như pandas).
+    Trả None nếu không có snapshot hợp lệ / không thấy sheet.
+    """
+    manifest = _load_manifest(file_path)
+    if not manifest:
+        return None
+    sheets: List[str] = manifest["sheets"]
+    d = snapshot_dir(file_path)
+
+    if sheet_name is None:
+        return {name: _read_sheet(os.path.join(d, f"sheet_{i}")) for i, name in enumerate(sheets)}
+
+    idx = _sheet_index(manifest, sheet_name)
+    if idx is None:
+        return None
+    return _read_sheet(os.path.join(d, f"sheet_{idx}"))
@@ -0,0 +1,94 @@
+import hashlib, os, uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from common.concurrency import run_in_pool
+
+# File upload lưu theo nội dung: uploaded_files/blobs/<sha256><ext>
+# → upload lại đúng file cũ (báo cáo tháng gửi lại) không tốn thêm đĩa, không parse lại.
+# ENV:
+# UPLOAD_MAX_MB   : dung lượng tối đa 1 file (mặc định 200)
+# UPLOAD_CHUNK_KB : kích thước mỗi lần đọc/ghi (mặc định 1024)
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "200"))
+UPLOAD_CHUNK_KB = int(os.getenv("UPLOAD_CHUNK_KB", "1024"))
+UPLOAD_MAX_BYTES = UPLOAD_MAX_MB * 1024 * 1024
+CHUNK_SIZE = UPLOAD_CHUNK_KB * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int = UPLOAD_MAX_BYTES):
+        super().__init__(f"File vượt quá giới hạn {limit // (1024 * 1024)} MB")
+        self.limit = limit
+
+
+def check_declared_size(content_length: Optional[str], limit: int = UPLOAD_MAX_BYTES) -> None:
+    """Từ chối sớm theo Content-Length (chưa đọc byte nào của body)."""
+    try:
+        size = int(content_length) if content_length else None
+    except ValueError:
+        size = None
+    if size is not None and size > limit:
+        raise UploadTooLarge(limit)
+
+
+def _open(path: str):
+    return open(path, "wb")
+
+
+def _commit(tmp_path: str, blob_path: str) -> bool:
+    """Đưa file tạm vào kho blob. Trả True nếu blob đã có sẵn (bỏ file tạm)."""
+    if os.path.exists(blob_path):
+        os.remove(tmp_path)
+        return True
+    os.replace(tmp_path, blob_path)
+    return False
+
+
+def _discard(f, tmp_path: str) -> None:
+    f.close()
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+async def save_stream(
+    chunks: AsyncIterator[bytes],
+    ext: str,
+    upload_dir: str,
+    limit: int = UPLOAD_MAX_BYTES,
+) -> Tuple[str, str, int, bool]:
+    """
+    Ghi luồng byte ra đĩa theo từng chunk, vừa ghi vừa tính sha256, dừng ngay khi vượt `limit`.
+    Trả (blob_path, sha256, size, deduped).
+    """
+    blob_dir = os.path.join(upload_dir, "blobs")
+    os.makedirs(blob_dir, exist_ok=True)
+    tmp_path = os.path.join(blob_dir, f".tmp-{uuid.uuid4().hex}{ext}")
+    h = hashlib.sha256()
+    size = 0
+    f = await run_in_pool("io", _open, tmp_path)
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > limit:
+                raise UploadTooLarge(limit)
+            h.update(chunk)
+            await run_in_pool("io", f.write, chunk)
+        await run_in_pool("io", f.close)
+    except BaseException:
+        await run_in_pool("io", _discard, f, tmp_path)
+        raise
+
+    digest = h.hexdigest()
+    blob_path = os.path.join(blob_dir, f"{digest}{ext}")
+    deduped = await run_in_pool("io", _commit, tmp_path, blob_path)
+    return blob_path, digest, size, deduped
+
+
+async def iter_upload_file(file, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Đọc UploadFile (multipart) theo chunk."""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
@@ -1,33 +1,24 @@
 # controllers/chat_controller.py
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
-import pandas as pd
+from typing import Dict, Any, List, Optional, Tuple
 
 from common.session_store import SessionStore
 from common.models import Section
 from data_processing.chat_memory import memory
-from services.intent_llm import parse_intent_llm 
+from services.intent_llm import parse_intent_async
+from common.concurrency import run_in_pool
 
 
 from data_processing.rule_learning_from_chat import upsert_candidate
-from data_processing.rule_memory import get_fingerprint
+from data_processing.rule_memory import file_fingerprint
+from data_processing.section_detector import unpack_row_signals, sections_in_window
 
 router = APIRouter()
 store = SessionStore()
 
 
 
-def _read_df(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
-    ext = (file_path or "").lower().split(".")[-1]
-    if ext == "csv":
-        return pd.read_csv(file_path)
-    try:
-        return pd.read_excel(file_path, sheet_name=sheet_name, header=None)
-
-    except TypeError:
-        return pd.read_excel(file_path)
-
 def _idx_from_sid(sid: str) -> int:
     """ 'S1' -> 0 ; 's2' -> 1 ; '1' -> 0 """
     if isinstance(sid, int):
@@ -110,6 +101,59 @@ def _set_group_by(sections: List[Section], sid: str, col: str) -> List[Section]:
             sections[idx].group_by = col
     return sections
 
+def _fingerprint_of(file_path: str, sheet_name: Optional[str]) -> Optional[str]:
+    """Chỉ dùng khi session chưa có fingerprint (chưa /preview): đọc vài dòng đầu sheet."""
+    ext = (file_path or "").lower().split(".")[-1]
+    try:
+        if ext == "csv":
+            return file_fingerprint(file_path, header=None)
+        return file_fingerprint(file_path, sheet_name or 0, header=None)
+    except Exception:
+        return None
+
+def _record_candidate(fp: Optional[str], user_id: str,
+                      operations: List[Dict[str, Any]], confidence: float) -> None:
+    if not fp:
+        return
+    try:
+        patch_spec = {
+            "intent": "edit_sections",
+            "operations": operations
+        }
+        upsert_candidate(user_id, fp, patch_spec, confidence)
+    except Exception:
+        pass
+
+def _span(s: Section) -> Tuple[int, int, int]:
+    return (int(s.header_row), int(s.start_row), int(s.end_row))
+
+def _window_check(row_signals: Optional[Dict[str, Any]], before: List[Tuple[int, int, int]],
+                  after: List[Section]) -> Optional[Dict[str, Any]]:
+    """
+    Autodetect lại CHỈ trên vùng dòng mà lệnh chat vừa đổi (dùng tín hiệu dòng lưu từ /preview,
+    không đọc lại file). Trả {"rows": [lo, hi], "detected": [...], "split": [sid...]} hoặc None.
+    split = các section vừa sửa mà bên trong autodetect thấy nhiều hơn 1 bảng.
+    """
+    if not row_signals:
+        return None
+    changed_new = [(k, sp) for k, sp in enumerate(map(_span, after)) if sp not in before]
+    changed_old = [sp for sp in before if sp not in set(map(_span, after))]
+    spans = [sp for _, sp in changed_new] + changed_old
+    if not spans:
+        return None
+    lo = min(min(h, st) for h, st, _ in spans)
+    hi = max(e for _, _, e in spans)
+    try:
+        lo, hi, detected = sections_in_window(unpack_row_signals(row_signals), lo, hi)
+    except Exception:
+        return None
+    split = []
+    for k, (h, st, e) in changed_new:
+        inside = [d for d in detected if d["start_row"] <= e and d["end_row"] >= st]
+        if len(inside) > 1:
+            split.append(f"S{k + 1}")
+    return {"rows": [lo, hi], "detected": detected, "split": split}
+
 class ChatRequest(BaseModel):
     session_id: str
     message: str
@@ -125,21 +169,22 @@ class ChatResponse(BaseModel):
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest):
-    data = store.get(req.session_id)
+    data = await run_in_pool("io", store.get, req.session_id)
     if not data:
         raise HTTPException(status_code=404, detail="Session không tồn tại")
     user_id = getattr(data, "user_id", None) or "anonymous"
 
     
-    memory.add_record(user_id, {"role": "user", "session_id": req.session_id, "content": req.message})
+    await run_in_pool("io", memory.add_record, user_id, {"role": "user", "session_id": req.session_id, "content": req.message})
 
    
-    parsed = parse_intent_llm(req.message)  
+    parsed = await parse_intent_async(req.message)  
     intent: str = parsed.get("intent", "unknown")
     args: Dict[str, Any] = parsed.get("arguments", {}) or {}
     confidence: float = float(parsed.get("confidence", 0.75))
 
     sections: List[Section] = getattr(data, "auto_sections", []) or []
+    spans_before = [_span(s) for s in sections]
     reply = ""
 
     
@@ -216,22 +261,20 @@ async def chat(req: ChatRequest):
     else:
         reply = "Mình chưa hiểu yêu cầu này. Bạn thử nói ngắn gọn, ví dụ: 'gộp 1 và 2', 'S1 từ 10 đến 32', 'đặt header 7'."
 
-    
+    window = _window_check(getattr(data, "row_signals", None), spans_before, sections)
+    if window and window["split"]:
+        reply += f" Lưu ý: {', '.join(window['split'])} có vẻ chứa nhiều bảng (dòng trống/header ở giữa)."
+
+    # fingerprint lấy từ session (do /preview lưu), chỉ đọc file khi session chưa có
+    if operations and not getattr(data, "fingerprint", None):
+        data.fingerprint = await run_in_pool("parse", _fingerprint_of, data.file_path, req.sheet_name)
+
     data.auto_sections = sections
-    store.upsert(data)
+    await run_in_pool("io", store.upsert, data)
 
     
-    try:
-        df = _read_df(data.file_path, sheet_name=req.sheet_name)
-        fp = get_fingerprint(df)
-        patch_spec = {
-            "intent": "edit_sections",
-            "operations": operations
-        }
-        if operations:
-            upsert_candidate(user_id, fp, patch_spec, confidence)
-    except Exception:
-        pass
+    if operations:
+        await run_in_pool("io", _record_candidate, data.fingerprint, user_id, operations, confidence)
 
     
     preview = {
@@ -239,9 +282,11 @@ async def chat(req: ChatRequest):
         "index_base": "zero", 
         "auto_sections": [s.model_dump() for s in sections]
     }
+    if window:
+        preview["window"] = window
 
     
-    memory.add_record(user_id, {
+    await run_in_pool("io", memory.add_record, user_id, {
         "role": "assistant",
         "session_id": req.session_id,
         "intent": intent,
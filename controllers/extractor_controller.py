@@ -1,18 +1,29 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException , Query , Body
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException , Query , Body, Request
 from typing import Optional, List, Dict, Tuple , Any
-import os, shutil, uuid
+import os, uuid
+import asyncio
 import pandas as pd
 import time
-import glob
 import json
 
-from data_processing.section_detector import detect_sections_auto
-from data_processing.rule_memory import get_rule_for_fingerprint, get_fingerprint
+from data_processing.section_detector import (
+    compute_row_signals, sections_from_signals, pack_row_signals, unpack_row_signals,
+)
+from data_processing.stream_loader import should_stream, scan_sheet, sheet_names as stream_sheet_names
+from data_processing.rule_memory import fingerprint_candidates, sheet_signature, rule_store, _safe_user_id
+from data_processing.rule_index import rule_index, FUZZY_RULE_MATCH
 from data_processing.rule_based_extractor import extract_sections_with_rule
 from data_processing.chat_memory import memory
 from .rules_controller import _load_rules, _key , _save_rules
 # Session & models & validate
 from common.session_store import SessionStore
+from common.df_cache import read_table, seed_sheets
+from common.sheet_snapshot import write_snapshot, snapshot_sheet_names
+from common.upload_store import (
+    save_stream, iter_upload_file, check_declared_size, UploadTooLarge, UPLOAD_MAX_BYTES,
+)
+from common.concurrency import run_in_pool
+from common.metrics import stage, timed
 from common.models import SessionData, Section
 from data_processing.validators import to_zero_based, validate_sections_zero_based, IndexErrorDetail
 
@@ -23,39 +34,29 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(RULE_DIR, exist_ok=True)
 
 store = SessionStore()
+_MULTIPART_OVERHEAD = 64 * 1024  # boundary + header của multipart
 
 
 def _read_df(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
 
     """
-    Luôn trả về đúng 1 DataFrame.
+    Luôn trả về đúng 1 DataFrame (đọc qua cache dùng chung, không sửa tại chỗ).
     - CSV -> DataFrame
     - Excel:
         + Nếu sheet_name truyền vào: đọc đúng sheet đó.
         + Nếu không truyền: đọc sheet đầu tiên (index 0).
     """
-    resolved_sheet_name = sheet_name
-    if resolved_sheet_name is None or str(resolved_sheet_name).strip() == "":
-        try:
-        
-           
-            xls = pd.ExcelFile(file_path)
-            if xls.sheet_names:
-                resolved_sheet_name = xls.sheet_names[0]
-        except Exception:
-            resolved_sheet_name = None
-
     ext = (file_path or "").lower().split(".")[-1]
     if ext == "csv":
-        return pd.read_csv(file_path, header=None)
+        return read_table(file_path, header=None)
 
     
     if sheet_name is None or str(sheet_name).strip() == "":
         
-        return pd.read_excel(file_path, sheet_name=0)
+        return read_table(file_path, sheet_name=0, header=0)
 
     
-    return pd.read_excel(file_path, sheet_name=0, header=None)
+    return read_table(file_path, sheet_name=0, header=None)
 
 
 
@@ -117,98 +118,126 @@ def apply_overrides_to_sections(sections: List[Dict], overrides: Dict) -> List[D
     return sections
 
 
-def _fingerprints_for(df: pd.DataFrame, sheet_name: Optional[str]) -> List[str]:
-    """Trả về danh sách fingerprint ứng viên: [có sheet_name, không sheet_name] (loại trùng)."""
-    fps: List[str] = []
-    try:
-        fps.append(get_fingerprint(df, sheet_name=sheet_name))
-    except TypeError:
-        pass
-    fps.append(get_fingerprint(df))
-    seen, out = set(), []
-    for fp in fps:
-        if fp and fp not in seen:
-            seen.add(fp)
-            out.append(fp)
-    return out
-
-
+@timed("rule_lookup")
 def _find_rule_for(
-    df: pd.DataFrame,
-    sheet_name: Optional[str],
+    fp_list: List[str],
     user_id: str,
-) -> Tuple[Optional[dict], Optional[str], Optional[str], Optional[str]]:
+    tokens: Optional[List[str]] = None,
+) -> Tuple[Optional[dict], Optional[str], Optional[str], Optional[str], Optional[float]]:
     """
     Tìm rule theo thứ tự: (user_id, fp_with_sheet) -> (user_id, fp_no_sheet) -> (default_user, ...)
-    Trả về: (rule, matched_fp, matched_uid, rule_kind)
+    fp_list: từ fingerprint_candidates (chỉ đọc vài dòng đầu sheet).
+    Không khớp đúng fingerprint → rule gần nhất theo chữ ký cấu trúc `tokens` (rule_index).
+    Trả về: (rule, matched_fp, matched_uid, rule_kind, match_score) — score 1.0 = khớp đúng.
     """
-    fp_list = _fingerprints_for(df, sheet_name)
-
-    
-    for fp in fp_list:
-        try:
-            rule = get_rule_for_fingerprint(fp, user_id=user_id)
-            if rule:
-                kind = "overrides" if (isinstance(rule, dict) and "overrides" in rule) else "structured"
-                return rule, fp, user_id, kind
-        except Exception:
-            pass
-
-    #
-    if user_id != "default_user":
-        for fp in fp_list:
-            try:
-                rule = get_rule_for_fingerprint(fp, user_id="default_user")
-                if rule:
-                    kind = "overrides" if (isinstance(rule, dict) and "overrides" in rule) else "structured"
-                    return rule, fp, "default_user", kind
-            except Exception:
-                pass
+    try:
+        rule, fp, uid = rule_store.find(fp_list, user_id)
+        score = 1.0 if rule else None
+        if not rule and tokens and FUZZY_RULE_MATCH:
+            hit = rule_index.nearest(tokens, user_id)
+            if hit:
+                fp, uid, score = hit
+                rule = rule_store.get(fp, user_id=uid)
+    except Exception:
+        rule, fp, uid, score = None, None, None, None
+    if rule:
+        kind = "overrides" if (isinstance(rule, dict) and "overrides" in rule) else "structured"
+        return rule, fp, uid, kind, score
 
-    return None, None, None, None
+    return None, None, None, None, None
 
 
 def _list_rule_files_for_user(user_id: str) -> List[str]:
-    """Liệt kê các file rule hiện có cho user (debug)."""
-    pattern = os.path.join(RULE_DIR, f"{user_id}_*.json")
-    return [os.path.basename(p) for p in glob.glob(pattern)]
+    """Liệt kê các rule hiện có cho user (debug), lấy từ index của rule store."""
+    uid = _safe_user_id(user_id)
+    return [f"{uid}_{fp}.json" for fp in rule_store.list_fingerprints(uid)]
 
 
 
-@router.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    user_id: Optional[str] = Form(None),
-):
-    ext = os.path.splitext(file.filename)[1].lower()
+def _check_ext(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
     if ext not in [".xlsx", ".xls", ".csv"]:
         raise HTTPException(status_code=400, detail="Chỉ nhận .xlsx/.xls/.csv")
+    return ext
 
-    session_id = str(uuid.uuid4())
-    saved_path = os.path.join(UPLOAD_DIR, f"{session_id}{ext}")
 
+async def _store_upload(chunks, ext: str, user_id: Optional[str]) -> Dict[str, Any]:
+    """Ghi blob theo nội dung, snapshot nếu là blob mới, rồi tạo session trỏ tới blob."""
     try:
-        with open(saved_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        saved_path, digest, size, deduped = await save_stream(chunks, ext, UPLOAD_DIR)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lưu file: {e}")
 
-    store.upsert(SessionData(session_id=session_id, user_id=user_id, file_path=saved_path))
+    # Snapshot từng sheet ngay lúc upload để các bước sau không phải parse lại Excel
+    # (blob đã có snapshot hợp lệ → bỏ qua, không parse lại; file quá lớn → đọc streaming, không snapshot)
+    if ext in (".xlsx", ".xls") and not should_stream(saved_path) and snapshot_sheet_names(saved_path) is None:
+        try:
+            frames = await run_in_pool("parse", write_snapshot, saved_path)
+            seed_sheets(saved_path, frames)
+        except Exception as e:
+            print(f"[UPLOAD] snapshot failed for {saved_path}: {e}")
+
+    session_id = str(uuid.uuid4())
+    await run_in_pool("io", store.upsert, SessionData(session_id=session_id, user_id=user_id, file_path=saved_path))
 
     return {
         "ok": True,
         "code": "UPLOAD_OK",
-        "data": {"session_id": session_id, "file_path": saved_path},
+        "data": {
+            "session_id": session_id,
+            "file_path": saved_path,
+            "sha256": digest,
+            "size": size,
+            "deduped": deduped,
+        },
     }
 
 
+@router.post("/upload")
+async def upload_file(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: Optional[str] = Form(None),
+):
+    ext = _check_ext(file.filename)
+    try:
+        check_declared_size(request.headers.get("content-length"), UPLOAD_MAX_BYTES + _MULTIPART_OVERHEAD)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await _store_upload(iter_upload_file(file), ext, user_id)
+
+
+@router.post("/upload/raw")
+async def upload_raw(
+    request: Request,
+    filename: str = Query(...),
+    user_id: Optional[str] = Query(None),
+):
+    """
+    Upload body thô (application/octet-stream), đọc thẳng từ socket theo chunk:
+    không spool cả file như multipart, vượt UPLOAD_MAX_MB là dừng ngay.
+    """
+    ext = _check_ext(filename)
+    try:
+        check_declared_size(request.headers.get("content-length"))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await _store_upload(request.stream(), ext, user_id)
+
+
 @router.post("/preview")
 async def preview(
     session_id: str = Form(...),
     sheet_name: Optional[str] = Form(None),
     user_id: Optional[str] = Form(None),
 ):
-   
+    # Parse + detect + sqlite đều blocking → chạy trên pool "parse"
+    return await run_in_pool("parse", _preview_sync, session_id, sheet_name, user_id)
+
+
+def _session_and_uid(session_id: str, user_id: Optional[str]):
     data = store.get(session_id)
     if not data:
         raise HTTPException(status_code=404, detail="Session không tồn tại")
@@ -218,25 +247,85 @@ async def preview(
         uid = user_id
         try:
             data.user_id = uid
-            store.upsert(data)
+            store.update_fields(session_id, user_id=uid)
         except Exception:
             pass
     if not uid:
         uid = "default_user"
+    return data, uid
 
-    df = _read_df(data.file_path, sheet_name=sheet_name)
-    if df.shape[0] == 0:
-        raise HTTPException(status_code=400, detail="File/sheet rỗng")
 
-    
-    rule, matched_fp, matched_uid, rule_kind = _find_rule_for(df, sheet_name, uid)
+def _session_readonly(session_id: str, user_id: Optional[str]):
+    """Như _session_and_uid nhưng không ghi user_id vào session (cho endpoint chỉ đọc)."""
+    data = store.get(session_id)
+    if not data:
+        raise HTTPException(status_code=404, detail="Session không tồn tại")
+    uid = getattr(data, "user_id", None) or user_id or "default_user"
+    return data, uid
+
+
+def _parse_sheet_names(raw: str) -> List[str]:
+    """sheet_names: JSON list, hoặc 1 tên / danh sách phân tách bằng dấu phẩy."""
+    try:
+        parsed = json.loads(raw)
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, list):
+        return [str(x) for x in parsed]
+    if isinstance(parsed, str):
+        raw = parsed
+    return [x.strip() for x in raw.split(",") if x.strip()]
+
+
+def _view_of(sig: Dict[str, Any], ncols: int, load) -> Dict[str, Any]:
+    """
+    View của 1 sheet: {"nrows", "ncols", "signals", "sections", "load"}.
+    sections = autodetect từ tín hiệu dòng, load() = sheet đầy đủ (chỉ gọi khi rule cần nội dung ô).
+    """
+    return {
+        "nrows": int(len(sig["blank"])),
+        "ncols": int(ncols),
+        "signals": sig,
+        "sections": sections_from_signals(sig["blank"], sig["header"], sig["data"]),
+        "load": load,
+    }
+
+
+def _frame_view(df: pd.DataFrame) -> Dict[str, Any]:
+    with stage("detect", size=len(df)):
+        return _view_of(compute_row_signals(df), df.shape[1], lambda: df)
+
+
+def _streamed_view(file_path: str, sheet: Any, header: Optional[int]) -> Dict[str, Any]:
+    """Sheet của file lớn (should_stream): tín hiệu dòng từ 1 lượt openpyxl read_only, không dựng DataFrame."""
+    sig = scan_sheet(file_path, sheet, header=header)
+    with stage("detect", size=sig["nrows"]):
+        return _view_of(sig, sig["ncols"], lambda: read_table(file_path, sheet_name=sheet, header=header))
+
+
+def _packed_view(packed: Dict[str, Any], load) -> Dict[str, Any]:
+    """Sheet đã /preview trong session: tín hiệu dòng lưu sẵn → không đọc file."""
+    with stage("detect", size=packed.get("nrows")):
+        return _view_of(unpack_row_signals(packed), packed.get("ncols", 0), load)
+
+
+def _match_sections(fp_list: List[str], uid: str, view: Dict[str, Any], tokens: Optional[List[str]] = None):
+    """
+    Rule của user (nếu có) hoặc autodetect cho 1 sheet, CHƯA validate
+    (trừ rule khớp gần đúng: sections lệch khỏi sheet thì bỏ rule, quay về autodetect).
+    Rule được tra theo fingerprint trước; chỉ rule dạng từ khóa mới cần view["load"]().
+    Trả (sections, used_rule, matched_fp, matched_uid, rule_kind, overrides_effective, match_score).
+    """
+    rule, matched_fp, matched_uid, rule_kind, match_score = _find_rule_for(fp_list, uid, tokens)
+
+    def autodetect() -> List[Dict]:
+        return [dict(s) for s in view["sections"]]
 
-    
     used_rule = False
     try:
         if rule:
             if rule_kind == "overrides":
-                base_sections = detect_sections_auto(df)  # 0-based sẵn
+                base_sections = autodetect()  # 0-based sẵn
                 before = [dict(x) for x in base_sections]
                 sections = apply_overrides_to_sections(base_sections, rule.get("overrides", {}))
                 used_rule = True
@@ -248,22 +337,61 @@ async def preview(
                     used_rule = len(sections) > 0
                     overrides_effective = None
                 else:
-                    sections = extract_sections_with_rule(df, rule) or []
+                    sections = extract_sections_with_rule(view["load"](), rule) or []
                     used_rule = len(sections) > 0
                     overrides_effective = None
         else:
-            sections = detect_sections_auto(df)
+            sections = autodetect()
             overrides_effective = None
     except Exception:
-        sections = detect_sections_auto(df)
+        sections = autodetect()
         used_rule = False
         overrides_effective = None
 
+    if used_rule and match_score is not None and match_score < 1.0:
+        try:
+            validate_sections_zero_based(to_zero_based(sections, nrows=view["nrows"]), nrows=view["nrows"])
+        except Exception:
+            sections = autodetect()
+            used_rule = False
+            overrides_effective = None
+            rule, matched_fp, matched_uid, rule_kind, match_score = None, None, None, None, None
+
+    return sections, used_rule, matched_fp, matched_uid, rule_kind, overrides_effective, match_score
+
+
+def _preview_sync(session_id: str, sheet_name: Optional[str], user_id: Optional[str]) -> Dict[str, Any]:
+   
+    data, uid = _session_and_uid(session_id, user_id)
+
+    # cùng quy ước với _read_df: luôn sheet đầu, header=0 khi không truyền sheet_name; CSV luôn header=None
+    sheet_key = sheet_name if (sheet_name is not None and str(sheet_name).strip() != "") else None
+    is_csv = (data.file_path or "").lower().endswith(".csv")
+    header = 0 if (sheet_key is None and not is_csv) else None
+    source = [data.file_path, sheet_key, header]
+    fps = fingerprint_candidates(data.file_path, 0, header, sheet_name)
+    tokens = sheet_signature(data.file_path, 0, header, sheet_name)
+    packed = data.row_signals if (data.row_signals or {}).get("source") == source else None
+    if packed is not None:
+        view = _packed_view(packed, lambda: _read_df(data.file_path, sheet_name=sheet_name))
+    elif should_stream(data.file_path):
+        view = _streamed_view(data.file_path, 0, header)
+    else:
+        view = _frame_view(_read_df(data.file_path, sheet_name=sheet_name))
+    nrows = view["nrows"]
+    if nrows == 0:
+        raise HTTPException(status_code=400, detail="File/sheet rỗng")
+
+    
+    sections, used_rule, matched_fp, matched_uid, rule_kind, overrides_effective, match_score = _match_sections(
+        fps, uid, view, tokens
+    )
+
     
     try:
         
-        sections = to_zero_based(sections, nrows=df.shape[0])
-        sections = validate_sections_zero_based(sections, nrows=df.shape[0])
+        sections = to_zero_based(sections, nrows=nrows)
+        sections = validate_sections_zero_based(sections, nrows=nrows)
     except IndexErrorDetail as ie:
         return {"ok": False, "code": ie.code, "error": str(ie)}
     except Exception as e:
@@ -272,17 +400,32 @@ async def preview(
     
     data.auto_sections = [Section(**s) for s in sections]
     data.used_rule = bool(used_rule)
-    try:
-        fps = _fingerprints_for(df, sheet_name)
-        data.fingerprint = matched_fp or (fps[-1] if fps else None)
-    except Exception:
-        pass
+    # fingerprint của chính sheet này (rule khớp gần đúng thuộc fingerprint khác → ghi ở rule_match)
+    data.fingerprint = (matched_fp if match_score == 1.0 else None) or (fps[-1] if fps else None)
+    # sheet + sections rule cho ra: /final chỉ lưu lại rule gần đúng khi vẫn đúng sheet, sections chưa bị sửa
+    data.rule_match = (
+        {"fingerprint": matched_fp, "user_id": matched_uid, "score": match_score, "sheet": sheet_key, "sections": sections}
+        if used_rule else None
+    )
     if not getattr(data, "user_id", None):
         try:
             data.user_id = uid
         except Exception:
             pass
-    store.upsert(data)
+    fields = {}
+    if packed is None:
+        # lưu tín hiệu dòng kèm session → /preview lại và /chat không phải phân loại lại cả sheet
+        data.row_signals = {**pack_row_signals(view["signals"]), "ncols": view["ncols"], "source": source}
+        fields["row_signals"] = data.row_signals
+    store.update_fields(
+        session_id,
+        auto_sections=data.auto_sections,
+        used_rule=data.used_rule,
+        fingerprint=data.fingerprint,
+        rule_match=data.rule_match,
+        user_id=data.user_id,
+        **fields,
+    )
 
     
     rule_files_for_user = _list_rule_files_for_user(matched_uid or uid)
@@ -298,18 +441,119 @@ async def preview(
         "code": "PREVIEW_OK",
         "data": {
             "session_id": session_id,
-            "fingerprints_tried": _fingerprints_for(df, sheet_name),
+            "fingerprints_tried": fps,
             "matched_fingerprint": matched_fp,
             "matched_user_id": matched_uid,
+            "match_score": match_score,
             "rule_kind": rule_kind,
             "rule_files_for_user": rule_files_for_user,
             "used_rule": used_rule,
             "sections_source": source,
             "index_base": "zero",
             "sections": sections,
-            "nrows": int(df.shape[0]),
+            "nrows": int(nrows),
             "overrides_effective": (overrides_effective if rule_kind == "overrides" else None),
         },
     }
 
 
+
+
+def _read_workbook(file_path: str) -> Dict[str, Optional[pd.DataFrame]]:
+    """
+    Mọi sheet (header=None) trong 1 lần mở workbook (hoặc từ snapshot). CSV → 1 'sheet'.
+    File lớn (should_stream): chỉ lấy tên sheet, giá trị None → _preview_sheet đọc streaming.
+    """
+    ext = (file_path or "").lower().split(".")[-1]
+    if ext == "csv":
+        return {"csv": read_table(file_path, header=None)}
+    if should_stream(file_path):
+        return {name: None for name in stream_sheet_names(file_path)}
+    return read_table(file_path, sheet_name=None, header=None)
+
+
+def _preview_sheet(name: str, df: Optional[pd.DataFrame], uid: str, file_path: Optional[str] = None) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    view = _streamed_view(file_path, name, None) if df is None else _frame_view(df)
+    nrows = view["nrows"]
+    out: Dict[str, Any] = {"sheet_name": name, "nrows": int(nrows)}
+    if nrows == 0:
+        out.update({"ok": False, "code": "EMPTY_SHEET", "sections": []})
+    else:
+        try:
+            # mẫu lấy từ sheet _read_workbook đã đọc → không mở lại workbook cho từng sheet
+            fps = fingerprint_candidates(file_path, name, None, name, frame=df)
+            tokens = sheet_signature(file_path, name, None, name, frame=df)
+            sections, used_rule, matched_fp, matched_uid, rule_kind, _, match_score = _match_sections(
+                fps, uid, view, tokens
+            )
+            sections = to_zero_based(sections, nrows=nrows)
+            sections = validate_sections_zero_based(sections, nrows=nrows)
+            out.update({
+                "ok": True,
+                "used_rule": used_rule,
+                "sections_source": "rule" if used_rule else "autodetect",
+                "matched_fingerprint": matched_fp,
+                "matched_user_id": matched_uid,
+                "match_score": match_score,
+                "rule_kind": rule_kind,
+                "fingerprints_tried": fps,
+                "sections": sections,
+            })
+        except IndexErrorDetail as ie:
+            out.update({"ok": False, "code": ie.code, "error": str(ie), "sections": []})
+        except Exception as e:
+            out.update({"ok": False, "code": "PREVIEW_ERROR", "error": str(e), "sections": []})
+    out["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return out
+
+
+def _preview_sheets(frames: Dict[str, Optional[pd.DataFrame]], uid: str, file_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    return [_preview_sheet(str(name), df, uid, file_path) for name, df in frames.items()]
+
+
+@router.post("/preview/batch")
+async def preview_batch(
+    session_id: str = Form(...),
+    user_id: Optional[str] = Form(None),
+    sheet_names: Optional[str] = Form(None, description="Danh sách sheet (JSON list hoặc phân tách bằng dấu phẩy); bỏ trống = mọi sheet"),
+    parallel: bool = Form(False),
+):
+    """
+    Preview mọi sheet của workbook trong 1 request: mở workbook 1 lần, mỗi sheet chạy
+    rule matching / autodetect (tuần tự hoặc song song trên pool "parse").
+    Chỉ đọc: không ghi sections vào session (dùng /preview để chọn sheet làm việc).
+    """
+    t0 = time.perf_counter()
+    data, uid = await run_in_pool("io", _session_readonly, session_id, user_id)
+    frames = await run_in_pool("parse", _read_workbook, data.file_path)
+    read_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    if sheet_names:
+        wanted = _parse_sheet_names(sheet_names)
+        missing = [n for n in wanted if n not in frames]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Không có sheet: {missing}")
+        frames = {n: frames[n] for n in wanted}
+
+    if parallel and len(frames) > 1:
+        sheets = list(await asyncio.gather(
+            *(run_in_pool("parse", _preview_sheet, str(name), df, uid, data.file_path) for name, df in frames.items())
+        ))
+    else:
+        sheets = await run_in_pool("parse", _preview_sheets, frames, uid, data.file_path)
+
+    return {
+        "ok": True,
+        "code": "PREVIEW_BATCH_OK",
+        "data": {
+            "session_id": session_id,
+            "index_base": "zero",
+            "sheets": sheets,
+            "timings": {
+                "read_ms": read_ms,
+                "total_ms": round((time.perf_counter() - t0) * 1000, 2),
+                "parallel": bool(parallel and len(frames) > 1),
+            },
+        },
+    }
@@ -1,13 +1,20 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from typing import Optional
 from data_processing.chat_memory import memory
+from common.concurrency import run_in_pool
 
 router = APIRouter()
 
 @router.get("/history/{user_id}")
-async def get_history(user_id: str):
-    return {"user_id": user_id, "history": memory.get_history(user_id)}
+async def get_history(
+    user_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+):
+    history = await run_in_pool("io", memory.get_history, user_id, offset=offset, limit=limit)
+    return {"user_id": user_id, "history": history, "offset": offset, "limit": limit}
 
 @router.delete("/history/{user_id}")
 async def clear_history(user_id: str):
-    memory.reset(user_id)
+    await run_in_pool("io", memory.reset, user_id)
     return {"message": f"Đã xóa lịch sử của {user_id}."}
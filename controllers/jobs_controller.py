@@ -0,0 +1,53 @@
+from fastapi import APIRouter, HTTPException
+
+from common.concurrency import run_in_pool
+from common.job_queue import job_queue, worker_pool, RUNNING
+from controllers.section_confirm_controller import ConfirmRequest
+from controllers.pipeline_controller import FinalIn
+
+router = APIRouter()
+
+_HANDLERS = {
+    "confirm_sections": "controllers.section_confirm_controller:confirm_job",
+    "final": "controllers.pipeline_controller:final_job",
+}
+
+
+async def _submit(kind: str, payload: dict) -> dict:
+    job_id, deduped = await run_in_pool("io", job_queue.submit, kind, _HANDLERS[kind], payload)
+    await run_in_pool("io", worker_pool.ensure_started)
+    return {
+        "ok": True,
+        "code": "JOB_DEDUPED" if deduped else "JOB_QUEUED",
+        "data": {"job_id": job_id, "kind": kind, "status_url": f"/jobs/{job_id}"},
+    }
+
+
+@router.post("/jobs/confirm_sections")
+async def submit_confirm(payload: ConfirmRequest):
+    """Như /confirm_sections nhưng chạy nền; trả job_id để hỏi /jobs/{job_id}."""
+    return await _submit("confirm_sections", payload.model_dump())
+
+
+@router.post("/jobs/final")
+async def submit_final(payload: FinalIn):
+    """Như /final nhưng chạy nền; trả job_id để hỏi /jobs/{job_id}."""
+    return await _submit("final", payload.model_dump())
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await run_in_pool("io", job_queue.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job không tồn tại")
+    return {"ok": True, "code": "JOB_STATUS", "data": job}
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    status = await run_in_pool("io", job_queue.cancel, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job không tồn tại")
+    msg = ("Job đang chạy: dừng trước bước ghi kế tiếp; nếu đã ghi xong thì chỉ bỏ kết quả, chi tiết ở error của job."
+           if status == RUNNING else f"Trạng thái: {status}.")
+    return {"ok": True, "code": "JOB_CANCEL", "data": {"job_id": job_id, "status": status}, "message": msg}
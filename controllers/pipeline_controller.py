@@ -1,15 +1,21 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List
 import pandas as pd
+import json
 import time
 
 from common.session_store import SessionStore
+from common.job_queue import check_cancelled
+from common.df_cache import read_table
 from data_processing.validators import validate_sections_zero_based, to_zero_based
-from data_processing.analyzer import run_analysis
-from data_processing.planner import build_report
+from data_processing.stream_loader import should_stream, load_sections_frame
+from data_processing.analyzer import run_analysis, iter_analysis, summarize_analysis
+from data_processing.planner import build_report, build_report_stream
 from data_processing.rule_learning_gpt import learn_rule_from_sections
-from data_processing.rule_memory import get_fingerprint, save_rule_for_fingerprint
+from data_processing.rule_memory import file_fingerprint, save_rule_for_fingerprint, get_rule_for_fingerprint
 from data_processing.exporter import save_report_excel
 from data_processing.chat_memory import memory
 from data_processing.rule_learning_from_chat import promote_best_candidates
@@ -18,14 +24,17 @@ from data_processing.rule_learning_from_chat import promote_best_candidates
 router = APIRouter()
 store = SessionStore()
 
-def _load_df(file_path: str, sheet_name: Optional[str] = None):
+def _load_df(file_path: str, sheet_name: Optional[str] = None, sections: Optional[List[Dict]] = None):
+    if sections and should_stream(file_path):
+        # File lớn: chỉ nạp giá trị các dòng thuộc sections (khung vẫn đủ nrows x ncols)
+        return load_sections_frame(file_path, sheet_name or 0, sections)
     ext = (file_path or "").lower().split(".")[-1]
     if ext == "csv":
-        return pd.read_csv(file_path, header=None) 
+        return read_table(file_path, header=None) 
     try:
-        return pd.read_excel(file_path, sheet_name=sheet_name, header=None)  
+        return read_table(file_path, sheet_name=sheet_name, header=None)  
     except TypeError:
-        return pd.read_excel(file_path, header=None)  
+        return read_table(file_path, sheet_name=0, header=None)  
 
 def _pick_sections(data) -> tuple[list[dict], bool]:
     if data.confirmed_sections and len(data.confirmed_sections) > 0:
@@ -40,21 +49,16 @@ class FinalIn(BaseModel):
     sheet_name: Optional[str] = None
     force: bool = False
 
-@router.post("/final")
-def run_final(payload: FinalIn) -> Dict[str, Any]:
-    data = store.get(payload.session_id)
-    if not data:
-        raise HTTPException(status_code=404, detail="Session ID không tồn tại.")
-
-    df = _load_df(data.file_path, sheet_name=payload.sheet_name)
-
+def _prepare(payload: FinalIn, data):
+    """Chọn sections + đọc sheet + kiểm tra sections. Trả (df, sections, is_confirmed, error_dict)."""
     sections, is_confirmed = _pick_sections(data)
     if not sections:
-        return {
+        return None, sections, is_confirmed, {
             "ok": False,
             "code": "NO_SECTIONS",
             "error": "Không có sections (auto hoặc confirmed). Hãy /preview và/hoặc /chat trước.",
         }
+    df = _load_df(data.file_path, sheet_name=payload.sheet_name, sections=sections)
 
     
     try:
@@ -64,36 +68,57 @@ def run_final(payload: FinalIn) -> Dict[str, Any]:
             sections = to_zero_based(sections, nrows=df.shape[0])
             sections = validate_sections_zero_based(sections, nrows=df.shape[0])
     except Exception as e:
-        return {"ok": False, "code": "INVALID_SECTIONS", "error": f"Sections không hợp lệ: {e}"}
+        return df, sections, is_confirmed, {"ok": False, "code": "INVALID_SECTIONS", "error": f"Sections không hợp lệ: {e}"}
 
     if (not is_confirmed) and (not payload.force):
-        return {
+        return df, sections, is_confirmed, {
             "ok": False,
             "code": "NEED_CONFIRM",
             "error": "Chưa xác nhận sections; gửi force=true để chạy tạm bằng auto hoặc hãy /confirm_sections.",
         }
+    return df, sections, is_confirmed, None
 
-    analysis = run_analysis(df, sections, params=None)
-    report = build_report(analysis)
-
-    export_path = None
+def _export(payload: FinalIn, report: str) -> Optional[str]:
     try:
-        export_path = save_report_excel(
+        return save_report_excel(
             report=report,
             session_id=payload.session_id,
             filename_prefix=payload.user_id  
         )
     except Exception as e:
-        export_path = None
+        return None
+
+def _near_rule(data, sheet_name: Optional[str], sections: List[Dict]) -> Optional[Dict[str, Any]]:
+    """
+    Rule mà /preview đã khớp gần đúng (score < 1) cho session, nếu còn đúng với lần /final này:
+    cùng sheet với lần preview và sections đang chạy vẫn là sections rule cho ra (chưa sửa qua /chat).
+    """
+    match = getattr(data, "rule_match", None) or {}
+    score = match.get("score")
+    if score is None or score >= 1.0 or not match.get("fingerprint"):
+        return None
+    sheet_key = sheet_name if (sheet_name is not None and str(sheet_name).strip() != "") else None
+    if "sheet" not in match or match["sheet"] != sheet_key or match.get("sections") != sections:
+        return None
+    try:
+        return get_rule_for_fingerprint(match["fingerprint"], user_id=match.get("user_id") or "default_user")
+    except Exception:
+        return None
 
+def _finish(payload: FinalIn, data, df, sections, is_confirmed: bool,
+            analysis: Dict[str, Any], report: str, export_path: Optional[str]) -> Dict[str, Any]:
+    """Lưu rule, promote candidate, ghi lịch sử và dựng response của /final."""
+    # job nền bị hủy → dừng trước bước ghi đầu tiên
+    check_cancelled()
     # Lưu RULE
     auto_learned_rule = False
     warn = None
     fp = None
     try:
-        fp = get_fingerprint(df, sheet_name=payload.sheet_name)
-    except TypeError:
-        fp = get_fingerprint(df)
+        fp = file_fingerprint(data.file_path, payload.sheet_name or 0, header=None, sheet_name=payload.sheet_name)
+    except Exception as e:
+        warn = f"Không tính được fingerprint: {e}"
+    near_rule = None if is_confirmed else _near_rule(data, payload.sheet_name, sections)
 
     if is_confirmed:
         try:
@@ -107,6 +132,13 @@ def run_final(payload: FinalIn) -> Dict[str, Any]:
             save_rule_for_fingerprint(fp, structured_rule, user_id=payload.user_id)
         except Exception as e:
             warn = (warn or "") + f" | Lưu structured rule gặp lỗi: {e}"
+    elif near_rule is not None:
+        # /preview đã dùng rule khớp gần đúng → lưu lại cho fingerprint này, khỏi gọi GPT học lại
+        try:
+            save_rule_for_fingerprint(fp, near_rule, user_id=payload.user_id)
+            auto_learned_rule = True
+        except Exception as e:
+            warn = (warn or "") + f" | Lưu rule gần đúng gặp lỗi: {e}"
     else:
         try:
             learned_rule = learn_rule_from_sections(
@@ -133,8 +165,6 @@ def run_final(payload: FinalIn) -> Dict[str, Any]:
 
     promoted = False
     try:
-        if fp is None:
-            fp = get_fingerprint(df, sheet_name=payload.sheet_name)
         promoted = promote_best_candidates(payload.user_id, fp)
     except Exception:
         promoted = False
@@ -171,3 +201,86 @@ def run_final(payload: FinalIn) -> Dict[str, Any]:
     if warn:
         resp["warn"] = warn.strip(" |")
     return resp
+
+@router.post("/final")
+def run_final(payload: FinalIn) -> Dict[str, Any]:
+    data = store.get(payload.session_id)
+    if not data:
+        raise HTTPException(status_code=404, detail="Session ID không tồn tại.")
+
+    df, sections, is_confirmed, error = _prepare(payload, data)
+    if error:
+        return error
+
+    analysis = run_analysis(df, sections, params=None)
+    report = build_report(analysis)
+    export_path = _export(payload, report)
+    return _finish(payload, data, df, sections, is_confirmed, analysis, report, export_path)
+
+def final_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler cho job nền (common/job_queue.py)."""
+    try:
+        return run_final(FinalIn(**payload))
+    finally:
+        # process worker bị dừng từ ngoài → atexit không chắc chạy, ghi lịch sử ngay
+        memory.flush()
+
+def _final_events(payload: FinalIn, data) -> Iterator[Dict[str, Any]]:
+    """
+    Các bước của /final dưới dạng event, phát ngay khi từng bước xong:
+    start → section (mỗi section) → analysis → report_token (nhiều lần) → export → done.
+    Lỗi giữa chừng kết thúc stream bằng một event error thay vì cắt ngang.
+    """
+    try:
+        yield from _final_steps(payload, data)
+    except Exception as e:
+        yield {"event": "error", "ok": False, "code": "FINAL_STREAM_ERROR", "error": str(e)}
+
+
+def _final_steps(payload: FinalIn, data) -> Iterator[Dict[str, Any]]:
+    df, sections, is_confirmed, error = _prepare(payload, data)
+    if error:
+        yield {"event": "error", **error}
+        return
+    yield {"event": "start", "sections_count": len(sections), "used_confirmed_sections": is_confirmed}
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(sections)
+    for i, res in iter_analysis(df, sections, params=None):
+        results[i] = res
+        yield {"event": "section", "index": i, "result": res}
+    analysis = summarize_analysis(results)
+    yield {"event": "analysis", "sections_count": analysis["sections_count"], "total_rows": analysis["total_rows"]}
+
+    parts: List[str] = []
+    for token in build_report_stream(analysis):
+        parts.append(token)
+        yield {"event": "report_token", "text": token}
+    report = "".join(parts).strip()
+
+    export_path = _export(payload, report)
+    yield {"event": "export", "excel_path": export_path}
+
+    resp = _finish(payload, data, df, sections, is_confirmed, analysis, report, export_path)
+    # analysis/report đã gửi ở các event trước
+    resp["data"] = {"export": resp["data"]["export"]}
+    yield {"event": "done", **resp}
+
+def _encode_events(events: Iterator[Dict[str, Any]], sse: bool) -> Iterator[str]:
+    for ev in events:
+        body = json.dumps(jsonable_encoder(ev), ensure_ascii=False)
+        yield f"event: {ev['event']}\ndata: {body}\n\n" if sse else body + "\n"
+
+@router.post("/final/stream")
+def run_final_stream(payload: FinalIn, request: Request):
+    """
+    Giống /final nhưng stream kết quả: NDJSON (mặc định) hoặc SSE khi Accept: text/event-stream.
+    """
+    data = store.get(payload.session_id)
+    if not data:
+        raise HTTPException(status_code=404, detail="Session ID không tồn tại.")
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    return StreamingResponse(
+        _encode_events(_final_events(payload, data), sse),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from common.concurrency import run_in_pool
+from common.profiler import profile_store, PROFILE_REQUESTS, PROFILE_SLOW_MS, PROFILE_HEADER, PROFILE_FORMAT
+
+router = APIRouter()
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """Các profile request chậm đã ghi (mới nhất trước); bật bằng PROFILE_REQUESTS=1."""
+    items = await run_in_pool("io", profile_store.list)
+    return {
+        "ok": True,
+        "code": "PROFILES",
+        "data": {
+            "enabled": PROFILE_REQUESTS,
+            "slow_ms": PROFILE_SLOW_MS,
+            "header": PROFILE_HEADER,
+            "format": PROFILE_FORMAT,
+            "profiles": [{**r, "url": f"/profiles/{r['name']}"} for r in items],
+        },
+    }
+
+
+@router.get("/profiles/{name}")
+async def get_profile(name: str):
+    path = await run_in_pool("io", profile_store.path_of, name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile không tồn tại")
+    media = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media, filename=name)
@@ -1,6 +1,6 @@
 # controllers/section_confirm_controller.py
 
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Header
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
 import pandas as pd
@@ -8,12 +8,14 @@ import time
 import json
 
 from common.session_store import SessionStore
+from common.job_queue import check_cancelled, on_requeue
+from common.df_cache import read_table
 from common.models import Section
 from data_processing.validators import to_zero_based, validate_sections_zero_based, IndexErrorDetail
 
 
 from data_processing.rule_learning_gpt import learn_rule_from_sections
-from data_processing.rule_memory import get_fingerprint, save_rule_for_fingerprint
+from data_processing.rule_memory import file_fingerprint, save_rule_for_fingerprint
 from data_processing.rule_based_extractor import extract_sections_with_rule
 from data_processing.chat_memory import memory
 
@@ -39,6 +41,28 @@ class ConfirmRequest(BaseModel):
     sections: Optional[List[SectionIn]] = None
 
 
+# Hợp đồng của /confirm_sections, quảng bá ở /health (protocols.confirm_sections):
+# client đọc 1 lần rồi gửi đúng 1 request theo schema, không thử nhiều kiểu body.
+# Đổi shape ConfirmRequest theo kiểu không tương thích → tăng version.
+CONFIRM_PROTOCOL_VERSION = 1
+CONFIRM_PROTOCOL_HEADER = "X-Confirm-Protocol"
+_confirm_protocol: Optional[Dict[str, Any]] = None
+
+
+def confirm_protocol() -> Dict[str, Any]:
+    global _confirm_protocol
+    if _confirm_protocol is None:
+        _confirm_protocol = {
+            "version": CONFIRM_PROTOCOL_VERSION,
+            "method": "POST",
+            "path": "/confirm_sections",
+            "content_type": "application/json",
+            "header": CONFIRM_PROTOCOL_HEADER,
+            "index_base": "zero",  # 1-based vẫn nhận (tự quy đổi), xem index_base trong response
+            "schema": ConfirmRequest.model_json_schema(),
+        }
+    return _confirm_protocol
+
 
 def _read_df(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
     """
@@ -48,17 +72,17 @@ def _read_df(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
     """
     ext = (file_path or "").lower().split(".")[-1]
     if ext == "csv":
-        return pd.read_csv(file_path, header=None)
+        return read_table(file_path, header=None)
 
     
     if sheet_name is None or str(sheet_name).strip() == "":
-        return pd.read_excel(file_path, sheet_name=0, header=None)
+        return read_table(file_path, sheet_name=0, header=None)
 
     try:
-        return pd.read_excel(file_path, sheet_name=sheet_name, header=None)
+        return read_table(file_path, sheet_name=sheet_name, header=None)
     except TypeError:
         
-        return pd.read_excel(file_path, header=None)
+        return read_table(file_path, sheet_name=0, header=None)
 
 
 def _pick_sections_from_input_or_session(
@@ -87,9 +111,36 @@ def confirm_sections(
                 {"header_row": 5, "start_row": 34, "end_row": 49, "label": "Du an thang 2"},
             ],
         },
-    )
+    ),
+    protocol: Optional[int] = Header(None, alias=CONFIRM_PROTOCOL_HEADER),
 ):
-    
+    if protocol is not None and protocol != CONFIRM_PROTOCOL_VERSION:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{CONFIRM_PROTOCOL_HEADER}={protocol} không được hỗ trợ (BE dùng version {CONFIRM_PROTOCOL_VERSION}, xem /health)",
+        )
+    return _confirm(payload)
+
+
+def confirm_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler cho job nền (common/job_queue.py)."""
+    try:
+        return _confirm(ConfirmRequest(**payload))
+    finally:
+        # process worker bị dừng từ ngoài → atexit không chắc chạy, ghi lịch sử ngay
+        memory.flush()
+
+
+def _release_confirm_lock(payload: Dict[str, Any]) -> None:
+    # worker chết giữa confirm → finally không chạy, cờ confirming còn lại → job chạy lại sẽ 409 mãi
+    if payload.get("session_id"):
+        store.update_fields(payload["session_id"], confirming=False)
+
+
+on_requeue("confirm_sections", _release_confirm_lock)
+
+
+def _confirm(payload: ConfirmRequest) -> Dict[str, Any]:
     session_id: str = payload.session_id
     user_id: str = payload.user_id or "default_user"
     sheet_name: Optional[str] = payload.sheet_name
@@ -109,7 +160,7 @@ def confirm_sections(
     if getattr(data, "confirming", False):
         raise HTTPException(status_code=409, detail="Confirm đang chạy. Vui lòng thử lại sau.")
     setattr(data, "confirming", True)
-    store.upsert(data)
+    store.update_fields(session_id, confirming=True)
 
     try:
         
@@ -136,14 +187,15 @@ def confirm_sections(
             except Exception:
                 return {"ok": False, "code": ie_primary.code, "error": str(ie_primary)}
 
-        
+        # job nền bị hủy → dừng ở đây, trước bước ghi đầu tiên
+        check_cancelled()
         data.confirmed_sections = [Section(**s) for s in sections_zb]
         if not getattr(data, "user_id", None):
             try:
                 data.user_id = user_id
             except Exception:
                 pass
-        store.upsert(data)
+        store.update_fields(session_id, confirmed_sections=data.confirmed_sections, user_id=data.user_id)
 
         
         auto_learned = False
@@ -154,10 +206,9 @@ def confirm_sections(
 
         try:
             
-            try:
-                fp_used = get_fingerprint(df, sheet_name=sheet_name)
-            except TypeError:
-                fp_used = get_fingerprint(df)
+            # cùng sheet với _read_df; tên cột lấy từ vài dòng đầu (có memo), không từ df
+            sheet_arg = sheet_name if (sheet_name is not None and str(sheet_name).strip() != "") else 0
+            fp_used = file_fingerprint(data.file_path, sheet_arg, header=None, sheet_name=sheet_name)
 
             
             try:
@@ -268,4 +319,4 @@ def confirm_sections(
 
     finally:
         setattr(data, "confirming", False)
-        store.upsert(data)
+        store.update_fields(session_id, confirming=False)
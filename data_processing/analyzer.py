@@ -1,9 +1,22 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import os
+import pickle
+import threading
 import pandas as pd
 
+from common.metrics import stage
 from .auto_group_by import choose_group_by
+from .column_profile import profile_column, profile_frame
 
+# Chế độ song song (tùy chọn): fan-out các section sang process pool.
+# ANALYSIS_WORKERS=0 → tắt (chạy tuần tự như cũ).
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "0"))
+# Chỉ bật khi tổng số dòng các section đủ lớn để bù chi phí khởi tạo process.
+ANALYSIS_PARALLEL_MIN_ROWS = int(os.getenv("ANALYSIS_PARALLEL_MIN_ROWS", "50000"))
 
 
 def _normalize_region(df: pd.DataFrame, header_row: int, end_row: int) -> pd.DataFrame:
@@ -53,60 +66,35 @@ def _normalize_region(df: pd.DataFrame, header_row: int, end_row: int) -> pd.Dat
     return region
 
 
-def _column_quality(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+def _column_quality(df: pd.DataFrame, profile: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
     """Return basic quality metrics per column."""
+    profile = profile if profile is not None else profile_frame(df)
     out: Dict[str, Dict[str, Any]] = {}
-    n = len(df)
     for col in df.columns:
-        s = df[col]
-        null_rate = float(s.isna().mean()) if n else 0.0
-        nunique = int(s.nunique(dropna=True))
-        sample = s.dropna().astype(str).head(5).tolist()
-        coltype = str(s.dtype)
+        p = profile[col]
         out[col] = {
-            "dtype": coltype,
-            "null_rate": round(null_rate, 4),
-            "nunique": nunique,
-            "sample": sample,
+            "dtype": p["dtype"],
+            "null_rate": round(p["null_rate"], 4),
+            "nunique": p["nunique"],
+            "sample": p["sample"],
         }
     return out
 
 
-def _top_categories(df: pd.DataFrame, col: str, k: int = 10) -> Dict[str, int]:
+def _top_categories(
+    df: pd.DataFrame, col: str, k: int = 10, profile: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, int]:
     try:
-        vc = (
-            df[col]
-            .dropna()
-            .astype(str)
-            .replace({"": None, "nan": None})
-            .dropna()
-            .value_counts()
-            .head(k)
-        )
-        return {str(i): int(v) for i, v in vc.items()}
+        p = profile[col] if profile is not None else profile_column(df[col], top_k=k)
+        return dict(list(p["top"].items())[:k])
     except Exception:
         return {}
 
 
-def _numeric_summary(df: pd.DataFrame) -> Dict[str, Dict[str, float]]:
+def _numeric_summary(df: pd.DataFrame, profile: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, float]]:
     """Summary for numeric columns."""
-    out: Dict[str, Dict[str, float]] = {}
-    num_df = df.select_dtypes(include=["number"])  
-    for c in num_df.columns:
-        s = num_df[c].dropna()
-        if s.empty:
-            continue
-        out[c] = {
-            "count": float(s.count()),
-            "mean": float(s.mean()),
-            "std": float(s.std(ddof=1)) if s.count() > 1 else 0.0,
-            "min": float(s.min()),
-            "q25": float(s.quantile(0.25)),
-            "median": float(s.median()),
-            "q75": float(s.quantile(0.75)),
-            "max": float(s.max()),
-        }
-    return out
+    profile = profile if profile is not None else profile_frame(df)
+    return {c: profile[c]["numeric"] for c in df.columns if profile[c]["numeric"] is not None}
 
 
 def _analyze_single_region(
@@ -124,11 +112,13 @@ def _analyze_single_region(
     hr = int(section["header_row"])
 
     region = _normalize_region(sheet_df, header_row=hr, end_row=er)
+    # 1 lượt profile mỗi cột, dùng chung cho group_by / quality / numeric / top-k
+    profile = profile_frame(region)
 
     
     group_by = params.get("group_by")
     if not group_by or (region.shape[1] > 0 and group_by not in region.columns):
-        group_by = choose_group_by(region)
+        group_by = choose_group_by(region, profile=profile)
 
     
     group_summary: Dict[str, int] = {}
@@ -145,12 +135,12 @@ def _analyze_single_region(
             group_summary = {}
 
     
-    quality = _column_quality(region)
-    numeric = _numeric_summary(region)
+    quality = _column_quality(region, profile)
+    numeric = _numeric_summary(region, profile)
 
     quick_notes: List[str] = []
     if group_by:
-        topk = _top_categories(region, group_by, k=5)
+        topk = _top_categories(region, group_by, k=5, profile=profile)
         if topk:
             head = ", ".join([f"{k}: {v}" for k, v in list(topk.items())[:3]])
             quick_notes.append(f"group_by='{group_by}' top: {head}")
@@ -175,32 +165,151 @@ def _analyze_single_region(
 
 
 
-def run_analysis(
+def _safe_analyze(
     sheet_df: pd.DataFrame,
-    sections: List[Dict[str, Any]],
+    section: Dict[str, Any],
     params: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
-    """
-    Run analysis for all sections on a single sheet dataframe.
-    - Expects **0-based** validated sections (validate before calling).
-    - Returns a machine-friendly dict.
-    """
-    results: List[Dict[str, Any]] = []
+    try:
+        return _analyze_single_region(sheet_df, section, params=params)
+    except Exception as e:
+        
+        return {
+            "label": section.get("label"),
+            "error": str(e),
+            "header_row": section.get("header_row"),
+            "start_row": section.get("start_row"),
+            "end_row": section.get("end_row"),
+        }
+
+
+# --- process pool: 1 pool "spawn" dùng chung cả process, tạo lười, đóng khi app shutdown ---
+# (không fork: server đang có thread pool parse/io + thread ghi lịch sử, fork lúc đó có thể kẹt lock)
+# Mỗi lần phân tích, sheet được pickle 1 lần vào shared memory; worker nạp 1 lần / sheet rồi giữ lại
+# (theo tên block shared memory) cho các section tiếp theo.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+_WORKER_SHEET: Tuple[Optional[str], Optional[pd.DataFrame]] = (None, None)
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size < workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            _pool_size = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    # worker chết → pool hỏng (BrokenProcessPool), lần sau tạo pool mới
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is pool:
+            _pool, _pool_size = None, 0
+    pool.shutdown(wait=False)
+
+
+def shutdown_pool() -> None:
+    global _pool, _pool_size
+    with _pool_lock:
+        pool, _pool, _pool_size = _pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _sheet_from(shm_name: str, size: int) -> pd.DataFrame:
+    global _WORKER_SHEET
+    if _WORKER_SHEET[0] != shm_name:
+        # worker dùng chung resource_tracker với tiến trình cha → cha unlink là đủ
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            _WORKER_SHEET = (shm_name, pickle.loads(bytes(shm.buf[:size])))
+        finally:
+            shm.close()
+    return _WORKER_SHEET[1]
 
+
+def _worker_analyze(
+    shm_name: str, size: int, idx: int, section: Dict[str, Any], params: Optional[Dict[str, Any]]
+) -> Tuple[int, Dict[str, Any]]:
+    return idx, _safe_analyze(_sheet_from(shm_name, size), section, params=params)
+
+
+def _use_parallel(sections: List[Dict[str, Any]], workers: int) -> bool:
+    if workers <= 1 or len(sections) < 2:
+        return False
+    rows = 0
     for s in sections:
         try:
-            res = _analyze_single_region(sheet_df, s, params=params)
-        except Exception as e:
-            
-            res = {
-                "label": s.get("label"),
-                "error": str(e),
-                "header_row": s.get("header_row"),
-                "start_row": s.get("start_row"),
-                "end_row": s.get("end_row"),
-            }
-        results.append(res)
+            rows += int(s["end_row"]) - int(s["header_row"])
+        except Exception:
+            pass
+    return rows >= ANALYSIS_PARALLEL_MIN_ROWS
 
+
+def iter_analysis(
+    sheet_df: pd.DataFrame,
+    sections: List[Dict[str, Any]],
+    params: Optional[Dict[str, Any]] = None,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Yield (index, result) cho từng section ngay khi phân tích xong.
+    - workers=None → dùng ANALYSIS_WORKERS; chỉ chạy song song khi đủ lớn (ANALYSIS_PARALLEL_MIN_ROWS).
+    - Ở chế độ song song thứ tự yield là thứ tự hoàn thành, không phải thứ tự section.
+    """
+    workers = ANALYSIS_WORKERS if workers is None else workers
+    if not _use_parallel(sections, workers):
+        for i, s in enumerate(sections):
+            yield i, _safe_analyze(sheet_df, s, params=params)
+        return
+
+    payload = pickle.dumps(sheet_df, protocol=pickle.HIGHEST_PROTOCOL)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(payload)))
+    try:
+        shm.buf[:len(payload)] = payload
+        size = len(payload)
+        del payload
+        pool = _get_pool(workers)
+        futures = {pool.submit(_worker_analyze, shm.name, size, i, s, params): i for i, s in enumerate(sections)}
+        try:
+            for fut in as_completed(futures):
+                try:
+                    yield fut.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        _discard_pool(pool)
+                    i = futures[fut]
+                    s = sections[i]
+                    yield i, {
+                        "label": s.get("label"),
+                        "error": str(e),
+                        "header_row": s.get("header_row"),
+                        "start_row": s.get("start_row"),
+                        "end_row": s.get("end_row"),
+                    }
+        finally:
+            # generator bị đóng giữa chừng → hủy các section chưa chạy, đợi section đang chạy
+            # (còn đọc shared memory) trước khi unlink
+            for fut in futures:
+                fut.cancel()
+            for fut in futures:
+                if not fut.cancelled():
+                    try:
+                        fut.exception()
+                    except Exception:
+                        pass
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def summarize_analysis(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Gói kết quả từng section (đúng thứ tự section) thành output của run_analysis."""
     total_rows = int(sum(r.get("rows", 0) for r in results if isinstance(r.get("rows"), int)))
 
     return {
@@ -209,3 +318,22 @@ def run_analysis(
         "total_rows": total_rows,
         "sections": results,
     }
+
+
+def run_analysis(
+    sheet_df: pd.DataFrame,
+    sections: List[Dict[str, Any]],
+    params: Optional[Dict[str, Any]] = None,
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Run analysis for all sections on a single sheet dataframe.
+    - Expects **0-based** validated sections (validate before calling).
+    - workers: process pool size (None → ANALYSIS_WORKERS env, 0/1 → sequential).
+    - Returns a machine-friendly dict.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(sections)
+    with stage("analysis", size=len(sheet_df)):
+        for i, res in iter_analysis(sheet_df, sections, params=params, workers=workers):
+            results[i] = res
+        return summarize_analysis(results)
@@ -1,20 +1,23 @@
 import pandas as pd
-from typing import Optional
+from typing import Any, Dict, Optional
 
-def choose_group_by(df: pd.DataFrame) -> Optional[str]:
+from .column_profile import profile_frame
+
+def choose_group_by(df: pd.DataFrame, profile: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[str]:
     n = len(df)
     if n == 0:
         return None
+    profile = profile if profile is not None else profile_frame(df)
     best = None
     best_score = -1.0
     for col in df.columns:
-        s = df[col]
-        if s.isna().mean() > 0.5:
+        null_rate = profile[col]["null_rate"]
+        if null_rate > 0.5:
             continue
-        ur = s.nunique(dropna=True) / max(1, n)  # unique ratio
+        ur = profile[col]["nunique"] / max(1, n)  # unique ratio
         if ur < 0.02 or ur > 0.6:
             continue
-        score = 1.0 - abs(ur - 0.25) - 0.2 * s.isna().mean()
+        score = 1.0 - abs(ur - 0.25) - 0.2 * null_rate
         if score > best_score:
             best_score = score
             best = col
@@ -1,34 +1,129 @@
 # chat_memory.py
-import json, os
-from collections import defaultdict
+import atexit, json, os, sqlite3, threading, time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Ghi dồn: record được gom trong RAM rồi ghi 1 transaction mỗi HISTORY_FLUSH_MS
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", "200"))
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "user_history.sqlite3")
+LEGACY_JSON_PATH = "user_history.json"
+
 
 class PersistentMemory:
-    def __init__(self, path="user_history.json"):
+    """
+    Lịch sử chat theo user, lưu append-only trong sqlite (1 dòng / record, index theo user_id).
+    - add_record: chỉ đẩy vào buffer; thread nền ghi theo lô (WAL, synchronous=NORMAL).
+    - get_history: chỉ đọc record của 1 user, hỗ trợ offset/limit.
+    - Process không chạy lâu (job nền bị pool kết thúc, atexit không chắc chạy) phải tự gọi flush().
+    """
+
+    def __init__(self, path: str = HISTORY_DB_PATH, flush_ms: int = HISTORY_FLUSH_MS):
         self.path = path
-        self.store = defaultdict(list)
-        self._load()
+        self.flush_interval = max(0, flush_ms) / 1000.0
+        self._con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._pending: List[Tuple[str, str, int]] = []
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._init()
+        self._import_legacy_json()
+        self._writer = threading.Thread(target=self._writer_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _init(self):
+        with self._db_lock, self._con:
+            self._con.execute('PRAGMA journal_mode=WAL')
+            self._con.execute('PRAGMA synchronous=NORMAL')
+            self._con.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS history (
+                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id TEXT NOT NULL,
+                  record TEXT NOT NULL,
+                  created_at INTEGER NOT NULL
+                )
+                '''
+            )
+            self._con.execute('CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id, id)')
+            self._con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _import_legacy_json(self):
+        """
+        Chuyển user_history.json (định dạng cũ) sang sqlite đúng 1 lần rồi đổi tên file.
+        Mọi worker uvicorn / process job đều chạy hàm này lúc import: BEGIN IMMEDIATE + dòng đánh dấu
+        trong bảng meta → chỉ 1 process nhập, các process sau thấy dấu và bỏ qua.
+        """
+        if not os.path.exists(LEGACY_JSON_PATH):
+            return
+        with self._db_lock:
+            self._con.execute('BEGIN IMMEDIATE')
+            try:
+                done = self._con.execute("SELECT 1 FROM meta WHERE key='legacy_json_migrated'").fetchone()
+                if not done:
+                    try:
+                        with open(LEGACY_JSON_PATH, "r", encoding="utf-8") as f:
+                            legacy = json.load(f)
+                    except FileNotFoundError:
+                        legacy = {}  # process khác vừa nhập xong và đổi tên file
+                    now = int(time.time())
+                    rows = [
+                        (str(uid), json.dumps(rec, ensure_ascii=False), now)
+                        for uid, recs in (legacy or {}).items()
+                        for rec in (recs or [])
+                    ]
+                    self._con.executemany('INSERT INTO history(user_id, record, created_at) VALUES (?, ?, ?)', rows)
+                    self._con.execute(
+                        "INSERT INTO meta(key, value) VALUES ('legacy_json_migrated', ?)", (str(int(time.time())),)
+                    )
+                self._con.commit()
+            except Exception as e:
+                self._con.rollback()
+                print(f"[WARN] Không nhập được {LEGACY_JSON_PATH}: {e}")
+                return
+        try:
+            os.replace(LEGACY_JSON_PATH, LEGACY_JSON_PATH + ".migrated")
+        except FileNotFoundError:
+            pass
 
-    def _load(self):
-        if os.path.exists(self.path):
-            with open(self.path, "r", encoding="utf-8") as f:
-                try:
-                    self.store = defaultdict(list, json.load(f))
-                except:
-                    self.store = defaultdict(list)
+    def _writer_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval or None)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARN] Ghi lịch sử thất bại: {e}")
 
-    def _save(self):
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(self.store, f, indent=2, ensure_ascii=False)
+    def flush(self):
+        """Ghi mọi record đang chờ trong 1 transaction."""
+        with self._db_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            with self._con:
+                self._con.executemany('INSERT INTO history(user_id, record, created_at) VALUES (?, ?, ?)', batch)
 
     def add_record(self, user_id, record):
-        self.store[user_id].append(record)
-        self._save()
+        item = (str(user_id), json.dumps(record, ensure_ascii=False), int(time.time()))
+        with self._pending_lock:
+            self._pending.append(item)
+        if self.flush_interval == 0:
+            self._wake.set()
 
-    def get_history(self, user_id):
-        return self.store[user_id]
+    def get_history(self, user_id, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # đọc được cả record vừa add
+        self.flush()
+        with self._db_lock:
+            cur = self._con.execute(
+                'SELECT record FROM history WHERE user_id=? ORDER BY id LIMIT ? OFFSET ?',
+                (str(user_id), -1 if limit is None else int(limit), max(0, int(offset))),
+            )
+            return [json.loads(r[0]) for r in cur.fetchall()]
 
     def reset(self, user_id):
-        self.store[user_id] = []
-        self._save()
+        self.flush()
+        with self._db_lock, self._con:
+            self._con.execute('DELETE FROM history WHERE user_id=?', (str(user_id),))
 
 memory = PersistentMemory()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+
+def _top_from_counts(nn: pd.Series, vc: pd.Series, k: int) -> Dict[str, int]:
+    """
+    Top-k theo chuỗi (giống .astype(str).value_counts(), bỏ "" và "nan")
+    dựng lại từ value_counts trên giá trị gốc. Giá trị bằng nhau khi hash (True/1/1.0)
+    được đếm chung dưới khóa xuất hiện trước.
+    """
+    if vc.empty or k <= 0:
+        return {}
+    keys = vc.index.map(str)
+    if keys.is_unique:
+        counts = pd.Series(vc.to_numpy(), index=keys)
+    else:
+        # hiếm: vd 1 và "1" khác nhau khi đếm gốc nhưng trùng khi ép str → đếm lại trên chuỗi
+        counts = nn.astype(str).value_counts()
+    counts = counts[(counts.index != "") & (counts.index != "nan")]
+    return {str(i): int(v) for i, v in counts.head(k).items()}
+
+
+def profile_column(s: pd.Series, top_k: int = 10) -> Dict[str, Any]:
+    """
+    Profile 1 cột trong 1 lượt: mask NaN 1 lần, value_counts 1 lần
+    (→ nunique + top-k), thống kê số + 3 quantile trong 1 lần np.quantile.
+    """
+    n = len(s)
+    na = s.isna().to_numpy(dtype=bool)
+    null_count = int(na.sum())
+    nn = s[~na]
+    vc = nn.value_counts(sort=True, dropna=True)
+
+    numeric: Optional[Dict[str, float]] = None
+    if is_numeric_dtype(s.dtype) and not is_bool_dtype(s.dtype) and len(nn) > 0:
+        v = nn.to_numpy(dtype=float)
+        q25, med, q75 = np.quantile(v, [0.25, 0.5, 0.75])
+        cnt = int(v.size)
+        numeric = {
+            "count": float(cnt),
+            "mean": float(v.mean()),
+            "std": float(v.std(ddof=1)) if cnt > 1 else 0.0,
+            "min": float(v.min()),
+            "q25": float(q25),
+            "median": float(med),
+            "q75": float(q75),
+            "max": float(v.max()),
+        }
+
+    return {
+        "dtype": str(s.dtype),
+        "rows": n,
+        "null_rate": (null_count / n) if n else 0.0,
+        "nunique": int(len(vc)),
+        "sample": nn.head(5).astype(str).tolist(),
+        "top": _top_from_counts(nn, vc, top_k),
+        "numeric": numeric,
+    }
+
+
+def profile_frame(df: pd.DataFrame, top_k: int = 10) -> Dict[str, Dict[str, Any]]:
+    """Profile mọi cột của 1 region; analyzer và choose_group_by cùng đọc từ đây."""
+    return {col: profile_column(df[col], top_k=top_k) for col in df.columns}
@@ -15,6 +15,8 @@ from typing import Dict, Optional, Any
 import pandas as pd
 from openpyxl import Workbook
 
+from common.metrics import timed
+
 MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 
@@ -28,6 +30,7 @@ def _output_dir() -> str:
     return d
 
 
+@timed("export", size_of=lambda out: os.path.getsize(out["path"]))
 def save_report_excel(
     report: Dict[str, pd.DataFrame] | str,
     session_id: str,
@@ -1,12 +1,14 @@
 import os
 import json
-from typing import Dict, List
-from openai import OpenAI
+from typing import Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from services.llm_client import get_client
+from services.llm_cache import cached_completion, cached_stream
+
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+SYSTEM_PROMPT = "Bạn là trợ lý chuyên viết báo cáo tổng hợp từ dữ liệu bảng biểu."
 
 def _render_group_summary_table(group_by: str, summary: Dict[str, int]) -> str:
     """
@@ -45,18 +47,14 @@ def _prepare_sections_for_llm(analysis_result: Dict) -> List[Dict]:
         })
     return payload
 
-def build_report(analysis_result: Dict) -> str:
-    """
-    Tạo báo cáo tiếng Việt từ output của analyzer (phiên bản mới).
-    - Không yêu cầu analyzer tạo sẵn summary_table nữa.
-    - Dùng group_summary để dựng bảng đơn giản + mô tả tự nhiên nhờ GPT.
-    """
+def _report_messages(analysis_result: Dict) -> Tuple[Optional[List[Dict[str, str]]], Optional[str]]:
+    """Trả (messages cho LLM, None) hoặc (None, thông báo) khi không đủ dữ liệu để lập báo cáo."""
     if not analysis_result or not analysis_result.get("ok"):
-        return " Phân tích không hợp lệ hoặc thiếu dữ liệu."
+        return None, " Phân tích không hợp lệ hoặc thiếu dữ liệu."
 
     sections_payload = _prepare_sections_for_llm(analysis_result)
     if not sections_payload:
-        return " Không có vùng (section) hợp lệ để lập báo cáo."
+        return None, " Không có vùng (section) hợp lệ để lập báo cáo."
 
     # Giới hạn độ dài JSON đưa vào prompt để tránh quá tải ngữ cảnh
     limited = json.dumps(sections_payload, ensure_ascii=False)
@@ -83,15 +81,57 @@ DỮ LIỆU CHI TIẾT CHO TỪNG VÙNG (đã rút gọn):
 {limited}
 """
 
-    try:
-        resp = client.chat.completions.create(
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ], None
+
+def build_report(analysis_result: Dict) -> str:
+    """
+    Tạo báo cáo tiếng Việt từ output của analyzer (phiên bản mới).
+    - Không yêu cầu analyzer tạo sẵn summary_table nữa.
+    - Dùng group_summary để dựng bảng đơn giản + mô tả tự nhiên nhờ GPT.
+    """
+    messages, notice = _report_messages(analysis_result)
+    if notice is not None:
+        return notice
+
+    def _call() -> str:
+        resp = get_client().chat.completions.create(
             model=MODEL,
-            messages=[
-                {"role": "system", "content": "Bạn là trợ lý chuyên viết báo cáo tổng hợp từ dữ liệu bảng biểu."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.2
         )
         return resp.choices[0].message.content.strip()
+
+    try:
+        # Cùng dữ liệu phân tích → cùng prompt → dùng lại báo cáo đã sinh
+        return cached_completion(MODEL, messages, _call, temperature=0.2)
     except Exception as e:
         return f"Lỗi khi sinh báo cáo từ GPT: {e}"
+
+def build_report_stream(analysis_result: Dict) -> Iterator[str]:
+    """
+    Như build_report nhưng yield từng đoạn text ngay khi LLM sinh ra (stream=True).
+    Dùng chung cache với build_report: báo cáo đã có thì yield 1 lần cả bài.
+    """
+    messages, notice = _report_messages(analysis_result)
+    if notice is not None:
+        yield notice
+        return
+
+    def _stream() -> Iterator[str]:
+        resp = get_client().chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=0.2,
+            stream=True
+        )
+        for chunk in resp:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    try:
+        yield from cached_stream(MODEL, messages, _stream, temperature=0.2)
+    except Exception as e:
+        yield f"Lỗi khi sinh báo cáo từ GPT: {e}"
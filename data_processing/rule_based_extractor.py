@@ -1,43 +1,128 @@
+import re
+from typing import Dict, List, Optional
+
 import pandas as pd
 
-def extract_sections_with_rule(df: pd.DataFrame, rule: dict) -> list:
+from common.metrics import stage
+
+
+class RowTextIndex:
+    """
+    Text từng dòng (lower, nối các ô khác NaN bằng " ") tính 1 lần cho cả sheet,
+    dùng lại cho mọi rule áp lên cùng DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.labels = list(df.index)
+        self.texts: List[str] = []
+        self.has_cells: List[bool] = []
+        for row in df.values:
+            cells = [str(x).lower() for x in row if pd.notna(x)]
+            self.texts.append(" ".join(cells))
+            self.has_cells.append(len(cells) > 0)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def section_text(self, start: int, stop: int) -> str:
+        """Text của các dòng [start, stop) — giống nối mọi ô của vùng bằng " "."""
+        return " ".join(t for t, h in zip(self.texts[start:stop], self.has_cells[start:stop]) if h)
+
+
+class KeywordMatcher:
+    """
+    So khớp nhiều keyword 1 lượt trên mỗi dòng, trả bitmap (bit k = keyword k xuất hiện).
+    Regex gộp mọi keyword lọc nhanh các dòng không chứa keyword nào.
+    """
+
+    def __init__(self, keywords: List[str]):
+        self.keywords: List[str] = []
+        self._bit: Dict[str, int] = {}
+        for kw in keywords:
+            if kw not in self._bit:
+                self._bit[kw] = 1 << len(self.keywords)
+                self.keywords.append(kw)
+        pattern = "|".join(re.escape(k) for k in sorted(self.keywords, key=len, reverse=True))
+        self._prefilter = re.compile(pattern) if self.keywords else None
+
+    def mask_of(self, keywords: List[str]) -> int:
+        m = 0
+        for kw in keywords:
+            m |= self._bit.get(kw, 0)
+        return m
+
+    def scan(self, text: str) -> int:
+        if self._prefilter is None or self._prefilter.search(text) is None:
+            return 0
+        m = 0
+        for kw in self.keywords:
+            if kw in text:
+                m |= self._bit[kw]
+        return m
+
+
+def _label_conditions(rule: dict) -> List[tuple]:
+    """[(keyword, label)] theo đúng thứ tự label_keywords, chỉ lấy điều kiện dạng "chứa '...'"."""
+    out = []
+    for condition, name in (rule.get("label_keywords", {}) or {}).items():
+        if "chứa" in condition:
+            out.append((condition.split("chứa")[1].strip(" '\""), name))
+    return out
+
+
+def extract_sections_with_rule(df: pd.DataFrame, rule: dict, index: Optional[RowTextIndex] = None) -> list:
     """
     Dò tìm các section trong file Excel dựa vào rule đã học (start_keywords, end_keywords).
+    index: RowTextIndex dựng sẵn cho df (nếu có) để không phải nối lại text từng dòng.
     """
+    with stage("rule_apply", size=len(df)):
+        return _extract_sections_with_rule(df, rule, index)
+
+
+def _extract_sections_with_rule(df: pd.DataFrame, rule: dict, index: Optional[RowTextIndex] = None) -> list:
+    index = index or RowTextIndex(df)
+    start_kws = list(rule.get("start_keywords", []) or [])
+    end_kws = list(rule.get("end_keywords", []) or [])
+    conditions = _label_conditions(rule)
+
+    matcher = KeywordMatcher(start_kws + end_kws + [kw for kw, _ in conditions])
+    start_mask = matcher.mask_of(start_kws)
+    end_mask = matcher.mask_of(end_kws)
+    row_hits = [matcher.scan(t) for t in index.texts]
+
     sections = []
     current_start = None
 
-    for i, row in df.iterrows():
-        row_text = " ".join(str(x).lower() for x in row if pd.notna(x))
+    for p, label_i in enumerate(index.labels):
+        hits = row_hits[p]
 
-        
-        if any(kw in row_text for kw in rule.get("start_keywords", [])):
-            current_start = i
+        if hits & start_mask:
+            current_start = p
 
-        
-        elif current_start is not None and (
-            any(kw in row_text for kw in rule.get("end_keywords", [])) or row_text.strip() == ""
-        ):
-            header_row = current_start + 1
-            label = None
+        elif current_start is not None and ((hits & end_mask) or index.texts[p].strip() == ""):
+            section_hits = 0
+            for h in row_hits[current_start:p]:
+                section_hits |= h
 
-            
-            section_text = " ".join(
-                str(x).lower()
-                for row_idx in range(current_start, i)
-                for x in df.iloc[row_idx] if pd.notna(x)
-            )
-            for condition, name in rule.get("label_keywords", {}).items():
-                if "chứa" in condition:
-                    keyword = condition.split("chứa")[1].strip(" '\"")
+            label = None
+            section_text = None
+            for keyword, name in conditions:
+                if section_hits & matcher.mask_of([keyword]):
+                    label = name
+                    break
+                # keyword có khoảng trắng có thể nằm vắt qua 2 dòng liền nhau
+                if " " in keyword:
+                    if section_text is None:
+                        section_text = index.section_text(current_start, p)
                     if keyword in section_text:
                         label = name
                         break
 
+            start_label = index.labels[current_start]
             sections.append({
-                "start_row": current_start,
-                "end_row": i - 1,
-                "header_row": header_row,
+                "start_row": start_label,
+                "end_row": label_i - 1,
+                "header_row": start_label + 1,
                 "label": label or "Bảng chưa gán"
             })
             current_start = None
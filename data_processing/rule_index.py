@@ -0,0 +1,129 @@
+from __future__ import annotations
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import hashlib
+import os
+import threading
+import numpy as np
+
+from .rule_memory import rule_store, _safe_user_id
+
+# So khớp rule gần đúng: MinHash + LSH trên chữ ký cấu trúc (token tên cột/header + bố cục).
+# Dùng khi không có rule nào khớp đúng fingerprint (đổi tên 1 cột, thêm cột cuối...).
+# ENV:
+# FUZZY_RULE_MATCH     : 1 = bật (mặc định), 0 = chỉ khớp đúng fingerprint
+# FUZZY_RULE_MIN_SCORE : ngưỡng Jaccard tối thiểu để dùng lại rule (mặc định 0.7)
+FUZZY_RULE_MATCH = os.getenv("FUZZY_RULE_MATCH", "1") != "0"
+FUZZY_RULE_MIN_SCORE = float(os.getenv("FUZZY_RULE_MIN_SCORE", "0.7"))
+
+_PRIME = (1 << 61) - 1
+
+
+def _token_hash(token: str) -> int:
+    # ổn định giữa các process (không dùng hash() của Python)
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little") % _PRIME
+
+
+class MinHashLSH:
+    """
+    MinHash num_perm hàm băm (a*x + b) mod p, chia bands x rows cho LSH.
+    Mặc định 64 = 16 x 4: cặp có Jaccard 0.7 lọt vào ứng viên với xác suất ~0.98.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 7):
+        if num_perm % bands:
+            raise ValueError("num_perm phải chia hết cho bands")
+        rng = np.random.default_rng(seed)
+        self.num_perm, self.bands, self.rows = num_perm, bands, num_perm // bands
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64).astype(object)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64).astype(object)
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [defaultdict(list) for _ in range(bands)]
+
+    def signature(self, tokens: Iterable[str]) -> Tuple[int, ...]:
+        xs = [_token_hash(t) for t in set(tokens)]
+        if not xs:
+            return tuple([_PRIME] * self.num_perm)
+        # object dtype: số nguyên Python → nhân không tràn 64 bit
+        h = (np.outer(np.array(xs, dtype=object), self._a) + self._b) % _PRIME
+        return tuple(int(v) for v in h.min(axis=0))
+
+    def _band_keys(self, sig: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [sig[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def add(self, item: int, sig: Tuple[int, ...]) -> None:
+        for band, key in zip(self._buckets, self._band_keys(sig)):
+            band[key].append(item)
+
+    def query(self, sig: Tuple[int, ...]) -> Set[int]:
+        out: Set[int] = set()
+        for band, key in zip(self._buckets, self._band_keys(sig)):
+            out.update(band.get(key, ()))
+        return out
+
+
+class RuleIndex:
+    """
+    Index các rule đã lưu (có chữ ký cấu trúc), cập nhật lười khi rule_store.generation đổi.
+    Cập nhật chỉ tính MinHash cho cặp (user, fingerprint) mới; chữ ký của 1 fingerprint không đổi
+    nên entry cũ giữ nguyên (dựng lại cả index chỉ khi có cặp biến mất).
+    nearest(): LSH lấy ứng viên → chấm Jaccard chính xác trên tập token → rule tốt nhất >= ngưỡng.
+    """
+
+    def __init__(self, store=rule_store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._lsh = MinHashLSH()
+        self._entries: List[Tuple[str, str, frozenset]] = []
+        self._keys: Set[Tuple[str, str]] = set()
+
+    def _ensure_fresh(self) -> None:
+        gen = self.store.current_generation()
+        with self._lock:
+            if gen == self._generation:
+                return
+            signed = self.store.signed_rules()
+            keys = {(uid, fp) for uid, fp, _ in signed}
+            if self._keys <= keys:
+                lsh, entries = self._lsh, self._entries
+            else:
+                lsh, entries, self._keys = MinHashLSH(), [], set()
+            for uid, fp, tokens in signed:
+                if (uid, fp) in self._keys:
+                    continue
+                # entry trước, LSH sau: nearest() đọc song song không thấy chỉ số chưa có entry
+                entries.append((uid, fp, frozenset(tokens)))
+                lsh.add(len(entries) - 1, lsh.signature(tokens))
+                self._keys.add((uid, fp))
+            self._lsh, self._entries, self._generation = lsh, entries, gen
+
+    def nearest(
+        self,
+        tokens: List[str],
+        user_id: str,
+        fallback_user: str = "default_user",
+        min_score: float = FUZZY_RULE_MIN_SCORE,
+    ) -> Optional[Tuple[str, str, float]]:
+        """Trả (fingerprint, user_id, score) của rule gần nhất; rule của user_id được ưu tiên hơn fallback_user."""
+        if not tokens:
+            return None
+        self._ensure_fresh()
+        query = frozenset(tokens)
+        uids = [_safe_user_id(user_id), _safe_user_id(fallback_user)]
+        with self._lock:
+            lsh, entries = self._lsh, self._entries
+        best: Optional[Tuple[int, float, str, str]] = None
+        for k in lsh.query(lsh.signature(query)):
+            uid, fp, toks = entries[k]
+            if uid not in uids:
+                continue
+            score = len(query & toks) / len(query | toks)
+            rank = uids.index(uid)
+            if score >= min_score and (best is None or (rank, -score) < (best[0], -best[1])):
+                best = (rank, score, fp, uid)
+        if best is None:
+            return None
+        return best[2], best[3], round(best[1], 4)
+
+
+rule_index = RuleIndex()
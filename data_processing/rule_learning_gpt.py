@@ -3,14 +3,16 @@ import os
 from typing import List, Dict, Any, Optional
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI, BadRequestError
+from openai import BadRequestError
 from pydantic import ValidationError
 
 from common.retry import with_backoff
+from common.df_cache import read_table
+from services.llm_client import get_client
+from services.llm_cache import cached_completion
 from .rule_schema import LearnedRule
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 
 SYSTEM_PROMPT = """Bạn là công cụ trích xuất RULE chia section từ bảng Excel sau khi OCR.
@@ -40,6 +42,7 @@ def _extract_json_str(text: str) -> str:
     return text[start:end+1]
 
 def _call_openai_json(user_prompt: str) -> str:
+    client = get_client()
     try:
         resp = client.responses.create(
             model=MODEL,
@@ -81,15 +84,29 @@ def _call_openai_json(user_prompt: str) -> str:
     )
     return resp.choices[0].message.content
 
-def learn_rule(prompt: str) -> dict:
-    raw = with_backoff(lambda: _call_openai_json(prompt))
+def _parse_rule(raw: str) -> dict:
     try:
         data = LearnedRule.model_validate_json(raw)
-        d = data.model_dump()
     except ValidationError:
         js = json.loads(_extract_json_str(raw))
         data = LearnedRule(**js)
-        d = data.model_dump()
+    return data.model_dump()
+
+def _call_and_validate(prompt: str) -> str:
+    raw = with_backoff(lambda: _call_openai_json(prompt))
+    _parse_rule(raw)  # rule hỏng → ném lỗi, không đưa vào cache
+    return raw
+
+def learn_rule(prompt: str) -> dict:
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    raw = cached_completion(
+        MODEL, messages, lambda: _call_and_validate(prompt),
+        temperature=0.2, response_format={"type": "json_object"},
+    )
+    d = _parse_rule(raw)
 
     # Gắn index_base "zero" để downstream KHÔNG trừ 1 ở header_row
     d["index_base"] = "zero"
@@ -98,8 +115,8 @@ def learn_rule(prompt: str) -> dict:
 def _read_df(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
     ext = (file_path or "").lower().split(".")[-1]
     if ext == "csv":
-        return pd.read_csv(file_path)
-    return pd.read_excel(file_path, sheet_name=sheet_name)
+        return read_table(file_path, header=0)
+    return read_table(file_path, sheet_name=sheet_name, header=0)
 
 def _sample_table_context(df: pd.DataFrame, head_rows: int = 20, tail_rows: int = 20) -> str:
     head = df.head(head_rows).to_csv(index=False)
@@ -1,11 +1,24 @@
 import os
+import copy
 import json
+import glob
 import hashlib
-from typing import Optional
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 import re
 
+import pandas as pd
+
+from common.metrics import timed
+
 RULE_DIR = "rule_memory"
+RULE_DB_PATH = os.getenv("RULE_DB_PATH", "rule_memory.sqlite3")
 os.makedirs(RULE_DIR, exist_ok=True)
+# Số dòng đầu sheet đọc để lấy tên cột khi tính fingerprint (không đọc cả sheet)
+FINGERPRINT_SAMPLE_ROWS = int(os.getenv("FINGERPRINT_SAMPLE_ROWS", "50"))
 
 
 def get_fingerprint(df, sheet_name: Optional[str] = None) -> str:
@@ -14,38 +27,415 @@ def get_fingerprint(df, sheet_name: Optional[str] = None) -> str:
     - Danh sách headers (lower + strip)
     - (Tùy chọn) sheet_name để phân biệt rule theo sheet
     """
-    headers = [str(col).strip().lower() for col in df.columns]
+    return _fingerprint_of_columns(df.columns, sheet_name)
+
+
+def _fingerprint_of_columns(columns: Iterable[Any], sheet_name: Optional[str] = None) -> str:
+    headers = [str(col).strip().lower() for col in columns]
     base_str = "|".join(headers)
     if sheet_name:
         base_str = f"{sheet_name.strip().lower()}||{base_str}"
     return hashlib.md5(base_str.encode()).hexdigest()
 
 
+def _norm_token(v: Any) -> str:
+    return " ".join(str(v).strip().lower().split())
+
+
+def _structural_tokens(sample: pd.DataFrame, header: Optional[int], ncols: int) -> List[str]:
+    """
+    Chữ ký cấu trúc của sheet (cho so khớp gần đúng, xem rule_index):
+    tên cột (header=0) + chữ trong tối đa 3 dòng header đầu tiên của mẫu + bố cục (số cột, vị trí header).
+    """
+    from .section_detector import _is_header_row
+
+    toks = set()
+    if header == 0:
+        toks.update(f"h:{_norm_token(c)}" for c in sample.columns if not str(c).startswith("Unnamed: "))
+    first_hdr, hdr_rows = None, 0
+    for i in range(sample.shape[0]):
+        row = sample.iloc[i]
+        if not _is_header_row(row):
+            continue
+        toks.update(f"h:{_norm_token(v)}" for v in row if isinstance(v, str) and len(v.strip()) >= 2)
+        first_hdr = i if first_hdr is None else first_hdr
+        hdr_rows += 1
+        if hdr_rows >= 3:
+            break
+    toks.add(f"ncols:{ncols}")
+    if first_hdr is not None:
+        toks.add(f"hdr_at:{first_hdr}")
+    return sorted(toks)
+
+
+def _plain_cell(v: Any) -> Any:
+    """Giá trị ô của DataFrame header=None → dạng ô thô mà pd.read_excel đưa vào TextParser."""
+    if v is None or (isinstance(v, float) and v != v) or v is pd.NaT:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _frame_head_rows(df: pd.DataFrame, n: int) -> List[List[Any]]:
+    return [[_plain_cell(v) for v in row] for row in df.head(n).astype(object).itertuples(index=False)]
+
+
+def _sample_from_rows(rows: List[List[Any]], header: Optional[int], nrows: int) -> pd.DataFrame:
+    """
+    Dựng mẫu như pd.read_excel(header=header, nrows=nrows) từ các dòng thô:
+    cắt ô trống cuối dòng / dòng trống cuối, đệm cho đều rồi parse bằng TextParser của pandas.
+    """
+    from pandas.errors import EmptyDataError
+    from pandas.io.parsers import TextParser
+
+    rows = [list(r) for r in rows]
+    for r in rows:
+        while r and r[-1] == "":
+            r.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    if not rows:
+        return pd.DataFrame()
+    width = max(len(r) for r in rows)
+    rows = [r + [""] * (width - len(r)) for r in rows]
+    try:
+        return TextParser(rows, header=header, skip_blank_lines=False, nrows=nrows).read(nrows=nrows)
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def _excel_sample(path: str, sheet: Any, header: Optional[int], frame: Optional[pd.DataFrame]) -> Tuple[pd.DataFrame, int]:
+    """
+    (mẫu FINGERPRINT_SAMPLE_ROWS dòng đầu, số cột của cả sheet), không đọc hết sheet:
+    - frame (sheet đã đọc, header=None) hoặc snapshot lúc /upload: lấy vài dòng đầu, độ rộng = số cột;
+    - còn lại: openpyxl read_only đọc n dòng đầu, độ rộng theo thẻ <dimension> (thiếu thẻ → độ rộng mẫu).
+    """
+    from common.df_cache import read_table
+    from common.sheet_snapshot import snapshot_ncols
+    from .stream_loader import head_rows
+
+    n = FINGERPRINT_SAMPLE_ROWS + (0 if header is None else header + 1)
+    if frame is None and snapshot_ncols(path, sheet) is not None:
+        frame = read_table(path, sheet_name=sheet, header=None)
+    if frame is not None:
+        rows, width = _frame_head_rows(frame, n), int(frame.shape[1])
+    else:
+        rows, width = head_rows(path, sheet, n)
+    sample = _sample_from_rows(rows, header, FINGERPRINT_SAMPLE_ROWS)
+    return sample, (width if width is not None else sample.shape[1])
+
+
+def _pad_columns(cols: List[str], width: int, header: Optional[int]) -> List[str]:
+    """Thêm các cột mà mẫu N dòng đầu không thấy, đặt tên như pandas (số thứ tự / "Unnamed: i")."""
+    if header is None:
+        return [str(i) for i in range(max(width, len(cols)))]
+    return cols + [f"Unnamed: {i}" for i in range(len(cols), width)]
+
+
+class _ColumnsMemo:
+    """
+    Tên cột + chữ ký cấu trúc theo (file, sheet, header), lấy từ FINGERPRINT_SAMPLE_ROWS dòng đầu
+    (_excel_sample); độ rộng theo cả sheet để tên cột giống hệt khi đọc đầy đủ.
+    CSV: pandas lấy độ rộng theo dòng đầu nên mẫu là đủ.
+    Key gồm mtime/size như df_cache; file upload đặt tên theo sha256 nên key ~ nội dung file.
+    """
+
+    def __init__(self, max_items: int = 1024):
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple, Tuple[List[str], List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, file_path: str, sheet: Any = 0, header: Optional[int] = None, frame: Optional[pd.DataFrame] = None
+    ) -> Tuple[List[str], List[str], bool]:
+        """
+        Trả (columns, structural_tokens, fresh) — fresh=True khi vừa tính.
+        frame: sheet đã đọc sẵn (header=None) của Excel → không mở lại file.
+        """
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        ext = path.lower().split(".")[-1]
+        key = (path, st.st_mtime_ns, st.st_size, None if ext == "csv" else sheet, header)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                return item[0], item[1], False
+        if ext == "csv":
+            sample = pd.read_csv(path, header=header, nrows=FINGERPRINT_SAMPLE_ROWS)
+            cols = [str(c) for c in sample.columns]
+        else:
+            sample, width = _excel_sample(path, sheet, header, frame)
+            cols = _pad_columns([str(c) for c in sample.columns], width, header)
+        tokens = _structural_tokens(sample, header, len(cols))
+        with self._lock:
+            self._items[key] = (cols, tokens)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return cols, tokens, True
+
+
+_columns_memo = _ColumnsMemo()
+
+
+def _with_sheet_token(tokens: List[str], sheet_name: Optional[str]) -> List[str]:
+    return sorted(set(tokens) | {f"sheet:{_norm_token(sheet_name)}"}) if sheet_name else list(tokens)
+
+
+@timed("fingerprint")
+def fingerprint_candidates(
+    file_path: str, sheet: Any = 0, header: Optional[int] = None, sheet_name: Optional[str] = None,
+    frame: Optional[pd.DataFrame] = None,
+) -> List[str]:
+    """
+    Mọi fingerprint ứng viên của 1 sheet trong 1 lần gọi: [có sheet_name, không sheet_name] (loại trùng).
+    sheet/header = cách đọc sheet (như read_table); sheet_name = nhãn đưa vào fingerprint.
+    Chỉ đọc vài dòng đầu (có memo) → tra rule xong trước khi phải nạp cả sheet;
+    frame = sheet đã đọc sẵn (header=None) thì lấy mẫu từ đó, không mở lại file.
+    Lần đầu gặp sheet: ghi chữ ký cấu trúc của từng fingerprint vào kho rule (cho rule_index).
+    """
+    cols, tokens, fresh = _columns_memo.get(file_path, sheet, header, frame)
+    fps = list(dict.fromkeys([_fingerprint_of_columns(cols, sheet_name), _fingerprint_of_columns(cols)]))
+    if fresh:
+        try:
+            rule_store.save_signatures({
+                _fingerprint_of_columns(cols, sheet_name): _with_sheet_token(tokens, sheet_name),
+                _fingerprint_of_columns(cols): tokens,
+            })
+        except Exception as e:
+            print(f"[WARN] Không lưu được chữ ký cấu trúc: {e}")
+    return fps
+
+
+def sheet_signature(
+    file_path: str, sheet: Any = 0, header: Optional[int] = None, sheet_name: Optional[str] = None,
+    frame: Optional[pd.DataFrame] = None,
+) -> List[str]:
+    """Chữ ký cấu trúc (token) của sheet, cùng memo với fingerprint_candidates."""
+    _, tokens, _ = _columns_memo.get(file_path, sheet, header, frame)
+    return _with_sheet_token(tokens, sheet_name)
+
+
+def file_fingerprint(
+    file_path: str, sheet: Any = 0, header: Optional[int] = None, sheet_name: Optional[str] = None
+) -> str:
+    """Fingerprint để lưu rule: có sheet_name nếu truyền, giống get_fingerprint(df, sheet_name)."""
+    return fingerprint_candidates(file_path, sheet, header, sheet_name)[0]
+
+
 def _safe_user_id(user_id: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_\-]", "_", user_id or "default_user")
 
 
-def _get_rule_file_path(fingerprint: str, user_id: str = "default_user") -> str:
-    safe_uid = _safe_user_id(user_id)
-    return os.path.join(RULE_DIR, f"{safe_uid}_{fingerprint}.json")
+class RuleStore:
+    """
+    Kho rule trong sqlite, khóa (user_id, fingerprint).
+    - Tra cứu có cache trong process (kể cả kết quả "không có"), xóa cache khi save.
+    - Ghi từ process khác được phát hiện qua PRAGMA data_version.
+    - Lần đầu mở DB sẽ nạp các file rule_memory/{user}_{fp}.json cũ (không ghi đè), chỉ 1 lần.
+    - Bảng signatures: chữ ký cấu trúc theo fingerprint (cho so khớp gần đúng ở rule_index).
+    - `generation` chỉ tăng khi tập (rule, chữ ký) mà rule_index thấy có thêm phần tử: rule mới
+      có chữ ký, hoặc chữ ký mới của fingerprint đã có rule. Process khác ghi → đọc bộ đếm
+      meta.index_version; chữ ký của sheet chưa có rule (mỗi lần upload) không làm index cập nhật.
+    """
+
+    def __init__(self, db_path: str = RULE_DB_PATH, legacy_dir: str = RULE_DIR):
+        self._con = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple[str, str], Optional[dict]] = {}
+        self._data_version: Optional[int] = None
+        self._index_version = 0
+        self.generation = 0
+        with self._lock, self._con:
+            self._con.execute('PRAGMA journal_mode=WAL')
+            self._con.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS rules (
+                  user_id TEXT NOT NULL,
+                  fingerprint TEXT NOT NULL,
+                  rule TEXT NOT NULL,
+                  updated_at INTEGER NOT NULL,
+                  PRIMARY KEY (user_id, fingerprint)
+                )
+                '''
+            )
+            self._con.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS signatures (
+                  fingerprint TEXT PRIMARY KEY,
+                  tokens TEXT NOT NULL,
+                  updated_at INTEGER NOT NULL
+                )
+                '''
+            )
+            self._con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._import_legacy(legacy_dir)
+
+    def _import_legacy(self, legacy_dir: str) -> None:
+        """Nạp rule_memory/*.json cũ đúng 1 lần cho mỗi DB (dấu meta.legacy_json_imported), kể cả nhiều process."""
+        with self._lock:
+            if self._con.execute("SELECT 1 FROM meta WHERE key='legacy_json_imported'").fetchone():
+                return
+            self._con.execute('BEGIN IMMEDIATE')
+            try:
+                if not self._con.execute("SELECT 1 FROM meta WHERE key='legacy_json_imported'").fetchone():
+                    self._con.executemany(
+                        'INSERT OR IGNORE INTO rules(user_id, fingerprint, rule, updated_at) VALUES (?, ?, ?, ?)',
+                        self._legacy_rows(legacy_dir),
+                    )
+                    self._con.execute(
+                        "INSERT INTO meta(key, value) VALUES ('legacy_json_imported', ?)", (int(time.time()),)
+                    )
+                self._con.commit()
+            except Exception:
+                self._con.rollback()
+                raise
+
+    @staticmethod
+    def _legacy_rows(legacy_dir: str) -> List[Tuple[str, str, str, int]]:
+        rows = []
+        for path in glob.glob(os.path.join(legacy_dir, "*.json")):
+            name = os.path.basename(path)[:-len(".json")]
+            if "_" not in name:
+                continue
+            uid, fp = name.rsplit("_", 1)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    rule = json.load(f)
+            except Exception as e:
+                print(f"[WARN] Không đọc được rule {path}: {e}")
+                continue
+            rows.append((uid, fp, json.dumps(rule, ensure_ascii=False), int(os.path.getmtime(path))))
+        return rows
+
+    def _read_index_version(self) -> int:
+        row = self._con.execute("SELECT value FROM meta WHERE key='index_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_index_version(self) -> None:
+        # gọi trong transaction đang ghi rule/chữ ký
+        self._con.execute(
+            "INSERT INTO meta(key, value) VALUES ('index_version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        self._index_version = self._read_index_version()
+        self.generation += 1
+
+    def _check_external_writes(self) -> None:
+        # gọi khi đang giữ lock
+        dv = self._con.execute('PRAGMA data_version').fetchone()[0]
+        if dv != self._data_version:
+            self._cache.clear()
+            self._data_version = dv
+            iv = self._read_index_version()
+            if iv != self._index_version:
+                self._index_version = iv
+                self.generation += 1
+
+    def get(self, fingerprint: str, user_id: str = "default_user") -> Optional[dict]:
+        key = (_safe_user_id(user_id), fingerprint)
+        with self._lock:
+            self._check_external_writes()
+            if key in self._cache:
+                return copy.deepcopy(self._cache[key])
+            row = self._con.execute(
+                'SELECT rule FROM rules WHERE user_id=? AND fingerprint=?', key
+            ).fetchone()
+            rule = None
+            if row:
+                try:
+                    rule = json.loads(row[0])
+                except Exception as e:
+                    print(f"[WARN] Không đọc được rule {key}: {e}")
+            self._cache[key] = rule
+            return copy.deepcopy(rule)
+
+    def find(
+        self, fingerprints: Iterable[str], user_id: str, fallback_user: str = "default_user"
+    ) -> Tuple[Optional[dict], Optional[str], Optional[str]]:
+        """
+        Tìm theo thứ tự: (user_id, fp_1..n) → (fallback_user, fp_1..n).
+        Trả về (rule, matched_fp, matched_uid).
+        """
+        fps = list(fingerprints)
+        uids = [user_id] if user_id == fallback_user else [user_id, fallback_user]
+        for uid in uids:
+            for fp in fps:
+                rule = self.get(fp, user_id=uid)
+                if rule:
+                    return rule, fp, uid
+        return None, None, None
+
+    @timed("sqlite.rule_save")
+    def save(self, fingerprint: str, rule: dict, user_id: str = "default_user") -> None:
+        key = (_safe_user_id(user_id), fingerprint)
+        with self._lock, self._con:
+            is_new = self._con.execute('SELECT 1 FROM rules WHERE user_id=? AND fingerprint=?', key).fetchone() is None
+            self._con.execute(
+                '''
+                INSERT INTO rules(user_id, fingerprint, rule, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, fingerprint) DO UPDATE SET rule=excluded.rule, updated_at=excluded.updated_at
+                ''',
+                key + (json.dumps(rule, ensure_ascii=False), int(time.time())),
+            )
+            self._cache.pop(key, None)
+            # sửa rule đã có không đổi tập (user, fingerprint, chữ ký) của index
+            if is_new and self._con.execute('SELECT 1 FROM signatures WHERE fingerprint=?', (fingerprint,)).fetchone():
+                self._bump_index_version()
+
+    def save_signatures(self, signatures: Dict[str, List[str]]) -> None:
+        """{fingerprint: tokens}; chữ ký đã có thì giữ nguyên (cùng fingerprint ~ cùng cấu trúc)."""
+        if not signatures:
+            return
+        now = int(time.time())
+        marks = ",".join("?" * len(signatures))
+        with self._lock, self._con:
+            known = {r[0] for r in self._con.execute(
+                f'SELECT fingerprint FROM signatures WHERE fingerprint IN ({marks})', list(signatures)
+            )}
+            new = [fp for fp in signatures if fp not in known]
+            if not new:
+                return
+            self._con.executemany(
+                'INSERT INTO signatures(fingerprint, tokens, updated_at) VALUES (?, ?, ?)',
+                [(fp, json.dumps(signatures[fp], ensure_ascii=False), now) for fp in new],
+            )
+            # chỉ báo index khi fingerprint đó đã có rule (sheet mới upload thường chưa có)
+            marks = ",".join("?" * len(new))
+            if self._con.execute(f'SELECT 1 FROM rules WHERE fingerprint IN ({marks}) LIMIT 1', new).fetchone():
+                self._bump_index_version()
+
+    def current_generation(self) -> int:
+        with self._lock:
+            self._check_external_writes()
+            return self.generation
+
+    def signed_rules(self) -> List[Tuple[str, str, List[str]]]:
+        """(user_id, fingerprint, tokens) của mọi rule đã có chữ ký cấu trúc."""
+        with self._lock:
+            cur = self._con.execute(
+                'SELECT r.user_id, r.fingerprint, s.tokens FROM rules r JOIN signatures s ON s.fingerprint = r.fingerprint'
+            )
+            return [(uid, fp, json.loads(toks)) for uid, fp, toks in cur.fetchall()]
+
+    def list_fingerprints(self, user_id: str) -> List[str]:
+        with self._lock:
+            cur = self._con.execute(
+                'SELECT fingerprint FROM rules WHERE user_id=? ORDER BY fingerprint', (_safe_user_id(user_id),)
+            )
+            return [r[0] for r in cur.fetchall()]
+
+
+rule_store = RuleStore()
 
 
 def save_rule_for_fingerprint(fingerprint: str, rule: dict, user_id: str = "default_user") -> None:
-    file_path = _get_rule_file_path(fingerprint, user_id)
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(rule, f, indent=2, ensure_ascii=False)
+        rule_store.save(fingerprint, rule, user_id=user_id)
     except Exception as e:
         raise RuntimeError(f"Lỗi lưu rule: {e}")
 
 
 def get_rule_for_fingerprint(fingerprint: str, user_id: str = "default_user") -> Optional[dict]:
-    file_path = _get_rule_file_path(fingerprint, user_id)
-    if not os.path.exists(file_path):
-        return None
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[WARN] Không đọc được rule {file_path}: {e}")
-        return None
+    return rule_store.get(fingerprint, user_id=user_id)
@@ -1,9 +1,14 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import base64
+import numpy as np
 import pandas as pd
 import math
 import re
 
+from common.metrics import stage
+
+
 def _is_header_row(row: pd.Series, min_text_cells: int = 2) -> bool:
     """
     Heuristic: dòng header có >= min_text_cells ô text (dài >=2),
@@ -40,16 +45,97 @@ def _is_data_row(row: pd.Series, min_non_empty: int = 2) -> bool:
                 return True
     return False
 
-def detect_sections_auto(df: pd.DataFrame) -> List[Dict[str, Any]]:
+def _column_signals(col: pd.Series, row_is_object: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    Phát hiện section tự động với **0-based** và **end_row inclusive**.
-    Mỗi phần tử trả về có dạng:
-      { "start_row": int, "end_row": int, "header_row": int, "label": "Section k" }
+    Tín hiệu theo từng ô của 1 cột, khớp đúng cách _is_header_row/_is_data_row nhìn ô đó
+    khi duyệt df.iloc[i]:
+      (is_na, non_empty, is_num, is_text2)
     """
-    sections: List[Dict[str, Any]] = []
-    n = len(df)
+    is_na = col.isna().to_numpy(dtype=bool)
+    kind = col.dtype.kind if isinstance(col.dtype, np.dtype) else "O"
+    n = len(col)
+
+    if kind == "f":
+        # float / np.float64 đều là float → luôn tính là ô số
+        not_na = ~is_na
+        return is_na, not_na, not_na, np.zeros(n, dtype=bool)
+    if kind in "iu" and not row_is_object:
+        # hàng thuần số → pandas trả int/float Python khi duyệt
+        ones = np.ones(n, dtype=bool)
+        return is_na, ones, ones, np.zeros(n, dtype=bool)
+    if kind in "iu":
+        # hàng object → ô là np.int64 (không phải int) nên bị coi là text nếu dài >= 2
+        lens = col.astype(str).str.len().to_numpy()
+        return is_na, np.ones(n, dtype=bool), np.zeros(n, dtype=bool), lens >= 2
+    if kind in "bMm":
+        # bool / Timestamp / Timedelta: không phải số, chuỗi luôn dài >= 2
+        not_na = ~is_na
+        return is_na, not_na, np.zeros(n, dtype=bool), not_na.copy()
+
+    # object / extension dtype: kiểm tra từng giá trị (1 lượt qua cột, không qua iloc)
+    values = col.to_numpy(dtype=object)
+    non_empty = np.zeros(n, dtype=bool)
+    is_num = np.zeros(n, dtype=bool)
+    is_text2 = np.zeros(n, dtype=bool)
+    for k in np.flatnonzero(~is_na):
+        v = values[k]
+        s = str(v).strip()
+        if s == "":
+            continue
+        non_empty[k] = True
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            is_num[k] = True
+        elif len(s) >= 2:
+            is_text2[k] = True
+    return is_na, non_empty, is_num, is_text2
+
+
+def compute_row_signals(
+    df: pd.DataFrame, min_text_cells: int = 2, min_non_empty: int = 2
+) -> Dict[str, np.ndarray]:
+    """
+    Phân loại toàn bộ dòng bằng vài lượt NumPy theo cột.
+    Trả về mảng bool độ dài len(df):
+      - blank : dòng trống hoàn toàn (row.isna().all())
+      - header: tương đương _is_header_row(row)
+      - data  : tương đương _is_data_row(row)
+    """
+    n, m = df.shape
+    na_cnt = np.zeros(n, dtype=np.int32)
+    non_empty_cnt = np.zeros(n, dtype=np.int32)
+    num_cnt = np.zeros(n, dtype=np.int32)
+    text_cnt = np.zeros(n, dtype=np.int32)
     if n == 0:
-        return sections
+        empty = np.zeros(0, dtype=bool)
+        return {"blank": empty, "header": empty, "data": empty}
+
+    row_is_object = df.iloc[0].dtype == object
+    for j in range(m):
+        is_na, non_empty, is_num, is_text2 = _column_signals(df.iloc[:, j], row_is_object)
+        na_cnt += is_na
+        non_empty_cnt += non_empty & ~is_na
+        num_cnt += is_num & ~is_na
+        text_cnt += is_text2 & ~is_na
+
+    return {
+        "blank": na_cnt == m,
+        "header": (text_cnt >= min_text_cells) & (num_cnt == 0),
+        "data": non_empty_cnt >= min_non_empty,
+    }
+
+
+def sections_from_signals(
+    blank: Sequence[bool], header: Sequence[bool], data: Sequence[bool]
+) -> List[Dict[str, Any]]:
+    """
+    Máy trạng thái chia section trên các mảng tín hiệu dòng.
+    **0-based**, **end_row inclusive**, label "Section k".
+    """
+    blank = list(map(bool, blank))
+    header = list(map(bool, header))
+    data = list(map(bool, data))
+    sections: List[Dict[str, Any]] = []
+    n = len(blank)
 
     in_section = False
     header_row: Optional[int] = None
@@ -57,10 +143,8 @@ def detect_sections_auto(df: pd.DataFrame) -> List[Dict[str, Any]]:
     section_id = 1
 
     for i in range(n):
-        row = df.iloc[i]
-
-        # Dòng trống hoàn toàn (kết thúc section hiện tại nếu có)
-        if row.isna().all():
+        # Dòng trống hoàn toàn hoặc dòng không đủ dữ liệu khi đang trong section → đóng section
+        if blank[i] or (in_section and not data[i]):
             if in_section and start_row is not None:
                 end_row = i - 1  # inclusive 0-based
                 if end_row >= start_row:
@@ -71,40 +155,18 @@ def detect_sections_auto(df: pd.DataFrame) -> List[Dict[str, Any]]:
                         "label": f"Section {section_id}"
                     })
                     section_id += 1
-                # reset
-                in_section = False
-                header_row = None
-                start_row = None
-            continue
-
-        if not in_section:
-            # mở section nếu phát hiện header
-            if _is_header_row(row):
-                in_section = True
-                header_row = i
-                start_row = i + 1  # dữ liệu bắt đầu sau header
-            # nếu chưa thấy header thì bỏ qua
-            continue
-
-        # đang trong section
-        if not _is_data_row(row):
-            # gặp một dòng không đủ dữ liệu → đóng section tới i-1
-            if start_row is not None:
-                end_row = i - 1
-                if end_row >= start_row:
-                    sections.append({
-                        "start_row": start_row,
-                        "end_row": end_row,
-                        "header_row": header_row if header_row is not None else start_row,
-                        "label": f"Section {section_id}"
-                    })
-                    section_id += 1
             # reset
             in_section = False
             header_row = None
             start_row = None
             continue
 
+        if not in_section and header[i]:
+            # mở section nếu phát hiện header; dữ liệu bắt đầu sau header
+            in_section = True
+            header_row = i
+            start_row = i + 1
+
     # Nếu còn section dở dang tới cuối bảng
     if in_section and start_row is not None:
         end_row = n - 1
@@ -117,3 +179,59 @@ def detect_sections_auto(df: pd.DataFrame) -> List[Dict[str, Any]]:
             })
 
     return sections
+
+
+def detect_sections_auto(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Phát hiện section tự động với **0-based** và **end_row inclusive**.
+    Mỗi phần tử trả về có dạng:
+      { "start_row": int, "end_row": int, "header_row": int, "label": "Section k" }
+    """
+    if len(df) == 0:
+        return []
+    with stage("detect", size=len(df)):
+        sig = compute_row_signals(df)
+        return sections_from_signals(sig["blank"], sig["header"], sig["data"])
+
+
+_SIGNAL_KEYS = ("blank", "header", "data")
+
+
+def pack_row_signals(sig: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Nén tín hiệu dòng (1 bit/dòng, base64) để lưu kèm session: {"nrows", "blank", "header", "data"}."""
+    out: Dict[str, Any] = {"nrows": int(len(sig["blank"]))}
+    for k in _SIGNAL_KEYS:
+        out[k] = base64.b64encode(np.packbits(np.asarray(sig[k], dtype=bool)).tobytes()).decode("ascii")
+    return out
+
+
+def unpack_row_signals(packed: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    n = int(packed["nrows"])
+    return {
+        k: np.unpackbits(np.frombuffer(base64.b64decode(packed[k]), dtype=np.uint8), count=n).astype(bool)
+        for k in _SIGNAL_KEYS
+    }
+
+
+def sections_in_window(sig: Dict[str, np.ndarray], lo: int, hi: int) -> Tuple[int, int, List[Dict[str, Any]]]:
+    """
+    Chạy lại máy trạng thái chỉ quanh dòng lo..hi của tín hiệu đã có.
+    Cửa sổ được nới tới dòng trống gần nhất mỗi phía (dòng trống luôn reset trạng thái)
+    → kết quả trùng đúng các section của detect_sections_auto nằm trong cửa sổ.
+    Trả (lo, hi, sections) — chỉ số theo sheet (0-based), label đánh lại từ "Section 1".
+    """
+    blank = sig["blank"]
+    n = len(blank)
+    lo, hi = max(0, lo), min(hi, n - 1)
+    if hi < lo:
+        return lo, hi, []
+    prev = np.flatnonzero(blank[:lo])
+    lo = int(prev[-1]) if len(prev) else 0
+    nxt = np.flatnonzero(blank[hi + 1:])
+    hi = hi + 1 + int(nxt[0]) if len(nxt) else n - 1
+    found = sections_from_signals(*(sig[k][lo:hi + 1] for k in _SIGNAL_KEYS))
+    for s in found:
+        s["start_row"] += lo
+        s["end_row"] += lo
+        s["header_row"] += lo
+    return lo, hi, found
@@ -0,0 +1,248 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import os
+import numpy as np
+import pandas as pd
+
+from common.metrics import timed
+from .section_detector import sections_from_signals
+
+# Đọc Excel rất lớn theo kiểu streaming (openpyxl read_only): phát hiện section
+# mà không dựng cả DataFrame, rồi chỉ nạp giá trị của các dòng thuộc section để phân tích.
+# ENV:
+# STREAM_LOADER_MIN_MB : file .xlsx/.xlsm từ ngưỡng này (MB) trở lên đi đường streaming (0 = tắt)
+STREAM_LOADER_MIN_MB = float(os.getenv("STREAM_LOADER_MIN_MB", "50"))
+
+_STREAM_EXTS = ("xlsx", "xlsm")
+
+try:
+    from pandas._libs.parsers import STR_NA_VALUES as _NA_STRINGS
+except Exception:  # pandas đổi chỗ hằng số → dùng bộ mặc định của read_excel
+    _NA_STRINGS = {
+        "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+        "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    }
+
+
+def should_stream(file_path: str, min_mb: float = STREAM_LOADER_MIN_MB) -> bool:
+    """File Excel (openpyxl) đủ lớn để không nên parse cả sheet vào RAM."""
+    ext = (file_path or "").lower().split(".")[-1]
+    if min_mb <= 0 or ext not in _STREAM_EXTS:
+        return False
+    try:
+        return os.path.getsize(file_path) >= min_mb * 1024 * 1024
+    except OSError:
+        return False
+
+
+def _convert_cell(cell) -> Any:
+    """Giống pd.read_excel (engine openpyxl): số nguyên → int, ô lỗi / chuỗi NA → None."""
+    v = cell.value
+    if v is None:
+        return None
+    dt = getattr(cell, "data_type", None)
+    if dt == "e":
+        return None
+    if dt == "n" and isinstance(v, (int, float)) and not isinstance(v, bool):
+        iv = int(v)
+        return iv if iv == v else float(v)
+    if isinstance(v, str) and v in _NA_STRINGS:
+        return None
+    return v
+
+
+def sheet_names(file_path: str) -> List[str]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, keep_links=False)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def head_rows(file_path: str, sheet_name: Any = 0, n: int = 50) -> Tuple[List[List[Any]], Optional[int]]:
+    """
+    n dòng đầu của sheet, ô giống pd.read_excel trước khi parse (ô trống = "", số nguyên → int),
+    kèm số cột theo thẻ <dimension> của sheet (None nếu file không ghi) — không duyệt cả sheet.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        if isinstance(sheet_name, int):
+            ws = wb.worksheets[sheet_name]
+        else:
+            if sheet_name not in wb.sheetnames:
+                raise ValueError(f"Worksheet named '{sheet_name}' not found")
+            ws = wb[sheet_name]
+        width = ws.max_column
+        rows: List[List[Any]] = []
+        for row in ws.iter_rows(max_row=n):
+            rows.append([_raw_cell(c) for c in row])
+        return rows, (int(width) if width else None)
+    finally:
+        wb.close()
+
+
+def _raw_cell(cell) -> Any:
+    """Như engine openpyxl của pandas: chưa áp chuỗi NA (TextParser làm), ô trống = ""."""
+    v = cell.value
+    if v is None:
+        return ""
+    dt = getattr(cell, "data_type", None)
+    if dt == "e":
+        return np.nan
+    if dt == "n" and isinstance(v, (int, float)) and not isinstance(v, bool):
+        iv = int(v)
+        return iv if iv == v else float(v)
+    return v
+
+
+def iter_sheet_rows(file_path: str, sheet_name: Any = 0) -> Iterator[List[Any]]:
+    """
+    Duyệt từng dòng của 1 sheet (0-based theo thứ tự dòng Excel), không giữ workbook trong RAM.
+    Mỗi dòng là list giá trị đã bỏ các ô trống ở cuối; None = ô trống/NA
+    (ô NA/lỗi ở cuối vẫn giữ chỗ, như pandas tính độ rộng/dòng có dữ liệu).
+    Các dòng trống ở cuối sheet vẫn được yield (caller tự cắt như pandas).
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        if isinstance(sheet_name, int):
+            ws = wb.worksheets[sheet_name]
+        else:
+            if sheet_name not in wb.sheetnames:
+                raise ValueError(f"Worksheet named '{sheet_name}' not found")
+            ws = wb[sheet_name]
+        ws.reset_dimensions()
+        for row in ws.rows:
+            width = len(row)
+            while width and row[width - 1].value is None:
+                width -= 1
+            yield [_convert_cell(c) for c in row[:width]]
+    finally:
+        wb.close()
+
+
+def _row_signals(values: List[Any]) -> Tuple[int, int, int]:
+    """(non_empty, num, text2) của 1 dòng, cùng tiêu chí với _is_header_row/_is_data_row."""
+    non_empty = num = text2 = 0
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, float) and np.isnan(v):
+            continue
+        s = str(v).strip()
+        if s == "":
+            continue
+        non_empty += 1
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            num += 1
+        elif len(s) >= 2:
+            text2 += 1
+    return non_empty, num, text2
+
+
+@timed("parse_stream", size_of=lambda sig: sig["nrows"])
+def scan_sheet(
+    file_path: str,
+    sheet_name: Any = 0,
+    header: Optional[int] = None,
+    min_text_cells: int = 2,
+    min_non_empty: int = 2,
+) -> Dict[str, Any]:
+    """
+    1 lượt streaming qua sheet → tín hiệu dòng (giống compute_row_signals) + kích thước.
+    header=0: dòng đầu là tên cột (như read_excel(header=0)), các chỉ số dòng bắt đầu từ dòng 2.
+    Trả về:
+      { "blank","header","data": np.ndarray[bool], "nrows": int, "ncols": int }
+    """
+    blank: List[bool] = []
+    is_header: List[bool] = []
+    is_data: List[bool] = []
+    ncols = 0
+    last_with_data = -1
+
+    for i, values in enumerate(iter_sheet_rows(file_path, sheet_name)):
+        if header == 0 and i == 0:
+            ncols = len(values)
+            continue
+        ncols = max(ncols, len(values))
+        if values:
+            last_with_data = len(blank)
+        non_empty, num, text2 = _row_signals(values)
+        blank.append(non_empty == 0)
+        is_header.append(text2 >= min_text_cells and num == 0)
+        is_data.append(non_empty >= min_non_empty)
+
+    n = last_with_data + 1  # cắt dòng trống cuối sheet như pandas
+    return {
+        "blank": np.asarray(blank[:n], dtype=bool),
+        "header": np.asarray(is_header[:n], dtype=bool),
+        "data": np.asarray(is_data[:n], dtype=bool),
+        "nrows": n,
+        "ncols": ncols,
+    }
+
+
+def detect_sections_streaming(file_path: str, sheet_name: Any = 0, header: Optional[int] = None) -> List[Dict[str, Any]]:
+    """detect_sections_auto cho file lớn: cùng máy trạng thái, tín hiệu lấy từ scan_sheet."""
+    sig = scan_sheet(file_path, sheet_name, header=header)
+    return sections_from_signals(sig["blank"], sig["header"], sig["data"])
+
+
+def section_rows(sections: Iterable[Dict[str, Any]], pad: int = 1) -> List[Tuple[int, int]]:
+    """
+    Các khoảng dòng [header_row - pad, end_row] (inclusive) cần nạp cho danh sách section.
+    pad=1 để vẫn đủ dòng khi caller quy đổi 1-based → 0-based sau khi đã nạp.
+    """
+    ranges: List[Tuple[int, int]] = []
+    for s in sections:
+        lo = min(int(s.get("header_row", 0)), int(s.get("start_row", 0))) - pad
+        hi = int(s.get("end_row", 0))
+        if hi >= 0:
+            ranges.append((max(0, lo), hi))
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in ranges:
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+@timed("parse_stream", size_of=len)
+def load_rows(
+    file_path: str,
+    sheet_name: Any,
+    ranges: List[Tuple[int, int]],
+    nrows: int,
+    ncols: int,
+) -> pd.DataFrame:
+    """
+    DataFrame đủ nrows x ncols (vị trí dòng/cột như read_excel(header=None)) nhưng chỉ
+    các dòng trong `ranges` có giá trị; dòng còn lại là NaN (1 con trỏ/ô, không parse).
+    Analyzer/validator dùng iloc trên khung này y như trên sheet đầy đủ.
+    """
+    arr = np.full((nrows, ncols), np.nan, dtype=object)
+    k = 0
+    for i, values in enumerate(iter_sheet_rows(file_path, sheet_name)):
+        while k < len(ranges) and i > ranges[k][1]:
+            k += 1
+        if k >= len(ranges) or i >= nrows:
+            break
+        if i < ranges[k][0]:
+            continue
+        for j, v in enumerate(values[:ncols]):
+            if v is not None:
+                arr[i, j] = v
+    return pd.DataFrame(arr).infer_objects()
+
+
+def load_sections_frame(file_path: str, sheet_name: Any, sections: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Khung sheet chỉ chứa giá trị các dòng thuộc `sections` (2 lượt streaming: kích thước, rồi giá trị)."""
+    sig = scan_sheet(file_path, sheet_name)
+    return load_rows(file_path, sheet_name, section_rows(sections), sig["nrows"], sig["ncols"])
@@ -1,16 +1,26 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
 import os
+import time
 
 
 from controllers.extractor_controller import router as extractor_router
-from controllers.section_confirm_controller import router as confirm_router
+from controllers.section_confirm_controller import router as confirm_router, confirm_protocol
 from controllers.chat_controller import router as chat_router
 from controllers.pipeline_controller import router as pipeline_router 
 from controllers.rules_controller import router as rules_router
 from controllers.section_confirm_controller import router as sections_router
+from controllers.jobs_controller import router as jobs_router
+from controllers.profiles_controller import router as profiles_router
+from common.job_queue import job_queue, worker_pool
+from common.concurrency import run_in_pool
+from services.llm_cache import llm_cache
+from data_processing.analyzer import shutdown_pool as shutdown_analysis_pool
+from services.intent_llm import intent_stats
+from common import metrics, profiler
 
 
 try:
@@ -45,9 +55,68 @@ OUTPUT_DIR = os.getenv("OUTPUT_DIR", os.path.join(os.getcwd(), "output"))
 os.makedirs(OUTPUT_DIR, exist_ok=True)          
 app.mount("/static", StaticFiles(directory=OUTPUT_DIR), name="static")
 
+def _endpoint_of(request: Request) -> str:
+    """"METHOD /route/{param}" (đường dẫn mẫu của route, không phải URL thật) để label không nở theo id."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return f"{request.method} {getattr(route, 'path', request.url.path)}"
+    return f"{request.method} <unmatched>"
+
+
+@app.middleware("http")
+async def _metrics_scope(request: Request, call_next):
+    # mọi công đoạn đo trong request (kể cả trên run_in_pool) được gắn label endpoint này
+    endpoint = _endpoint_of(request)
+    t0 = time.perf_counter()
+    with metrics.endpoint_scope(endpoint):
+        try:
+            return await call_next(request)
+        finally:
+            metrics.observe_request(endpoint, time.perf_counter() - t0)
+
+
+if profiler.PROFILE_REQUESTS:
+    # chỉ đăng ký khi bật → tắt thì không có middleware, không thread lấy mẫu
+    @app.middleware("http")
+    async def _profile_request(request: Request, call_next):
+        forced = request.headers.get(profiler.PROFILE_HEADER, "") not in ("", "0")
+        if not profiler.wants_profile(request.headers):
+            return await call_next(request)
+        prof = profiler.begin(_endpoint_of(request), forced)
+        t0 = time.perf_counter()
+        try:
+            response = await call_next(request)
+        except Exception:
+            profiler.end(prof, (time.perf_counter() - t0) * 1000.0, 500)
+            raise
+        if forced:
+            response.headers["X-Profile-Id"] = prof.id
+
+        # dừng khi gửi xong body (kể cả /final/stream), không phải lúc có header
+        body = response.body_iterator
+
+        async def _until_sent():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                ms = (time.perf_counter() - t0) * 1000.0
+                await run_in_pool("io", profiler.end, prof, ms, response.status_code)
+
+        response.body_iterator = _until_sent()
+        return response
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 def health():
-    return {"ok": True, "service": APP_NAME, "version": APP_VER}
+    return {"ok": True, "service": APP_NAME, "version": APP_VER, "llm_cache": llm_cache.stats(),
+            "intent": intent_stats.stats(), "protocols": {"confirm_sections": confirm_protocol()}}
 
 
 @app.exception_handler(Exception)
@@ -65,6 +134,25 @@ app.include_router(sections_router, prefix="", tags=["sections"])
 app.include_router(chat_router,      prefix="", tags=["chat"])
 app.include_router(confirm_router,   prefix="", tags=["confirm"])
 app.include_router(pipeline_router,  prefix="", tags=["final"])
+app.include_router(jobs_router,      prefix="", tags=["jobs"])
+app.include_router(profiles_router,  prefix="", tags=["profiles"])
+
+
+@app.on_event("startup")
+def _resume_jobs():
+    # còn job dở từ lần chạy trước → bật worker ngay, không đợi job mới
+    if job_queue.has_pending():
+        worker_pool.ensure_started()
+
+
+@app.on_event("shutdown")
+def _stop_jobs():
+    worker_pool.shutdown()
+
+
+@app.on_event("shutdown")
+def _stop_analysis_pool():
+    shutdown_analysis_pool()
 
 
 if history_router is not None:
@@ -73,7 +161,7 @@ if history_router is not None:
 
 @app.get("/")
 def index():
-    endpoints = ["/upload", "/preview", "/chat", "/confirm_sections", "/final", "/health", "/static/<file>"]
+    endpoints = ["/upload", "/upload/raw", "/preview", "/preview/batch", "/chat", "/confirm_sections", "/final", "/final/stream", "/jobs/confirm_sections", "/jobs/final", "/jobs/{job_id} (GET/DELETE)", "/health", "/metrics", "/profiles", "/profiles/{name}", "/static/<file>"]
     if history_router is not None:
         endpoints.extend(["/history/{user_id} (GET)", "/history/{user_id} (DELETE)"])
     return {
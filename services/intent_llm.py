@@ -1,5 +1,15 @@
-from typing import Dict, Any
-from services.llm_client import call_llm_json
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+from services.llm_client import call_llm_json, call_llm_json_async
+from services.intent_rules import parse_intent_local
+
+# ENV:
+# INTENT_FAST_PATH=0             : tắt parser cục bộ, mọi câu đều gọi LLM
+# INTENT_LOCAL_MIN_CONFIDENCE    : ngưỡng tin cậy để dùng kết quả cục bộ (mặc định 0.8)
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") == "1"
+INTENT_LOCAL_MIN_CONFIDENCE = float(os.getenv("INTENT_LOCAL_MIN_CONFIDENCE", "0.8"))
 
 # Danh sách intent và yêu cầu schema đầu ra:
 _INTENT_LIST = [
@@ -93,13 +103,7 @@ def _messages_for(text: str):
         {"role": "user", "content": _USER_TMPL % text.strip()},
     ]
 
-def parse_intent_llm(text: str) -> Dict[str, Any]:
-    """
-    Trả {"intent": ..., "arguments": {...}} từ LLM.
-    Không chắc thì 'unknown'.
-    """
-    messages = _messages_for(text or "")
-    result = call_llm_json(messages)
+def _normalize_result(result: Dict[str, Any]) -> Dict[str, Any]:
     # Vệ sinh nhẹ: ép section_ids sang dạng S#
     try:
         if result.get("intent") == "merge_sections":
@@ -126,3 +130,75 @@ def parse_intent_llm(text: str) -> Dict[str, Any]:
     if result.get("intent") not in _INTENT_LIST + ["unknown"]:
         return {"intent": "unknown", "arguments": {}}
     return result
+
+def parse_intent_llm(text: str) -> Dict[str, Any]:
+    """
+    Trả {"intent": ..., "arguments": {...}} từ LLM.
+    Không chắc thì 'unknown'.
+    """
+    messages = _messages_for(text or "")
+    return _normalize_result(call_llm_json(messages))
+
+async def parse_intent_llm_async(text: str) -> Dict[str, Any]:
+    """Bản async của parse_intent_llm (không chặn event loop)."""
+    messages = _messages_for(text or "")
+    return _normalize_result(await call_llm_json_async(messages))
+
+
+class IntentStats:
+    """Đếm số lần + tổng thời gian theo nhánh: local (parser cục bộ) / llm."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {"local": [0, 0.0], "llm": [0, 0.0]}
+
+    def record(self, path: str, seconds: float) -> None:
+        with self._lock:
+            slot = self._paths[path]
+            slot[0] += 1
+            slot[1] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(n for n, _ in self._paths.values())
+            out: Dict[str, Any] = {
+                path: {"count": n, "avg_ms": round(sec * 1000 / n, 3) if n else 0.0}
+                for path, (n, sec) in self._paths.items()
+            }
+            out["local_hit_rate"] = round(self._paths["local"][0] / total, 4) if total else 0.0
+            return out
+
+
+intent_stats = IntentStats()
+
+def _try_local(text: str) -> Optional[Dict[str, Any]]:
+    if not INTENT_FAST_PATH:
+        return None
+    t0 = time.perf_counter()
+    result = parse_intent_local(text)
+    if result and result.get("confidence", 0.0) >= INTENT_LOCAL_MIN_CONFIDENCE:
+        intent_stats.record("local", time.perf_counter() - t0)
+        return _normalize_result(result)
+    return None
+
+def parse_intent(text: str) -> Dict[str, Any]:
+    """
+    Parser cục bộ trước (câu ngắn, đúng mẫu), không đủ tin cậy mới gọi LLM.
+    """
+    local = _try_local(text or "")
+    if local is not None:
+        return local
+    t0 = time.perf_counter()
+    result = parse_intent_llm(text)
+    intent_stats.record("llm", time.perf_counter() - t0)
+    return result
+
+async def parse_intent_async(text: str) -> Dict[str, Any]:
+    """Bản async của parse_intent."""
+    local = _try_local(text or "")
+    if local is not None:
+        return local
+    t0 = time.perf_counter()
+    result = await parse_intent_llm_async(text)
+    intent_stats.record("llm", time.perf_counter() - t0)
+    return result
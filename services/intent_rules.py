@@ -0,0 +1,284 @@
+"""
+Bộ parse intent cục bộ (không gọi LLM) cho các câu lệnh ngắn, đúng mẫu.
+- Chuẩn hóa: bỏ dấu tiếng Việt, lower, số viết bằng chữ → chữ số ("hai mươi lăm" → 25),
+  "section 3" / "phần 3" / "s3" → s3, khoảng "10-25" / "10..25" / "10—25" → 10 - 25.
+- Mỗi intent trong _INTENT_LIST có vài mẫu regex khớp TOÀN BỘ câu; khớp được thì trả
+  kết quả kèm "confidence". Không khớp → None (để LLM xử lý).
+- Nhãn / tên cột lấy lại từ câu gốc (giữ dấu, hoa thường).
+"""
+import re
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ---------- Chuẩn hóa ----------
+
+_TOKEN_RE = re.compile(r"\d+|\w+|[^\w\s]+")
+_DASHES = set("-–—~→")
+_DROP_CHARS = set(",;!?=<>:\"“”'‘’«»`")
+_QUOTES = "\"“”'‘’«»` "
+
+
+def _strip_accents(s: str) -> str:
+    out = []
+    for ch in s:
+        if ch in "đĐ":
+            out.append("d")
+            continue
+        base = unicodedata.normalize("NFD", ch)[0]
+        out.append(base.lower())
+    return "".join(out)
+
+
+_UNITS = {"khong": 0, "mot": 1, "hai": 2, "ba": 3, "bon": 4, "bay": 7, "tam": 8, "chin": 9}
+# Từ chỉ là số khi có dấu hoặc đứng sau "mươi"/"trăm" (tránh nhầm "từ", "sau", "năm"...)
+_ACCENTED_UNITS = {"tư": 4, "năm": 5, "sáu": 6, "lăm": 5, "mốt": 1}
+_TAIL_UNITS = {"tu": 4, "nam": 5, "lam": 5, "sau": 6}
+
+
+class _Tok:
+    __slots__ = ("text", "norm", "start", "end")
+
+    def __init__(self, text: str, norm: str, start: int, end: int):
+        self.text, self.norm, self.start, self.end = text, norm, start, end
+
+
+def _tokenize(text: str) -> List[_Tok]:
+    toks: List[_Tok] = []
+    for m in _TOKEN_RE.finditer(text):
+        raw = m.group(0)
+        norm = _strip_accents(raw)
+        if not norm.isalnum():
+            if all(ch in _DASHES for ch in norm) or norm in ("..", "...", "->", "-->", "=>"):
+                norm = "-"
+            elif all(ch in _DROP_CHARS or unicodedata.category(ch).startswith("S") for ch in norm):
+                continue
+        toks.append(_Tok(raw, norm, m.start(), m.end()))
+    return toks
+
+
+def _unit_value(tok: _Tok, after_tens: bool) -> Optional[int]:
+    low = tok.text.lower()
+    if low in _ACCENTED_UNITS:
+        return _ACCENTED_UNITS[low]
+    if tok.norm in _UNITS:
+        return _UNITS[tok.norm]
+    if after_tens and tok.norm in _TAIL_UNITS:
+        return _TAIL_UNITS[tok.norm]
+    return None
+
+
+def _read_number(toks: List[_Tok], i: int) -> Tuple[Optional[int], int]:
+    """Đọc số viết bằng chữ bắt đầu tại toks[i]. Trả (giá trị, số token đã dùng)."""
+    total, cur, j, last = 0, None, i, None  # last: "unit" | "muoi" | "tram" | "linh"
+    while j < len(toks):
+        n = toks[j].norm
+        if n == "muoi" and last in (None, "unit", "tram"):
+            total += (cur if cur is not None else 1) * 10
+            cur, last = None, "muoi"
+        elif n == "tram" and last == "unit":
+            total += cur * 100
+            cur, last = None, "tram"
+        elif n in ("linh", "le") and last == "tram":
+            last = "linh"
+        else:
+            val = _unit_value(toks[j], after_tens=last in ("muoi", "tram", "linh"))
+            if val is None or last == "unit":
+                break
+            # "không" chỉ là số 0 khi đứng riêng (tránh "không đồng ý")
+            if toks[j].norm == "khong" and (last is not None or j + 1 < len(toks) and toks[j + 1].norm.isalpha()):
+                break
+            cur, last = val, "unit"
+        j += 1
+    if last in (None, "linh"):
+        return None, 0
+    return total + (cur or 0), j - i
+
+
+_SECTION_WORDS = {"section", "sec", "phan", "vung", "muc", "bang"}
+_SID_RE = re.compile(r"(?:s|sec|section)(\d+)")
+
+
+def _canonicalize(text: str) -> Tuple[str, List[Tuple[int, int]], List[_Tok]]:
+    """
+    Trả (chuỗi chuẩn hóa, span gốc của từng từ trong chuỗi chuẩn hóa, tokens).
+    Span giúp lấy lại nhãn/tên cột nguyên văn từ câu gốc.
+    """
+    toks = _tokenize(text)
+    words: List[str] = []
+    spans: List[Tuple[int, int]] = []
+    i = 0
+    while i < len(toks):
+        t = toks[i]
+        val, used = _read_number(toks, i) if not t.norm.isdigit() else (int(t.norm), 1)
+        if val is not None:
+            words.append(str(val)); spans.append((t.start, toks[i + used - 1].end))
+            i += used
+            continue
+        m = _SID_RE.fullmatch(t.norm)
+        if m:
+            words.append(f"s{int(m.group(1))}"); spans.append((t.start, t.end))
+            i += 1
+            continue
+        if t.norm in _SECTION_WORDS and i + 1 < len(toks):
+            nxt = toks[i + 1]
+            val, used = (int(nxt.norm), 1) if nxt.norm.isdigit() else _read_number(toks, i + 1)
+            if val is not None:
+                words.append(f"s{val}"); spans.append((t.start, toks[i + used].end))
+                i += 1 + used
+                continue
+        words.append(t.norm); spans.append((t.start, t.end))
+        i += 1
+    return " ".join(words), spans, toks
+
+
+# ---------- Ngữ pháp ----------
+
+_LEAD_FILLER = re.compile(r"^(?:(?:hay|giup|minh|toi|em|anh|chi|ban|vui long|lam on|please|can|muon|cho)\s+)+")
+_TAIL_FILLER = re.compile(r"(?:\s+(?:nhe|nha|nhen|di|voi|luon|giup|gium|minh|toi|em|please|thanks|cam on|dum))+$")
+# nhãn / tên cột chứa từ khóa lệnh khác hoặc S# → có thể là câu ghép ("nhóm S3 theo A và xóa S2")
+_COMPOUND = re.compile(r"\b(?:s\d+|xoa|gop|merge|doi ten|rename|nhom|group|bat dau|ket thuc|header|remove|delete)\b")
+_COMPOUND_PENALTY = 0.5
+
+SID = r"s(\d+)"            # section có tiền tố: s3 / section 3 / phần 3
+SIDX = r"s?(\d+)"          # chấp nhận cả số trần "3" (khi động từ đã rõ nghĩa)
+N = r"(\d+)"
+ROW = r"(?:(?:dong|hang|row|line)\s+)?(?:(?:so|thu)\s+)?"
+SEP = r"(?:-|den|toi|to)"
+TEXT = r"(.+)"
+
+_HEADER = r"(?:(?:dat|set|chon|doi)\s+)?(?:dong\s+)?(?:header|tieu de)(?:\s+(?:row|line))?"
+_MERGE = r"(?:gop|merge|hop nhat|join|gom|noi)(?:\s+lai)?"
+_RENAME = r"(?:doi ten|rename|dat ten|dat nhan|gan nhan|label)"
+_REMOVE = r"(?:xoa|xoa bo|loai|loai bo|bo|remove|delete|huy)"
+_START = r"(?:bat dau|start|khoi dau)"
+_END = r"(?:ket thuc|end|dung)"
+_GROUP = r"(?:nhom|group(?:\s+by)?|gom nhom|phan nhom)"
+_ALL = r"(?:tat ca|toan bo|moi|all|dong loat|het)"
+_SECTIONS = r"(?:\s+(?:cac\s+)?(?:sections?|phan|vung|bang))?"
+_BY_COL = r"(?:\s+theo)?(?:\s+cot)?"
+
+
+def _row_or_top(v: str) -> int:
+    return 0 if v.startswith("dau") else int(v)
+
+
+def _sid(v: str) -> str:
+    return f"S{int(v)}"
+
+
+# (intent, regex, confidence, builder(match, text_of_group) -> arguments)
+Builder = Callable[[re.Match, Callable[[int], str]], Dict[str, Any]]
+_RULES: List[Tuple[str, str, float, Builder]] = [
+    ("confirm",
+     r"(?:ok(?:e|ay|ie)?|dong y|chot|chap nhan|chuan|ap dung|xac nhan|duyet|yes|confirm|apply)(?:\s+(?:roi|ok|chot|luon|nhe))*",
+     1.0, lambda m, g: {}),
+    ("show_preview",
+     r"(?:xem(?:\s+thu)?|preview|kiem tra|test|show|hien thi)(?:\s+(?:lai|preview|ket qua|thu|truoc|bang|du lieu|sections?))*",
+     1.0, lambda m, g: {}),
+    ("set_section_range",
+     rf"(?:(?:dat|set|chinh)\s+)?(?:(?:khoang|range|pham vi)\s+)?(?:(?:cho|cua)\s+)?{SID}\s+(?:(?:la|range|tu|khoang)\s+)*{ROW}{N}\s+{SEP}\s+{ROW}{N}",
+     1.0, lambda m, g: {"section_id": _sid(m.group(1)), "start_row": int(m.group(2)), "end_row": int(m.group(3))}),
+    ("set_section_range",
+     rf"(?:tu\s+)?{ROW}{N}\s+{SEP}\s+{ROW}{N}\s+(?:(?:cho|cua|la)\s+)?{SID}",
+     1.0, lambda m, g: {"section_id": _sid(m.group(3)), "start_row": int(m.group(1)), "end_row": int(m.group(2))}),
+    ("set_start_row",
+     rf"(?:(?:dat|set)\s+)?(?:start(?:\s+row)?|dong {_START}|{_START})\s+(?:(?:cua|cho)\s+)?{SID}\s+(?:(?:la|tu|o|tai|from|at)\s+)*{ROW}(\d+|dau(?: bang)?)",
+     1.0, lambda m, g: {"section_id": _sid(m.group(1)), "start_row": _row_or_top(m.group(2))}),
+    ("set_start_row",
+     rf"{SID}\s+(?:(?:dat|set)\s+)?(?:{_START}|start row)\s+(?:(?:la|tu|o|tai|from|at)\s+)*{ROW}(\d+|dau(?: bang)?)",
+     1.0, lambda m, g: {"section_id": _sid(m.group(1)), "start_row": _row_or_top(m.group(2))}),
+    ("set_end_row",
+     rf"(?:(?:dat|set)\s+)?(?:end(?:\s+row)?|dong {_END}|{_END})\s+(?:(?:cua|cho)\s+)?{SID}\s+(?:(?:la|o|tai|den|at)\s+)*{ROW}{N}",
+     1.0, lambda m, g: {"section_id": _sid(m.group(1)), "end_row": int(m.group(2))}),
+    ("set_end_row",
+     rf"{SID}\s+(?:(?:dat|set)\s+)?(?:{_END}|end row|den|toi)\s+(?:(?:la|o|tai|den|at)\s+)*{ROW}{N}",
+     1.0, lambda m, g: {"section_id": _sid(m.group(1)), "end_row": int(m.group(2))}),
+    ("set_header_row",
+     rf"{_HEADER}\s+(?:(?:la|o|tai|thanh)\s+)*{ROW}{N}",
+     1.0, lambda m, g: {"header_row": int(m.group(1))}),
+    ("set_header_row",
+     rf"{ROW}{N}\s+la\s+(?:dong\s+)?(?:header|tieu de)",
+     1.0, lambda m, g: {"header_row": int(m.group(1))}),
+    ("merge_sections",
+     rf"{_MERGE}\s+({SIDX}(?:\s+(?:(?:va|voi|and|&|\+)\s+)?{SIDX})+)(?:\s+lai)?(?:\s+(?:thanh|lam)\s+(?:1|mot))?",
+     0.95, lambda m, g: {"section_ids": [_sid(x) for x in re.findall(r"\d+", m.group(1))]}),
+    ("rename_section",
+     rf"{_RENAME}\s+(?:(?:cho|cua)\s+)?{SIDX}\s+(?:(?:thanh|la|sang|to|moi)\s+)*{TEXT}",
+     0.9, lambda m, g: {"section_id": _sid(m.group(1)), "label": g(2)}),
+    ("rename_section",
+     rf"{SID}\s+{_RENAME}\s+(?:(?:thanh|la|sang|to|moi)\s+)*{TEXT}",
+     0.9, lambda m, g: {"section_id": _sid(m.group(1)), "label": g(2)}),
+    ("remove_section",
+     rf"{_REMOVE}\s+(?:di\s+)?{SIDX}(?:\s+di)?",
+     0.95, lambda m, g: {"section_id": _sid(m.group(1))}),
+    ("set_group_by_all",
+     rf"(?:(?:dat|set)\s+)?{_ALL}{_SECTIONS}\s+(?:deu\s+)?(?:{_GROUP}|gop){_BY_COL}\s+{TEXT}",
+     0.9, lambda m, g: {"column": g(1)}),
+    ("set_group_by_all",
+     rf"(?:(?:dat|set)\s+)?(?:{_GROUP}|gop)\s+(?:cho\s+)?{_ALL}{_SECTIONS}{_BY_COL}(?:\s+la)?\s+{TEXT}",
+     0.9, lambda m, g: {"column": g(1)}),
+    ("set_group_by_all",
+     rf"(?:{_GROUP}|gop){_BY_COL}\s+{TEXT}\s+cho\s+{_ALL}{_SECTIONS}",
+     0.9, lambda m, g: {"column": g(1)}),
+    ("set_group_by",
+     rf"{_GROUP}\s+(?:(?:cho|cua)\s+)?{SIDX}{_BY_COL}\s+{TEXT}",
+     0.9, lambda m, g: {"section_id": _sid(m.group(1)), "column": g(2)}),
+    ("set_group_by",
+     rf"gop\s+(?:(?:cho|cua)\s+)?{SIDX}\s+theo(?:\s+cot)?\s+{TEXT}",
+     0.9, lambda m, g: {"section_id": _sid(m.group(1)), "column": g(2)}),
+    ("set_group_by",
+     rf"{SID}\s+(?:{_GROUP}|gop){_BY_COL}\s+{TEXT}",
+     0.9, lambda m, g: {"section_id": _sid(m.group(1)), "column": g(2)}),
+    ("set_group_by",
+     rf"(?:{_GROUP}|gop){_BY_COL}\s+{TEXT}\s+cho\s+{SID}",
+     0.9, lambda m, g: {"section_id": _sid(m.group(2)), "column": g(1)}),
+]
+_COMPILED = [(intent, re.compile(rx), conf, build) for intent, rx, conf, build in _RULES]
+
+
+def _original_text(text: str, canon: str, spans: List[Tuple[int, int]], start: int, end: int) -> str:
+    """Cắt đoạn nguyên văn tương ứng với canon[start:end]."""
+    first = canon.count(" ", 0, start)
+    last = first + canon[start:end].count(" ")
+    raw = text[spans[first][0]:spans[last][1]]
+    # giữ ngoặc đóng ngay sau nếu có ngoặc mở bên trong
+    tail = spans[last][1]
+    while tail < len(text) and text[tail] in ")]}" and raw.count("([{"[")]}".index(text[tail])]) > raw.count(text[tail]):
+        raw += text[tail]
+        tail += 1
+    return raw.strip(_QUOTES)
+
+
+def parse_intent_local(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse không cần LLM. Trả {"intent", "arguments", "confidence"} hoặc None nếu không khớp mẫu nào.
+    """
+    if not text or not text.strip():
+        return None
+    canon, spans, _ = _canonicalize(text)
+    # bỏ lời đệm đầu/cuối câu, ghi nhớ offset để còn map ngược
+    lead = _LEAD_FILLER.match(canon)
+    offset = lead.end() if lead else 0
+    body = canon[offset:]
+    tail = _TAIL_FILLER.search(body)
+    if tail and tail.start() > 0:
+        body = body[:tail.start()]
+    if not body:
+        return None
+
+    for intent, rx, conf, build in _COMPILED:
+        m = rx.fullmatch(body)
+        if not m:
+            continue
+
+        def group_text(k: int, m=m) -> str:
+            return _original_text(text, canon, spans, offset + m.start(k), offset + m.end(k))
+
+        args = build(m, group_text)
+        texts = [args[k] for k in ("label", "column") if k in args]
+        if any(not v.strip() for v in texts):
+            continue
+        if any(_COMPOUND.search(_canonicalize(v)[0]) for v in texts):
+            conf *= _COMPOUND_PENALTY
+        return {"intent": intent, "arguments": args, "confidence": conf}
+    return None
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from common.concurrency import run_in_pool
+
+# ENV:
+# LLM_CACHE_PATH        : file sqlite lưu cache (mặc định llm_cache.sqlite3)
+# LLM_CACHE_TTL_S       : thời gian sống của 1 response (giây), mặc định 7 ngày
+# LLM_CACHE_MAX_ENTRIES : số response tối đa, vượt thì xóa bản ít dùng nhất
+# LLM_CACHE_DISABLED=1  : tắt cache
+# LLM_OFFLINE=1         : cache luôn tắt — response giả lập không được đọc/ghi vào cache của client thật
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL_S = int(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "0") == "1"
+LLM_OFFLINE = os.getenv("LLM_OFFLINE", "0") == "1"
+
+
+def cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: Optional[float] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+) -> str:
+    """sha256 của (model, messages, temperature, response_format) dạng JSON chuẩn hóa."""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "response_format": response_format,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Cache response LLM (text) lưu sqlite, có TTL và giới hạn số bản ghi (LRU theo last_used)."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl_s: int = LLM_CACHE_TTL_S,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        enabled: bool = not (LLM_CACHE_DISABLED or LLM_OFFLINE),
+    ):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute('PRAGMA journal_mode=WAL')
+            self._con.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                  key TEXT PRIMARY KEY,
+                  response TEXT NOT NULL,
+                  created_at INTEGER NOT NULL,
+                  last_used INTEGER NOT NULL
+                )
+                '''
+            )
+            self._con.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_used ON llm_cache(last_used)')
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = int(time.time())
+        with self._lock, self._con:
+            row = self._con.execute('SELECT response, created_at FROM llm_cache WHERE key=?', (key,)).fetchone()
+            if row and now - int(row[1]) <= self.ttl_s:
+                self._con.execute('UPDATE llm_cache SET last_used=? WHERE key=?', (now, key))
+                self.hits += 1
+                return row[0]
+            if row:
+                self._con.execute('DELETE FROM llm_cache WHERE key=?', (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        if not self.enabled:
+            return
+        now = int(time.time())
+        with self._lock, self._con:
+            self._con.execute(
+                'REPLACE INTO llm_cache(key, response, created_at, last_used) VALUES (?, ?, ?, ?)',
+                (key, response, now, now),
+            )
+            self._con.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl_s,))
+            n = self._con.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+            if n > self.max_entries:
+                cur = self._con.execute(
+                    'DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)',
+                    (n - self.max_entries,),
+                )
+                self.evictions += cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock, self._con:
+            self._con.execute('DELETE FROM llm_cache')
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "offline": LLM_OFFLINE,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+llm_cache = LLMCache()
+
+
+def cached_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    call: Callable[[], str],
+    temperature: Optional[float] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Trả response text từ cache nếu prompt trùng khớp, ngược lại gọi `call()` rồi lưu.
+    Lỗi trong `call()` được ném ra nguyên vẹn và không bị cache.
+    """
+    key = cache_key(model, messages, temperature, response_format)
+    hit = llm_cache.get(key)
+    if hit is not None:
+        return hit
+    text = call()
+    if text is not None:
+        llm_cache.put(key, text)
+    return text
+
+
+async def acached_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    call: Callable[[], Awaitable[str]],
+    temperature: Optional[float] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Bản async của cached_completion (truy cập sqlite trên pool "io")."""
+    key = cache_key(model, messages, temperature, response_format)
+    hit = await run_in_pool("io", llm_cache.get, key)
+    if hit is not None:
+        return hit
+    text = await call()
+    if text is not None:
+        await run_in_pool("io", llm_cache.put, key, text)
+    return text
+
+
+def cached_stream(
+    model: str,
+    messages: List[Dict[str, str]],
+    stream: Callable[[], Iterator[str]],
+    temperature: Optional[float] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+) -> Iterator[str]:
+    """
+    Bản stream của cached_completion: cache hit → yield cả response 1 lần;
+    miss → yield từng đoạn của `stream()` và chỉ lưu khi stream chạy hết không lỗi.
+    Text lưu được strip() để trùng khóa/giá trị với cached_completion.
+    """
+    key = cache_key(model, messages, temperature, response_format)
+    hit = llm_cache.get(key)
+    if hit is not None:
+        yield hit
+        return
+    parts: List[str] = []
+    for piece in stream():
+        parts.append(piece)
+        yield piece
+    llm_cache.put(key, "".join(parts).strip())
@@ -1,45 +1,148 @@
 import os
 import json
+import time
+import functools
+import inspect
 from typing import Dict, Any, List, Optional
 
 # Mặc định dùng OpenAI official SDK v1 (pip install openai>=1.40)
-from openai import OpenAI, APIError, RateLimitError, APITimeoutError
+from openai import OpenAI, AsyncOpenAI, APIError, RateLimitError, APITimeoutError
+
+from common.concurrency import llm_slot
+from common.metrics import observe, count_tokens
+from services.llm_cache import cached_completion, acached_completion
+from services.llm_stub import OfflineLLMClient, AsyncOfflineLLMClient
 
 # ENV:
 # OPENAI_API_KEY=<...>
 # OPENAI_BASE_URL (tuỳ chọn, nếu dùng proxy/gateway)
 # OPENAI_MODEL=gpt-4o-mini (hoặc gpt-4o, gpt-4.1, v.v.)
 # LLM_PROVIDER=openai (tương lai có thể thêm azure/openrouter)
+# LLM_OFFLINE=1 → dùng client giả lập (services/llm_stub.py), không gọi mạng
 
 _DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 _BASE_URL = os.getenv("OPENAI_BASE_URL", None)
+_OFFLINE = os.getenv("LLM_OFFLINE", "0") == "1"
+_JSON_FORMAT = {"type": "json_object"}
 
 _client: Optional[OpenAI] = None
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def _record_llm(stage_name: str, kwargs: Dict[str, Any], resp: Any, seconds: float) -> None:
+    """Thời gian 1 lời gọi LLM + token từ resp.usage (chat: prompt/completion, responses: input/output)."""
+    usage = getattr(resp, "usage", None)
+    prompt = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None)
+    completion = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None)
+    total = (prompt or 0) + (completion or 0)
+    # stream=True: chỉ đo tới lúc nhận được stream (chưa có usage)
+    name = f"{stage_name}_stream" if kwargs.get("stream") else stage_name
+    observe(name, seconds, total or None)
+    count_tokens(kwargs.get("model", ""), prompt, completion)
+
+
+def _timed_create(create, stage_name: str):
+    """Bọc hàm create của SDK; create async (AsyncOpenAI) → đo tới khi await xong."""
+    @functools.wraps(create)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        resp = create(*args, **kwargs)
+        if inspect.isawaitable(resp):
+            async def finish():
+                out = await resp
+                _record_llm(stage_name, kwargs, out, time.perf_counter() - t0)
+                return out
+            return finish()
+        _record_llm(stage_name, kwargs, resp, time.perf_counter() - t0)
+        return resp
+    return wrapper
+
 
-def _get_client() -> OpenAI:
+def _instrument(client):
+    """Bọc chat.completions.create / responses.create của client (đo mọi lời gọi LLM ở 1 chỗ)."""
+    completions = client.chat.completions
+    completions.create = _timed_create(completions.create, "llm.chat")
+    responses = getattr(client, "responses", None)
+    if responses is not None:
+        responses.create = _timed_create(responses.create, "llm.responses")
+    return client
+
+
+def get_client() -> OpenAI:
+    """Client OpenAI dùng chung cho mọi module (hoặc client offline khi LLM_OFFLINE=1)."""
     global _client
     if _client is None:
-        if _BASE_URL:
+        if _OFFLINE:
+            _client = OfflineLLMClient()
+        elif _BASE_URL:
             _client = OpenAI(base_url=_BASE_URL, api_key=os.getenv("OPENAI_API_KEY"))
         else:
             _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        _instrument(_client)
     return _client
 
+def get_async_client() -> AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        if _OFFLINE:
+            _async_client = AsyncOfflineLLMClient()
+        elif _BASE_URL:
+            _async_client = AsyncOpenAI(base_url=_BASE_URL, api_key=os.getenv("OPENAI_API_KEY"))
+        else:
+            _async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        _instrument(_async_client)
+    return _async_client
+
+def _checked_json(content: Optional[str]) -> str:
+    content = content or "{}"
+    json.loads(content)  # JSON hỏng → ném lỗi, không đưa vào cache
+    return content
+
 def call_llm_json(messages: List[Dict[str, str]], model: Optional[str] = None, timeout: int = 20) -> Dict[str, Any]:
     """
     Gọi LLM và kỳ vọng trả JSON. Dùng response_format={"type":"json_object"} để ép JSON.
+    Prompt trùng khớp được trả từ cache (services/llm_cache.py).
     Trả dict đã parse. Nếu lỗi → {"intent":"unknown","arguments":{}}.
     """
-    client = _get_client()
-    try:
+    client = get_client()
+    model = model or _DEFAULT_MODEL
+
+    def _call() -> str:
         resp = client.chat.completions.create(
-            model=model or _DEFAULT_MODEL,
+            model=model,
             messages=messages,
-            response_format={"type": "json_object"},
+            response_format=_JSON_FORMAT,
             temperature=0.0,
             timeout=timeout,
         )
-        content = resp.choices[0].message.content or "{}"
+        return _checked_json(resp.choices[0].message.content)
+
+    try:
+        content = cached_completion(model, messages, _call, temperature=0.0, response_format=_JSON_FORMAT)
+        return json.loads(content)
+    except (APIError, RateLimitError, APITimeoutError, ValueError, json.JSONDecodeError):
+        return {"intent": "unknown", "arguments": {}}
+
+async def call_llm_json_async(messages: List[Dict[str, str]], model: Optional[str] = None, timeout: int = 20) -> Dict[str, Any]:
+    """
+    Bản async của call_llm_json (AsyncOpenAI), giới hạn song song bởi LLM_CONCURRENCY.
+    """
+    client = get_async_client()
+    model = model or _DEFAULT_MODEL
+
+    async def _call() -> str:
+        async with llm_slot():
+            resp = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format=_JSON_FORMAT,
+                temperature=0.0,
+                timeout=timeout,
+            )
+        return _checked_json(resp.choices[0].message.content)
+
+    try:
+        content = await acached_completion(model, messages, _call, temperature=0.0, response_format=_JSON_FORMAT)
         return json.loads(content)
     except (APIError, RateLimitError, APITimeoutError, ValueError, json.JSONDecodeError):
         return {"intent": "unknown", "arguments": {}}
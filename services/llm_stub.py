@@ -0,0 +1,80 @@
+"""
+Client LLM giả lập (không gọi mạng) để chạy/test offline: LLM_OFFLINE=1.
+Có cùng bề mặt API đang dùng trong repo:
+  client.chat.completions.create(...) -> .choices[0].message.content
+  client.chat.completions.create(..., stream=True) -> các chunk .choices[0].delta.content
+  client.responses.create(...)        -> .output_text
+  .usage: số token ước lượng theo số từ (để /metrics có số liệu khi chạy offline)
+"""
+import json
+import re
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# chỉ giữ N lời gọi gần nhất (server chạy offline lâu không phình RAM)
+MAX_RECORDED_CALLS = 200
+
+Responder = Callable[[List[Dict[str, str]], Dict[str, Any]], str]
+
+
+def default_responder(messages: List[Dict[str, str]], kwargs: Dict[str, Any]) -> str:
+    fmt = kwargs.get("response_format") or {}
+    if fmt.get("type") == "json_object":
+        return json.dumps({"intent": "unknown", "arguments": {}})
+    return "[offline] Báo cáo giả lập (LLM_OFFLINE=1)."
+
+
+def _words(messages: List[Dict[str, str]]) -> int:
+    return sum(len(str(m.get("content", "")).split()) for m in messages)
+
+
+class _Completions:
+    def __init__(self, owner: "OfflineLLMClient"):
+        self._owner = owner
+
+    def create(self, model: str = "", messages: Optional[List[Dict[str, str]]] = None, **kwargs):
+        self._owner.calls.append({"model": model, "messages": messages or [], **kwargs})
+        content = self._owner.responder(messages or [], kwargs)
+        if kwargs.get("stream"):
+            return [
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+                for piece in re.findall(r"\S+\s*", content)
+            ]
+        prompt, completion = _words(messages or []), len(content.split())
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion),
+        )
+
+
+class _Responses:
+    def __init__(self, owner: "OfflineLLMClient"):
+        self._owner = owner
+
+    def create(self, model: str = "", input: Optional[List[Dict[str, str]]] = None, **kwargs):
+        self._owner.calls.append({"model": model, "messages": input or [], **kwargs})
+        content = self._owner.responder(input or [], kwargs)
+        return SimpleNamespace(
+            output_text=content,
+            usage=SimpleNamespace(input_tokens=_words(input or []), output_tokens=len(content.split())),
+        )
+
+
+class OfflineLLMClient:
+    def __init__(self, responder: Optional[Responder] = None):
+        self.responder: Responder = responder or default_responder
+        self.calls: Deque[Dict[str, Any]] = deque(maxlen=MAX_RECORDED_CALLS)
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.responses = _Responses(self)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model: str = "", messages: Optional[List[Dict[str, str]]] = None, **kwargs):
+        return _Completions.create(self, model=model, messages=messages, **kwargs)
+
+
+class AsyncOfflineLLMClient(OfflineLLMClient):
+    def __init__(self, responder: Optional[Responder] = None):
+        super().__init__(responder)
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(self))
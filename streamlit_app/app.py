@@ -237,7 +237,34 @@ with rf1:
         if not sid:
             st.warning("Chưa có session_id. Upload trước đã.")
         else:
-            r = api.run_final(sid, uid, sheet)
+            status = st.empty()
+            report_box = st.empty()
+            sections_out: list = []
+            tokens: list = []
+            r: dict = {}
+            analysis: dict = {}
+            for ev in api.run_final_stream(sid, uid, sheet):
+                kind = ev.pop("event", None)
+                if kind == "start":
+                    sections_out = [None] * int(ev.get("sections_count") or 0)
+                    status.info(f"Đang phân tích {len(sections_out)} section...")
+                elif kind == "section":
+                    sections_out[ev["index"]] = ev["result"]
+                    done = sum(1 for x in sections_out if x is not None)
+                    status.info(f"Đã phân tích {done}/{len(sections_out)} section...")
+                elif kind == "analysis":
+                    status.info("Đang viết báo cáo...")
+                    analysis = {"ok": True, **ev, "sections": sections_out}
+                elif kind == "report_token":
+                    tokens.append(ev.get("text", ""))
+                    report_box.markdown("".join(tokens))
+                elif kind == "export":
+                    status.info("Đã xuất file Excel, đang lưu rule...")
+                elif kind in ("done", "error"):
+                    r = ev
+            status.empty()
+            if r.get("ok"):
+                r.setdefault("data", {}).update({"analysis": analysis, "report": "".join(tokens).strip()})
             st.session_state.final_result = r
 
 res = st.session_state.get("final_result") or {}
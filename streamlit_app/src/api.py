@@ -1,78 +1,183 @@
 import os
-import mimetypes
+import atexit
+import threading
 import httpx
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 from dotenv import load_dotenv
 import json as _json
 
 load_dotenv()
 BASE = os.getenv("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+# ENV:
+# API_MAX_CONNECTIONS : số kết nối tối đa tới BE (dùng chung cho mọi rerun của Streamlit trong process)
+# API_KEEPALIVE_S     : giữ kết nối rảnh bao lâu để tái sử dụng
+# API_HTTP2           : 1 = bật HTTP/2 nếu có gói h2 (pip install "httpx[http2]"), 0 = tắt
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "10"))
+API_KEEPALIVE_S = float(os.getenv("API_KEEPALIVE_S", "60"))
+API_HTTP2 = os.getenv("API_HTTP2", "1") == "1"
+
+# Timeout theo endpoint (prefix dài nhất khớp trước), đặt theo việc BE làm trước khi trả lời;
+# connect ngắn để BE chết thì báo lỗi ngay. Hết giờ → {"ok": False, "code": "TIMEOUT"}, không ném lỗi.
+_CONNECT_S = 5.0
+_TIMEOUTS: Dict[str, httpx.Timeout] = {
+    "/health": httpx.Timeout(5.0, connect=_CONNECT_S),
+    "/history": httpx.Timeout(10.0, connect=_CONNECT_S),
+    "/sessions": httpx.Timeout(15.0, connect=_CONNECT_S),
+    "/rules": httpx.Timeout(15.0, connect=_CONNECT_S),
+    # BE ghi snapshot mọi sheet (parse cả workbook, tới STREAM_LOADER_MIN_MB) rồi mới trả lời
+    "/upload": httpx.Timeout(300.0, connect=_CONNECT_S),
+    "/preview": httpx.Timeout(120.0, connect=_CONNECT_S),
+    "/preview/batch": httpx.Timeout(300.0, connect=_CONNECT_S),
+    # đọc sheet + học rule bằng GPT
+    "/confirm_sections": httpx.Timeout(180.0, connect=_CONNECT_S),
+    "/chat": httpx.Timeout(120.0, connect=_CONNECT_S),
+    "/final": httpx.Timeout(300.0, connect=_CONNECT_S),
+    # stream: chỉ giới hạn thời gian chờ giữa 2 event, không giới hạn tổng
+    "/final/stream": httpx.Timeout(10.0, connect=_CONNECT_S, read=120.0),
+}
+_DEFAULT_TIMEOUT = httpx.Timeout(120.0, connect=_CONNECT_S)
+
+_client_lock = threading.Lock()
+_shared: Optional[httpx.Client] = None
+
+
+def _http2_available() -> bool:
+    if not API_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 
 def _client() -> httpx.Client:
-    return httpx.Client(timeout=120)
+    """
+    httpx.Client dùng chung cho cả process (thread-safe, pool keep-alive):
+    Streamlit chạy lại script mỗi lần tương tác nhưng module chỉ import 1 lần → không bắt tay TCP/TLS lại.
+    """
+    global _shared
+    if _shared is None:
+        with _client_lock:
+            if _shared is None:
+                _shared = httpx.Client(
+                    base_url=BASE,
+                    http2=_http2_available(),
+                    timeout=_DEFAULT_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=API_MAX_CONNECTIONS,
+                        max_keepalive_connections=API_MAX_CONNECTIONS,
+                        keepalive_expiry=API_KEEPALIVE_S,
+                    ),
+                )
+    return _shared
 
-def _post(path: str, json: Dict[str, Any] | None = None, files=None, data=None, params=None) -> Dict[str, Any]:
-    url = f"{BASE}{path}"
-    with _client() as c:
-        r = c.post(url, params=params, json=json, files=files, data=data)
-        try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError:
-            try:
-                return r.json()
-            except Exception:
-                return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+
+@atexit.register
+def close() -> None:
+    global _shared
+    with _client_lock:
+        if _shared is not None:
+            _shared.close()
+            _shared = None
+
+
+def _timeout_for(path: str) -> httpx.Timeout:
+    best = ""
+    for prefix in _TIMEOUTS:
+        if path.startswith(prefix) and len(prefix) > len(best):
+            best = prefix
+    return _TIMEOUTS[best] if best else _DEFAULT_TIMEOUT
+
+
+def _send(method: str, path: str, **kwargs) -> httpx.Response:
+    return _client().request(method, path, timeout=_timeout_for(path), **kwargs)
+
+
+def _timeout_error(path: str, e: httpx.TimeoutException) -> Dict[str, Any]:
+    return {"ok": False, "code": "TIMEOUT", "error": f"{path}: BE không trả lời kịp ({type(e).__name__})"}
+
+
+def _post(path: str, json: Dict[str, Any] | None = None, files=None, data=None, params=None, content=None, headers=None) -> Dict[str, Any]:
+    try:
+        r = _send("POST", path, params=params, json=json, files=files, data=data, content=content, headers=headers)
+    except httpx.TimeoutException as e:
+        return _timeout_error(path, e)
+    try:
+        r.raise_for_status()
+    except httpx.HTTPStatusError:
         try:
-            parsed = r.json()
-            if isinstance(parsed, dict):
-                parsed.setdefault("ok", True)
-            return parsed
+            return r.json()
         except Exception:
-            return {"ok": True, "code": "NO_JSON", "data": None}
+            return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+    try:
+        parsed = r.json()
+        if isinstance(parsed, dict):
+            parsed.setdefault("ok", True)
+        return parsed
+    except Exception:
+        return {"ok": True, "code": "NO_JSON", "data": None}
 
 def _get(path: str) -> Dict[str, Any]:
-    url = f"{BASE}{path}"
-    with _client() as c:
-        r = c.get(url)
+    try:
+        r = _send("GET", path)
+    except httpx.TimeoutException as e:
+        return _timeout_error(path, e)
+    try:
+        r.raise_for_status()
+    except httpx.HTTPStatusError:
         try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError:
-            try:
-                return r.json()
-            except Exception:
-                return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+            return r.json()
+        except Exception:
+            return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+    try:
+        return r.json()
+    except Exception:
+        return {"ok": False, "code": "BAD_JSON", "error": r.text}
+
+def _put(path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    try:
+        r = _send("PUT", path, json=json)
+    except httpx.TimeoutException as e:
+        return _timeout_error(path, e)
+    try:
+        r.raise_for_status()
+    except httpx.HTTPStatusError:
         try:
             return r.json()
         except Exception:
-            return {"ok": False, "code": "BAD_JSON", "error": r.text}
+            return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+    try:
+        return r.json()
+    except Exception:
+        return {"ok": False, "code": "BAD_JSON", "error": r.text}
 
 def _delete(path: str) -> Dict[str, Any]:
-    url = f"{BASE}{path}"
-    with _client() as c:
-        r = c.delete(url)
-        try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError:
-            try:
-                return r.json()
-            except Exception:
-                return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+    try:
+        r = _send("DELETE", path)
+    except httpx.TimeoutException as e:
+        return _timeout_error(path, e)
+    try:
+        r.raise_for_status()
+    except httpx.HTTPStatusError:
         try:
             return r.json()
         except Exception:
-            return {"ok": False, "code": "BAD_JSON", "error": r.text}
+            return {"ok": False, "code": "HTTP_ERROR", "error": r.text}
+    try:
+        return r.json()
+    except Exception:
+        return {"ok": False, "code": "BAD_JSON", "error": r.text}
 
 
 
 def upload_file(file, user_id: str = "default_user", sheet_name: Optional[str] = None) -> Dict[str, Any]:
     filename = getattr(file, "name", "upload.bin")
     data_bytes = file.getvalue()   # KHÔNG dùng getbuffer()
-    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-    files = {"file": (filename, data_bytes, content_type)}
-    form = {"user_id": user_id}
-    if sheet_name:
-        form["sheet_name"] = sheet_name
-    return _post("/upload", files=files, data=form)
+    # Gửi body thô tới /upload/raw: BE đọc theo chunk, không phải spool + parse multipart
+    params = {"filename": filename, "user_id": user_id}
+    return _post("/upload/raw", params=params, content=data_bytes,
+                 headers={"Content-Type": "application/octet-stream"})
 
 def preview(session_id: str, user_id: Optional[str] = None, sheet_name: Optional[str] = None) -> Dict[str, Any]:
     form: Dict[str, Any] = {"session_id": session_id, "id": session_id}
@@ -82,6 +187,55 @@ def preview(session_id: str, user_id: Optional[str] = None, sheet_name: Optional
         form["sheet_name"] = sheet_name
     return _post("/preview", data=form)
 
+def preview_batch(session_id: str, user_id: Optional[str] = None, sheet_names: Optional[List[str]] = None,
+                  parallel: bool = False) -> Dict[str, Any]:
+    """Preview mọi sheet (hoặc sheet_names) trong 1 request."""
+    form: Dict[str, Any] = {"session_id": session_id, "parallel": str(bool(parallel)).lower()}
+    if user_id:
+        form["user_id"] = user_id
+    if sheet_names:
+        form["sheet_names"] = _json.dumps(sheet_names, ensure_ascii=False)
+    return _post("/preview/batch", data=form)
+
+# Version hợp đồng confirm mà client này hiểu (khớp CONFIRM_PROTOCOL_VERSION của BE)
+CONFIRM_PROTOCOLS = (1,)
+# BE cũ không quảng bá protocols ở /health: dùng shape JSON mà ConfirmRequest luôn nhận
+_CONFIRM_FALLBACK: Dict[str, Any] = {
+    "version": None,
+    "path": "/confirm_sections",
+    "header": None,
+    "schema": {"properties": {"session_id": {}, "user_id": {}, "sheet_name": {}, "sections": {}}},
+}
+_protocol_lock = threading.Lock()
+_confirm_proto: Optional[Dict[str, Any]] = None
+
+
+def confirm_protocol(refresh: bool = False) -> Dict[str, Any]:
+    """
+    Hợp đồng /confirm_sections do BE quảng bá ở /health (protocols.confirm_sections),
+    đọc 1 lần cho cả process. /health lỗi → không cache, lần sau hỏi lại.
+    """
+    global _confirm_proto
+    if _confirm_proto is not None and not refresh:
+        return _confirm_proto
+    with _protocol_lock:
+        if _confirm_proto is not None and not refresh:
+            return _confirm_proto
+        try:
+            h = health()
+        except httpx.HTTPError:
+            return _CONFIRM_FALLBACK
+        proto = ((h.get("protocols") or {}).get("confirm_sections")) if isinstance(h, dict) else None
+        if isinstance(proto, dict) and proto.get("version") in CONFIRM_PROTOCOLS:
+            _confirm_proto = proto
+        elif isinstance(h, dict) and h.get("ok"):
+            # BE cũ (không có protocols) hoặc version lạ → shape JSON mặc định, không đoán thêm
+            _confirm_proto = _CONFIRM_FALLBACK
+        else:
+            return _CONFIRM_FALLBACK
+    return _confirm_proto
+
+
 def confirm_sections(
     session_id: str,
     sections: List[Dict[str, Any]],
@@ -89,54 +243,27 @@ def confirm_sections(
     sheet_name: Optional[str] = None
 ) -> Dict[str, Any]:
     """
-    Gửi xác nhận sections với các fallback để tương thích mọi BE:
-      Try A: data + params đồng thời (Form + Query), sections là JSON string (Form)
-      Try B: params + JSON body {"sections":[...]}
-      Try C: pure JSON body (session_id, sections, user_id?, sheet_name?)
+    Gửi xác nhận sections bằng ĐÚNG 1 request JSON theo hợp đồng BE quảng bá ở /health
+    (chỉ gửi các field có trong schema; kèm header version để BE từ chối rõ ràng nếu lệch).
     Thành công nếu ok=True OR có message/data OR 2xx không JSON.
     """
-    import json as _json
     sid = (str(session_id) if session_id is not None else "").strip()
     if not sid:
         return {"ok": False, "code": "MISSING_SESSION_ID", "error": "session_id trống ở FE"}
 
-    
-    formA: Dict[str, Any] = {
-        "session_id": sid,
-        "id": sid,  # alias phổ biến
-        "sections": _json.dumps(sections),  # JSON string trong form
-    }
-    if user_id:
-        formA["user_id"] = user_id
-    if sheet_name:
-        formA["sheet_name"] = sheet_name
-
-    paramsA: Dict[str, Any] = {
-        "session_id": sid,
-        "id": sid,
-    }
+    proto = confirm_protocol()
+    fields = (proto.get("schema") or {}).get("properties") or {}
+    body: Dict[str, Any] = {"session_id": sid, "sections": sections}
     if user_id:
-        paramsA["user_id"] = user_id
+        body["user_id"] = user_id
     if sheet_name:
-        paramsA["sheet_name"] = sheet_name
+        body["sheet_name"] = sheet_name
+    if fields:
+        body = {k: v for k, v in body.items() if k in fields}
 
-    rA = _post("/confirm_sections", data=formA, params=paramsA)
-    if isinstance(rA, dict) and (rA.get("ok") is True or "message" in rA or "data" in rA):
-        return rA
-
-    
-    rB = _post("/confirm_sections", params=paramsA, json={"sections": sections})
-    if isinstance(rB, dict) and (rB.get("ok") is True or "message" in rB or "data" in rB):
-        return rB
-
-    
-    bodyC: Dict[str, Any] = {"session_id": sid, "id": sid, "sections": sections}
-    if user_id:
-        bodyC["user_id"] = user_id
-    if sheet_name:
-        bodyC["sheet_name"] = sheet_name
-    rC = _post("/confirm_sections", json=bodyC)
-    return rC if isinstance(rC, dict) else {"ok": False, "code": "NO_VALID_RESPONSE", "error": str(rC)}
+    headers = {proto["header"]: str(proto["version"])} if proto.get("header") else None
+    r = _post(proto.get("path") or "/confirm_sections", json=body, headers=headers)
+    return r if isinstance(r, dict) else {"ok": False, "code": "NO_VALID_RESPONSE", "error": str(r)}
 
 
 def chat(session_id: str, message: str, sheet_name: Optional[str] = None) -> Dict[str, Any]:
@@ -153,6 +280,33 @@ def run_final(session_id: str, user_id: str, sheet_name: Optional[str] = None) -
         payload["sheet_name"] = sheet_name
     return _post("/final", json=payload)
 
+def run_final_stream(session_id: str, user_id: str, sheet_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Gọi /final/stream (NDJSON), yield từng event ngay khi BE gửi:
+      start, section, analysis, report_token, export, done (hoặc error).
+    Không giới hạn thời gian đọc toàn bộ; chỉ giới hạn thời gian chờ giữa 2 event.
+    """
+    sid = (str(session_id) if session_id is not None else "").strip()
+    payload: Dict[str, Any] = {"session_id": sid, "user_id": user_id}
+    if sheet_name:
+        payload["sheet_name"] = sheet_name
+    path = "/final/stream"
+    try:
+        with _client().stream("POST", path, json=payload, timeout=_timeout_for(path)) as r:
+            if r.status_code >= 400:
+                r.read()
+                try:
+                    body = r.json()
+                except Exception:
+                    body = {"error": r.text}
+                yield {"event": "error", "ok": False, "code": "HTTP_ERROR", **body}
+                return
+            for line in r.iter_lines():
+                if line.strip():
+                    yield _json.loads(line)
+    except httpx.TimeoutException as e:
+        yield {"event": "error", **_timeout_error(path, e)}
+
 def get_history(user_id: str) -> Dict[str, Any]:
     return _get(f"/history/{user_id}")
 
@@ -168,22 +322,13 @@ def save_rule(user_id: str, sheet_name: Optional[str], sections: List[Dict[str,
 
 
 def sections_get(session_id: str) -> dict:
-    with _client() as c:
-        r = c.get(f"{BASE}/sessions/{session_id}/sections")
-        return _json.loads(r.text)
+    return _get(f"/sessions/{session_id}/sections")
 
 def sections_replace(session_id: str, sections: list[dict]) -> dict:
-    with _client() as c:
-        r = c.put(f"{BASE}/sessions/{session_id}/sections", json={"sections": sections})
-        return _json.loads(r.text)
+    return _put(f"/sessions/{session_id}/sections", json={"sections": sections})
 
 def sections_add(session_id: str, section: dict) -> dict:
-    with _client() as c:
-        r = c.post(f"{BASE}/sessions/{session_id}/sections", json=section)
-        return _json.loads(r.text)
+    return _post(f"/sessions/{session_id}/sections", json=section)
 
 def sections_delete(session_id: str, index: int) -> dict:
-    with _client() as c:
-        r = c.delete(f"{BASE}/sessions/{session_id}/sections/{index}")
-        return _json.loads(r.text)
-
+    return _delete(f"/sessions/{session_id}/sections/{index}")
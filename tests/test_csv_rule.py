@@ -0,0 +1,48 @@
+"""
+CSV: rule lưu lúc /confirm_sections phải được /preview tìm lại (cùng fingerprint header=None).
+Chạy: python -m pytest -q tests
+"""
+import importlib
+import sys
+
+import pytest
+
+
+@pytest.fixture()
+def client(tmp_path, monkeypatch):
+    # mọi DB / thư mục đều tương đối theo cwd → chạy trong thư mục tạm, LLM offline
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LLM_OFFLINE", "1")
+    monkeypatch.syspath_prepend(str(__import__("pathlib").Path(__file__).resolve().parents[1]))
+    for name in [m for m in sys.modules if m == "main" or m.split(".")[0] in ("common", "controllers", "data_processing", "services")]:
+        del sys.modules[name]
+    main = importlib.import_module("main")
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as c:
+        yield c
+
+
+def test_confirmed_csv_rule_is_used_by_preview(client, tmp_path):
+    rows = ["Bảng doanh thu,", "Tên,Số lượng"] + [f"sp{i},{i}" for i in range(20)]
+    csv_path = tmp_path / "sales.csv"
+    csv_path.write_text("\n".join(rows) + "\n", encoding="utf-8")
+
+    with open(csv_path, "rb") as f:
+        up = client.post("/upload", files={"file": ("sales.csv", f, "text/csv")})
+    assert up.status_code == 200, up.text
+    sid = up.json()["data"]["session_id"]
+
+    first = client.post("/preview", data={"session_id": sid, "user_id": "u1"}).json()
+    assert first["ok"] and not first["data"]["used_rule"]
+
+    sections = [{"header_row": 1, "start_row": 2, "end_row": 21, "label": "Doanh thu"}]
+    conf = client.post("/confirm_sections", json={"session_id": sid, "user_id": "u1", "sections": sections})
+    assert conf.status_code == 200, conf.text
+    assert conf.json()["ok"]
+
+    again = client.post("/preview", data={"session_id": sid, "user_id": "u1"}).json()
+    assert again["ok"]
+    assert again["data"]["used_rule"] is True
+    assert again["data"]["match_score"] == 1.0
+    assert again["data"]["sections"][0]["start_row"] == 2